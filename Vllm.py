@@ -1,8 +1,19 @@
-import requests
+import json
+import threading
+from functools import cached_property
+
+import deadline
 from base import Base
+from config import deadline_config
+from exceptions import DeadlineExceeded
+from tracing import record_llm_call, record_usage
 
 
 class Vllm(Base):
+    # 进程内正在等待 vLLM 返回的请求数，服务端据此做背压
+    in_flight = 0
+    in_flight_lock = threading.Lock()
+
     def __init__(self, config=None):
         super().__init__(config)
         if config is None or "vllm_host" not in config:
@@ -19,6 +30,17 @@ class Vllm(Base):
             self.auth_key = config["auth-key"]
         else:
             self.auth_key = None
+        self.llm_timeout = deadline_config.get("llm_timeout")
+
+    @cached_property
+    def session(self):
+        """复用 HTTP 连接，fork 出的实例共享；首次请求时才导入 requests"""
+        import requests
+        return requests.Session()
+
+    def warmup(self):
+        super().warmup()
+        self.session
 
     def system_message(self, message: str) -> any:
         return {"role": "system", "content": message}
@@ -29,110 +51,103 @@ class Vllm(Base):
     def assistant_message(self, message: str) -> any:
         return {"role": "assistant", "content": message}
 
-    def submit_prompt(self, prompt, **kwargs) -> str:
+    def chat(self, prompt, **kwargs) -> str:
         url = f"{self.host}/v1/chat/completions"
         data = {
             "model": self.model,
             "stream": False,
             "messages": prompt,
         }
-        if self.auth_key is not None:
-            headers = {
-                'Content-Type': 'application/json',
-                'Authorization': f'Bearer {self.auth_key}'
-            }
-            response = requests.post(url, headers=headers, json=data)
-        else:
-            response = requests.post(url, json=data)
+        deadline.check("llm")
+        record_llm_call()
+        with Vllm.in_flight_lock:
+            Vllm.in_flight += 1
+        try:
+            # 超时后断开连接，vLLM 随之中止该请求的生成
+            timeout = deadline.timeout(self.llm_timeout)
+            if self.auth_key is not None:
+                headers = {
+                    'Content-Type': 'application/json',
+                    'Authorization': f'Bearer {self.auth_key}'
+                }
+                response = self.session.post(url, headers=headers, json=data, timeout=timeout)
+            else:
+                response = self.session.post(url, json=data, timeout=timeout)
+        except Exception as e:
+            if deadline.expired():
+                raise DeadlineExceeded("llm") from e
+            raise
+        finally:
+            with Vllm.in_flight_lock:
+                Vllm.in_flight -= 1
         response_dict = response.json()
+        record_usage(response_dict.get("usage"))
         return response_dict['choices'][0]['message']['content']
 
-    def submit_semantic_prompt(self, prompt, **kwargs) -> str:
+    def stream_chat(self, prompt, **kwargs):
+        """以 SSE 方式请求 /v1/chat/completions，逐段返回生成的内容；调用方提前停止迭代时关闭连接"""
         url = f"{self.host}/v1/chat/completions"
         data = {
             "model": self.model,
-            "stream": False,
+            "stream": True,
+            "stream_options": {"include_usage": True},
             "messages": prompt,
         }
+        headers = {'Content-Type': 'application/json'}
         if self.auth_key is not None:
-            headers = {
-                'Content-Type': 'application/json',
-                'Authorization': f'Bearer {self.auth_key}'
-            }
-            response = requests.post(url, headers=headers, json=data)
-        else:
-            response = requests.post(url, json=data)
-        response_dict = response.json()
-        return response_dict['choices'][0]['message']['content']
+            headers['Authorization'] = f'Bearer {self.auth_key}'
+        deadline.check("llm")
+        record_llm_call()
+        with Vllm.in_flight_lock:
+            Vllm.in_flight += 1
+        try:
+            timeout = deadline.timeout(self.llm_timeout)
+            with self.session.post(url, headers=headers, json=data, stream=True, timeout=timeout) as response:
+                response.raise_for_status()
+                # 按字节分行再解码，避免未声明 charset 时中文被错误切分
+                for line in response.iter_lines():
+                    # 读超时只限制两段数据的间隔，总时长在这里检查，退出 with 时断开连接
+                    deadline.check("llm")
+                    line = line.decode("utf-8")
+                    if not line.startswith("data:"):
+                        continue
+                    payload = line[len("data:"):].strip()
+                    if payload == "[DONE]":
+                        break
+                    chunk = json.loads(payload)
+                    record_usage(chunk.get("usage"))
+                    if not chunk.get("choices"):
+                        continue
+                    content = chunk["choices"][0].get("delta", {}).get("content")
+                    if content:
+                        yield content
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            if deadline.expired():
+                raise DeadlineExceeded("llm") from e
+            raise
+        finally:
+            with Vllm.in_flight_lock:
+                Vllm.in_flight -= 1
+
+    def submit_prompt(self, prompt, **kwargs) -> str:
+        return self.chat(prompt, **kwargs)
+
+    def submit_semantic_prompt(self, prompt, **kwargs) -> str:
+        return self.chat(prompt, **kwargs)
 
     def submit_thinking_prompt(self, prompt, **kwargs) -> str:
-        url = f"{self.host}/v1/chat/completions"
-        data = {
-            "model": self.model,
-            "stream": False,
-            "messages": prompt,
-        }
-        if self.auth_key is not None:
-            headers = {
-                'Content-Type': 'application/json',
-                'Authorization': f'Bearer {self.auth_key}'
-            }
-            response = requests.post(url, headers=headers, json=data)
-        else:
-            response = requests.post(url, json=data)
-        response_dict = response.json()
-        return response_dict['choices'][0]['message']['content']
+        return self.chat(prompt, **kwargs)
 
     def submit_reflection_prompt(self, prompt, **kwargs) -> str:
-        url = f"{self.host}/v1/chat/completions"
-        data = {
-            "model": self.model,
-            "stream": False,
-            "messages": prompt,
-        }
-        if self.auth_key is not None:
-            headers = {
-                'Content-Type': 'application/json',
-                'Authorization': f'Bearer {self.auth_key}'
-            }
-            response = requests.post(url, headers=headers, json=data)
-        else:
-            response = requests.post(url, json=data)
-        response_dict = response.json()
-        return response_dict['choices'][0]['message']['content']
+        return self.chat(prompt, **kwargs)
 
     def submit_final_prompt(self, prompt):
-        url = f"{self.host}/v1/chat/completions"
-        data = {
-            "model": self.model,
-            "stream": False,
-            "messages": prompt,
-        }
-        if self.auth_key is not None:
-            headers = {
-                'Content-Type': 'application/json',
-                'Authorization': f'Bearer {self.auth_key}'
-            }
-            response = requests.post(url, headers=headers, json=data)
-        else:
-            response = requests.post(url, json=data)
-        response_dict = response.json()
-        return response_dict['choices'][0]['message']['content']
+        return self.chat(prompt)
 
     def submit_confirm_prompt(self, prompt):
-        url = f"{self.host}/v1/chat/completions"
-        data = {
-            "model": self.model,
-            "stream": False,
-            "messages": prompt,
-        }
-        if self.auth_key is not None:
-            headers = {
-                'Content-Type': 'application/json',
-                'Authorization': f'Bearer {self.auth_key}'
-            }
-            response = requests.post(url, headers=headers, json=data)
-        else:
-            response = requests.post(url, json=data)
-        response_dict = response.json()
-        return response_dict['choices'][0]['message']['content']
+        return self.chat(prompt)
+
+    def stream_final_prompt(self, prompt):
+        return self.stream_chat(prompt)
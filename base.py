@@ -2,11 +2,39 @@ import json
 from abc import ABC, abstractmethod
 from typing import List, Tuple, Union
 import logging
-from exceptions import DependencyError, ValidationError, ImproperlyConfigured
-from config import base_config
+from exceptions import DependencyError, ValidationError, ImproperlyConfigured, QueryTooExpensiveError, DeadlineExceeded, \
+    ExecutionError
+from config import base_config, rollup_config, guard_config, cache_config, drilldown_config, coalesce_config
+from slot_extractor import SlotExtractor
+from department import DepartmentIndex
+from rollup import RollupBuilder, QueryRouter
+from query_guard import QueryGuard
+from result_cache import ResultCache, make_version_provider
+from drilldown import ResultReuse
+from sql_utils import normalize_sql
+from coalesce import normalize_question, question_flight, answer_flight, sql_flight
+from tracing import span, annotate, cache_lookups, sql_rows
+import deadline
+import copy
 import os
-import pandas as pd
+import queue
+import threading
+from contextlib import contextmanager
 from decimal import Decimal
+from functools import cached_property, partial
+
+def console_clarify(message: str) -> str:
+    print(message)
+    return input("请补充或确认相关信息:")
+
+
+def console_confirm(message: str) -> str:
+    return input("确认请输入：y, 补充或修改请直接输入内容:")
+
+
+def console_add_example(question: str, sql: str) -> str:
+    return input("是否添加到样例中？, 添加请输入 y，不添加请输入 n\n请输入您的选择：")
+
 
 class Base(ABC):
     def __init__(self, config=None):
@@ -22,19 +50,95 @@ class Base(ABC):
         self.SQL_DDL_file = self.config.get("SQL_DDL_file", "")
         self.run_sql_is_set = False
         self.relation_file = self.config.get("relation_file", "")
-        self.get_extra_info()
+        # ddl_info 等说明文件、科室层级和槽位词典在首次使用时加载，见 warmup
+        self.department_info = ''
         self.times = 1
         self.semantic_flag = 1
         self.MAX_TIMES = self.config.get("MAX_TIMES", 10)
         self.MAX_SQL_ATTEMPT = self.config.get("MAX_SQL_ATTEMPT", 3)
         self.AUTO_ADD_EXAMPLES = self.config.get("AUTO_ADD_EXAMPLES", False)
+        self.SLOT_CONFIDENCE = self.config.get("SLOT_CONFIDENCE", 0.8)
+        self.MYSQL_POOL_SIZE = self.config.get("MYSQL_POOL_SIZE", 8)
+        self.slot_result = None
+        self.rollup_builder = None
+        self.query_router = None
+        self.result_reuse = ResultReuse() if drilldown_config.get("enabled") else None
+        self.last_query = None
+        # 本次提问已得到的中间结果，超时时随 DeadlineExceeded 返回
+        self.partial = {}
+        # 交互回调，服务端可替换为抛出 ClarificationRequired 等非阻塞实现
+        self.clarify_callback = console_clarify
+        self.confirm_callback = console_confirm
+        self.add_example_callback = console_add_example
+
+    def fork(self):
+        """复制出共享向量库、数据库连接池和大模型客户端的新实例，只重置单次提问的状态
+
+        每个会话或工作线程使用自己的副本，避免重复加载模型、读取文件和建立连接。
+        """
+        rag = copy.copy(self)
+        rag.reset()
+        rag.result_reuse = ResultReuse() if drilldown_config.get("enabled") else None
+        return rag
+
+    def reset(self):
+        """清空上一次提问留下的状态，实例被复用处理新的请求前调用"""
+        self.times = 1
+        self.semantic_flag = 1
+        self.slot_result = None
+        self.department_info = ''
+        self.last_query = None
+        self.partial = {}
+
+    def turn_state(self):
+        """本轮解析出的槽位、查询和思路，合并的调用把它连同结果一起交给等待者"""
+        return self.slot_result, self.last_query, self.partial.get("thinking")
+
+    def adopt_turn_state(self, state):
+        self.slot_result, self.last_query, thinking = state
+        if thinking is not None:
+            self.partial["thinking"] = thinking
+
+    def warmup(self):
+        """提前加载延迟初始化的资源，服务启动或 fork 之前调用，避免首个问题承担加载耗时"""
+        import pandas
+
+        for name in ("ddl_info", "index_info", "example_info", "document_info", "slot_extractor"):
+            getattr(self, name)
+
+    @cached_property
+    def ddl_info(self):
+        return self.get_ddl_info()
+
+    @cached_property
+    def index_info(self):
+        return self.get_index_info()
+
+    @cached_property
+    def example_info(self):
+        return self.get_example_info()
+
+    @cached_property
+    def document_info(self):
+        return self.get_document_info()
+
+    @cached_property
+    def department_index(self):
+        return DepartmentIndex.from_files()
+
+    @cached_property
+    def slot_extractor(self):
+        slot_extractor = SlotExtractor(department_index=self.department_index)
+        if self.run_sql_is_set:
+            slot_extractor.load_from_db(self.run_unguarded_sql)
+        return slot_extractor
 
     def get_extra_info(self):
         self.ddl_info = self.get_ddl_info()
         self.index_info = self.get_index_info()
         self.example_info = self.get_example_info()
         self.document_info = self.get_document_info()
-        self.relation_info = self.get_relation_info()
+        self.department_info = ''
 
     def setup_logger(self, log_file: str, name: str = __name__, level: str = "INFO"):
         logger = logging.getLogger(name)
@@ -66,6 +170,8 @@ class Base(ABC):
                 "You need to install required dependencies to execute this method,"
                 " run command: \npip install PyMySQL"
             )
+        import pandas as pd
+
         if not host:
             host = os.getenv("HOST")
 
@@ -96,45 +202,249 @@ class Base(ABC):
         if not port:
             raise ImproperlyConfigured("Please set your MySQL port")
 
-        conn = None
+        def connect():
+            try:
+                return pymysql.connect(
+                    host=host,
+                    user=user,
+                    password=password,
+                    database=dbname,
+                    port=port,
+                    cursorclass=pymysql.cursors.DictCursor,
+                    **kwargs
+                )
+            except pymysql.Error as e:
+                raise ValidationError(e)
+
+        # 连接池，fork 出的多个实例在不同线程中同时查询时各自借用一个连接
+        pool = queue.LifoQueue()
+        pool.put(connect())
+        pool_state = {"created": 1, "lock": threading.Lock()}
+
+        @contextmanager
+        def connection():
+            try:
+                conn = pool.get_nowait()
+            except queue.Empty:
+                with pool_state["lock"]:
+                    create = pool_state["created"] < self.MYSQL_POOL_SIZE
+                    if create:
+                        pool_state["created"] += 1
+                if create:
+                    try:
+                        conn = connect()
+                    except ValidationError:
+                        with pool_state["lock"]:
+                            pool_state["created"] -= 1
+                        raise
+                else:
+                    conn = pool.get()
+            try:
+                yield conn
+            finally:
+                pool.put(conn)
 
-        try:
-            conn = pymysql.connect(
-                host=host,
-                user=user,
-                password=password,
-                database=dbname,
-                port=port,
-                cursorclass=pymysql.cursors.DictCursor,
-                **kwargs
-            )
-        except pymysql.Error as e:
-            raise ValidationError(e)
+        query_guard = QueryGuard() if guard_config.get("enabled") else None
 
-        def run_sql_mysql(sql: str):
-            if conn:
+        def kill_query(thread_id: int):
+            # 执行中的连接无法自行中止，另开一个连接发送 KILL QUERY
+            try:
+                side = connect()
+                try:
+                    with side.cursor() as cs:
+                        cs.execute(f"KILL QUERY {int(thread_id)}")
+                finally:
+                    side.close()
+            except Exception as e:
+                self.log(self.logger, f"KILL QUERY {thread_id} failed:" + str(e))
+
+        def check_plan(cs, sql: str, limit: bool = True) -> str:
+            """加超时提示和默认 LIMIT 后做 EXPLAIN 预检，返回改写后的SQL，代价过高时抛出 QueryTooExpensiveError"""
+            sql = query_guard.rewrite(sql, limit)
+            cs.execute("EXPLAIN FORMAT=JSON " + sql)
+            plan = json.loads(list(cs.fetchone().values())[0])
+            query_guard.check(query_guard.inspect(sql, plan))
+            return sql
+
+        def run_sql_mysql(sql: str, guarded: bool = True):
+            deadline.check("db")
+            with span("db", guarded=guarded) as item, connection() as conn:
+                killed = None
                 try:
                     conn.ping(reconnect=True)
                     cs = conn.cursor()
-                    cs.execute(sql)
-                    results = cs.fetchall()
+                    if query_guard and guarded:
+                        sql = check_plan(cs, sql)
+                    with deadline.on_expiry(lambda: kill_query(conn.thread_id())) as killed:
+                        cs.execute(sql)
+                        results = cs.fetchall()
 
                     # Create a pandas dataframe from the results
                     df = pd.DataFrame(
                         results, columns=[desc[0] for desc in cs.description]
                     )
+                    item.set("rows", len(df))
+                    sql_rows.inc(len(df))
                     return True, df
 
+                except QueryTooExpensiveError as e:
+                    self.log(self.logger, "SQL rejected:" + str(e))
+                    item.set("rejected", True)
+                    return False, e
                 except pymysql.Error as e:
                     conn.rollback()
+                    if killed is not None and killed.is_set():
+                        item.set("killed", True)
+                        raise DeadlineExceeded("db") from e
                     # raise ValidationError(e)
+                    item.set("sql_error", str(e))
                     return False, e
                 except Exception as e:
                     conn.rollback()
+                    item.set("sql_error", str(e))
                     return False, e
 
+        def stream_sql_mysql(sql: str, chunk_rows: int = 50000):
+            """读取生成SQL的完整结果用于导出：照常做 EXPLAIN 预检、加超时提示，截止时中止查询，只是不加默认 LIMIT
+
+            用服务端游标逐块读取，产出 (列名, 行列表)，至少产出一块。
+            """
+            deadline.check("db")
+            with connection() as conn:
+                conn.ping(reconnect=True)
+                if query_guard:
+                    with conn.cursor() as cs:
+                        sql = check_plan(cs, sql, limit=False)
+                cs = conn.cursor(pymysql.cursors.SSCursor)
+                killed = None
+                try:
+                    with deadline.on_expiry(lambda: kill_query(conn.thread_id())) as killed:
+                        cs.execute(sql)
+                        columns = [desc[0] for desc in cs.description]
+                        while True:
+                            rows = cs.fetchmany(chunk_rows)
+                            yield columns, rows
+                            if len(rows) < chunk_rows:
+                                break
+                except pymysql.Error as e:
+                    if killed is not None and killed.is_set():
+                        raise DeadlineExceeded("db") from e
+                    raise
+                finally:
+                    # 未读完的行必须读掉或丢弃，连接才能放回连接池
+                    cs.close()
+
+        def execute_sql_mysql(sql: str, args=None):
+            with connection() as conn:
+                conn.ping(reconnect=True)
+                try:
+                    with conn.cursor() as cs:
+                        rows = cs.execute(sql, args)
+                    conn.commit()
+                    return rows
+                except pymysql.Error:
+                    conn.rollback()
+                    raise
+
+        self.result_cache = None
+        if cache_config.get("enabled"):
+            self.result_cache = ResultCache(make_version_provider(
+                lambda sql: run_sql_mysql(sql, guarded=False), cache_config.get("change_marker_sql")
+            ))
+
+        def run_sql_cached(sql: str, guarded: bool = True):
+            # 检查时会追加 LIMIT，两种方式的结果分开缓存
+            params = () if guarded else ("unguarded",)
+            df = self.result_cache.get(sql, params)
+            cache_lookups.inc(result="miss" if df is None else "hit")
+            annotate("cache_hit", df is not None)
+            if df is not None:
+                annotate("rows", len(df))
+                return True, df
+            y_or_n, result = run_sql_mysql(sql, guarded)
+            if y_or_n:
+                self.result_cache.put(sql, result, params)
+            return y_or_n, result
+
+        run_sql = run_sql_cached if self.result_cache else run_sql_mysql
+
+        def run_sql_coalesced(sql: str, guarded: bool = True):
+            key = ("sql:" if guarded else "unguarded_sql:") + normalize_sql(sql)
+            (y_or_n, result), shared = deadline.shared(sql_flight, key, lambda: run_sql(sql, guarded), "db")
+            annotate("coalesced", shared)
+            if shared and y_or_n:
+                result = result.copy()
+            return y_or_n, result
+
         self.run_sql_is_set = True
-        self.run_sql = run_sql_mysql
+        self.run_sql = run_sql_coalesced if coalesce_config.get("enabled") else run_sql
+        self.run_unguarded_sql = partial(self.run_sql, guarded=False)
+        self.stream_sql = stream_sql_mysql
+        self.execute_sql = execute_sql_mysql
+        if "slot_extractor" in self.__dict__:
+            self.slot_extractor.load_from_db(self.run_unguarded_sql)
+        if rollup_config.get("enabled"):
+            self.setup_rollup()
+
+    def run_unguarded_sql(self, sql: str):
+        """内部查询和导出使用，不做 EXPLAIN 检查也不追加默认 LIMIT；只有大模型生成的SQL经过检查
+
+        connect_to_mysql 会替换为不经检查的查询，其他数据源没有检查，直接使用 run_sql。
+        """
+        return self.run_sql(sql)
+
+    def stream_sql(self, sql: str, chunk_rows: int = 50000):
+        """按块产出完整查询结果 (列名, 行列表)，用于导出；connect_to_mysql 会替换为带预检的服务端游标读取"""
+        y_or_n, result = self.run_unguarded_sql(sql)
+        if not y_or_n:
+            raise ExecutionError(result)
+        columns = list(result.columns)
+        for start in range(0, max(len(result), 1), chunk_rows):
+            yield columns, list(result.iloc[start:start + chunk_rows].itertuples(index=False, name=None))
+
+    def setup_rollup(self):
+        self.rollup_builder = RollupBuilder(self.run_unguarded_sql, self.execute_sql)
+        self.rollup_builder.create()
+        # 启动时的刷新也放到后台，完成前由原表回答
+        self.rollup_builder.refresh_in_background()
+        self.query_router = QueryRouter(self.department_index)
+
+    def resolve_slots(self, question):
+        """大模型补全后的问题也尝试用规则抽取槽位，供汇总表路由和结果复用使用"""
+        if self.slot_result is None:
+            slot_result = self.slot_extractor.extract(question)
+            if slot_result.confidence >= self.SLOT_CONFIDENCE:
+                self.slot_result = slot_result
+        return self.slot_result
+
+    def reuse_result(self):
+        if self.result_reuse is None:
+            return None, None
+        with span("reuse") as item:
+            sql, df = self.result_reuse.answer(self.slot_result)
+            item.set("hit", df is not None)
+        if df is not None:
+            self.log(self.logger, "reuse:" + sql)
+        return sql, df
+
+    def run_routed_sql(self):
+        """规则抽取的问题如果能由汇总表回答，直接执行改写后的SQL"""
+        if self.query_router is None or self.slot_result is None:
+            return None, None
+        sql = self.query_router.route(self.slot_result)
+        if sql is None:
+            return None, None
+        with span("rollup") as item:
+            fresh = self.rollup_builder.ensure_fresh()
+            item.set("fresh", fresh)
+            if not fresh:
+                return None, None
+            y_or_n, result = self.run_unguarded_sql(sql)
+        if not y_or_n:
+            self.log(self.logger, "rollup SQL error:" + str(result))
+            return None, None
+        return sql, result
+
     def get_index_info(self):
         index_file_path = os.path.join(self.prefix_dir, self.index_file)
         if os.path.isfile(index_file_path):
@@ -205,6 +515,12 @@ class Base(ABC):
             print(f"文件 {relation_file_path} 不存在。")
         return relation_info
 
+    def get_department_info(self, question, semantic_result):
+        departments = self.department_index.find(semantic_result) or self.department_index.find(question)
+        if not departments:
+            departments = [self.slot_extractor.default_department]
+        return self.department_index.describe(departments)
+
     def get_semantic_prompt(self, question, initial_semantic_prompt: str = None, reget_info:str = ''):
         if initial_semantic_prompt is None:
             initial_semantic_prompt = f'''
@@ -243,13 +559,35 @@ class Base(ABC):
             confirm_prompt = [self.system_message(confirm_initial_prompt), self.user_message(semantic_result)]
             return confirm_prompt
 
+    def extract_slots(self, question):
+        """本地规则抽取语义槽位，置信度不足时返回None，交由大模型处理"""
+        with span("slots") as item:
+            slot_result = self.slot_extractor.extract(question)
+            item.set("confidence", slot_result.confidence)
+        if slot_result.confidence < self.SLOT_CONFIDENCE:
+            return None
+        self.slot_result = slot_result
+        self.log(self.logger, "question:" + slot_result.question)
+        self.log(self.logger, "semantic(rule):" + json.dumps(slot_result.to_semantic(), ensure_ascii=False))
+        return slot_result.question, str(slot_result.slots)
+
     def confirm_quesiton(self, question, reget_info: str = '', need_confirm:str = False):
+        self.slot_result = None
+        if not reget_info and not need_confirm:
+            extracted = self.extract_slots(question)
+            if extracted:
+                print("semantic_result", extracted[1])
+                return extracted
         flag = False
         while not flag:
+            deadline.check("semantic")
             semantic_prompt = self.get_semantic_prompt(question, reget_info=reget_info)
             try:
-                semantic_ini = self.submit_semantic_prompt(semantic_prompt)
+                with span("semantic"):
+                    semantic_ini = self.submit_semantic_prompt(semantic_prompt)
                 semantic = json.loads(semantic_ini)
+            except DeadlineExceeded:
+                raise
             except Exception as e:
                 continue
             if semantic["Done"] == "True":
@@ -258,10 +596,11 @@ class Base(ABC):
                 print("semantic_result", semantic_result)
                 confirm_prompt = self.get_confirm_prompt(semantic_result)
                 try:
-                    confirm = self.submit_confirm_prompt(confirm_prompt)
+                    with span("confirm"):
+                        confirm = self.submit_confirm_prompt(confirm_prompt)
                     print(confirm)
                     if need_confirm :
-                        reget_info = input("确认请输入：y, 补充或修改请直接输入内容:")
+                        reget_info = self.confirm_callback(confirm)
                     else:
                         reget_info = "y"
                     if reget_info == "y":
@@ -271,11 +610,12 @@ class Base(ABC):
                         return question, semantic_result
                     else:
                         continue
+                except DeadlineExceeded:
+                    raise
                 except Exception as e:
                     continue
             else:
-                print(semantic["result"])
-                reget_info = input("请补充或确认相关信息:")
+                reget_info = self.clarify_callback(str(semantic["result"]))
                 continue
 
     def get_thinking_prompt(self, question, semantic: str = None):
@@ -292,8 +632,8 @@ class Base(ABC):
                 {self.example_info}
             ## 4. document_info:该部分为补充信息，必须重点关注
                 {self.document_info}
-            ## 5. relation_info: 该部分为科室的关系树，用户帮助你梳理科室之间的关系
-                {self.relation_info}
+            ## 5. department_info: 该部分为问题涉及科室的筛选条件，科室过滤必须直接使用，不要自行展开科室
+                {self.department_info}
         # 回答指南：
             1. 根据用户的问题question和semantic，从以上中提取出最相关的信息, 并以此说明你解决此问题的思路
                 思路应尽量简洁,如果有复杂问题，可将问题进行分解。
@@ -324,8 +664,8 @@ class Base(ABC):
                 {self.example_info}
             ## 补充信息:
                 {self.document_info}
-            ## 关系树:
-                {self.relation_info}
+            ## 科室筛选条件（必须原样使用）:
+                {self.department_info}
             ## 解决问题专家的建议
                 {thingking}
             ## 用户问题：
@@ -355,8 +695,8 @@ class Base(ABC):
                 {self.example_info}
             ## 补充信息:
                 {self.document_info}
-            ## 关系树:
-                {self.relation_info}
+            ## 科室筛选条件（必须原样使用）:
+                {self.department_info}
             ## 解决问题专家的建议:
                 {thinking}
             ## 用户问题：
@@ -390,71 +730,211 @@ class Base(ABC):
 
 
 
-    def ask(self, question):
-        while self.times <= self.MAX_TIMES:
-            question, semantic_result = self.confirm_quesiton(question)
-            thinking = self.get_thinking_prompt(question, semantic_result)
+    def generate_sql(self, question, semantic_result):
+        thinking = self.get_thinking_prompt(question, semantic_result)
+        with span("thinking"):
             thinking_result = self.submit_thinking_prompt(thinking)
-            self.log(self.logger, "thinking:" + thinking_result)
-            try:
-                thinking_result = json.loads(thinking_result)
-            except Exception as e:
-                print(e)
-                self.times += 1
-                continue
-            if thinking_result["Done"] == "False":
-                print("thinking_result:", thinking_result["res"])
-                self.times += 1
-            else:
-                thinking_result = thinking_result["res"]
-                print("thinking_result:", thinking_result)
-            sql_attempt = 1
-            error = ''
-            while sql_attempt <= self.MAX_SQL_ATTEMPT:
+        self.log(self.logger, "thinking:" + thinking_result)
+        try:
+            thinking_result = json.loads(thinking_result)
+        except Exception as e:
+            print(e)
+            return None, None
+        if thinking_result["Done"] == "False":
+            print("thinking_result:", thinking_result["res"])
+            self.times += 1
+        else:
+            thinking_result = thinking_result["res"]
+            print("thinking_result:", thinking_result)
+        self.partial["thinking"] = thinking_result
+        sql_attempt = 1
+        error = ''
+        while sql_attempt <= self.MAX_SQL_ATTEMPT:
+            deadline.check("sql_attempt")
+            with span("sql_attempt", attempt=sql_attempt) as item:
                 sql_prompt = self.get_sql_prompt(question, thinking_result, error)
-                sql = self.submit_prompt(sql_prompt)
+                with span("sql_generate"):
+                    sql = self.submit_prompt(sql_prompt)
                 print("initial_sql:", sql)
+                self.partial["sql"] = sql
 
                 # reflection_prompt = self.get_reflection_prompt(question, thinking_result, sql)
                 # sql = self.submit_reflection_prompt(reflection_prompt)
                 # print("reflection:", sql)
 
                 y_or_n, run_sql_result,  = self.run_sql(sql)
-                if not y_or_n:
-                    error = run_sql_result
-                    self.log(self.logger, "SQL:" + sql)
-                    self.log(self.logger, "SQL error:" + str(error))
-                    print(f"第{sql_attempt} 次运行SQL失败， 进行下一次尝试")
-                    sql_attempt += 1
-                    continue
-                break
-            if not isinstance(run_sql_result, pd.DataFrame):
-                if not run_sql_result:
-                    self.times += 1
-                    continue
+                item.set("ok", y_or_n)
+            if not y_or_n:
+                error = run_sql_result
+                self.log(self.logger, "SQL:" + sql)
+                self.log(self.logger, "SQL error:" + str(error))
+                print(f"第{sql_attempt} 次运行SQL失败， 进行下一次尝试")
+                sql_attempt += 1
+                continue
+            break
+        return sql, run_sql_result
+
+    def ask(self, question, reget_info: str = '', timeout: float = None, cancel=None, budget: float = None):
+        """相同问题并发提问时只执行一次流水线，其余调用等待并共享结果
+
+        budget 为本次提问的总时长(秒)，默认取 deadline_config；超时抛出 DeadlineExceeded，
+        其 partial 中带有已生成的SQL、查询结果等中间结果。
+        """
+        with span("ask", question=question) as item, deadline.budget(budget):
+            if not coalesce_config.get("enabled"):
+                return self._ask(question, reget_info)
+            if timeout is None:
+                timeout = coalesce_config.get("wait_timeout")
+            key = "question:" + normalize_question(question + reget_info)
+            (result, state), shared = deadline.shared(
+                question_flight, key, lambda: (self._ask(question, reget_info), self.turn_state()), "coalesce",
+                timeout, cancel)
+            item.set("coalesced", shared)
+            if shared:
+                # 等待者没有执行查询，用执行者的槽位和查询，以免多轮对话记住本实例上一次的查询
+                self.partial = {}
+                self.adopt_turn_state(state)
+                self.log(self.logger, "coalesced question:" + question)
+            return result
+
+    def _ask(self, question, reget_info: str = ''):
+        self.partial = {}
+        try:
+            return self._ask_loop(question, reget_info)
+        except DeadlineExceeded as e:
+            self.timed_out(e)
+            raise
+
+    def timed_out(self, error: DeadlineExceeded):
+        if not error.partial:
+            error.partial = dict(self.partial)
+        self.times = 1
+        self.log(self.logger, f"deadline exceeded at {error.stage}, partial: {list(error.partial)}")
+
+    def _ask_loop(self, question, reget_info: str = ''):
+        while self.times <= self.MAX_TIMES:
+            deadline.check("ask")
+            question, semantic_result = self.confirm_quesiton(question, reget_info)
+            reget_info = ''
+            self.partial.update(question=question, semantic=semantic_result)
+            self.department_info = self.get_department_info(question, semantic_result)
+            self.resolve_slots(question)
+            if self.slot_result is not None and coalesce_config.get("enabled"):
+                # 规则槽位会丢掉部分限定条件，键中同时带上确认后的问题
+                key = "answer:" + json.dumps([normalize_question(question), self.slot_result.slots],
+                                             ensure_ascii=False, sort_keys=True)
+                (result, state), shared = deadline.shared(
+                    answer_flight, key, lambda: (self.answer(question, semantic_result), self.turn_state()), "coalesce")
+                if shared:
+                    self.adopt_turn_state(state)
+            else:
+                result = self.answer(question, semantic_result)
+            if result is None:
                 self.times += 1
+                annotate("retries", self.times - 1)
                 continue
+            self.times = 1
+            return result
+
+    def answer(self, question, semantic_result):
+        """语义确定后的查询和回答阶段，失败时返回None"""
+        import pandas as pd
 
-            self.log(self.logger, "sql:" + sql)
-            # self.log(self.logger, "reflection:" + reflection)
-            print("result:", run_sql_result)
-            sql_result = run_sql_result.to_dict()
-            converted_dict = {key: {k: float(v) if isinstance(v, Decimal) else v for k, v in value.items()} for
-                              key, value in sql_result.items()}
-            sql_result = json.dumps(converted_dict, ensure_ascii=False)
-            self.log(self.logger, "sql_result:" + sql_result)
-            final_prompt = self.get_final_prompt(question, sql_result)
+        sql, run_sql_result, source = self.query(question, semantic_result)
+        if not isinstance(run_sql_result, pd.DataFrame):
+            return None
+        final_prompt = self.get_answer_prompt(question, sql, run_sql_result)
+        with span("final", source=source):
             result = self.submit_final_prompt(final_prompt)
-            self.log(self.logger, "查询结果:" + result)
-            print("查询结果:", result)
-            self.times = 1
+        self.finish_answer(question, sql, result, source)
+        return result
+
+    def query(self, question, semantic_result):
+        """依次尝试复用已有结果、汇总表路由和大模型生成SQL，返回 (SQL, 结果, 来源)"""
+        import pandas as pd
+
+        sql, run_sql_result = self.reuse_result()
+        source = "reuse"
+        if run_sql_result is None:
+            sql, run_sql_result = self.run_routed_sql()
+            source = "rollup"
+        if sql is None:
+            sql, run_sql_result = self.generate_sql(question, semantic_result)
+            source = "generated"
+        if source != "reuse" and isinstance(run_sql_result, pd.DataFrame) and self.result_reuse is not None:
+            self.result_reuse.remember(self.slot_result, sql, run_sql_result)
+        # 最近一次查询，供评估等场景对比结果
+        self.last_query = (sql, run_sql_result, source)
+        if isinstance(run_sql_result, pd.DataFrame):
+            self.partial.update(sql=sql, result=run_sql_result, source=source)
+        return sql, run_sql_result, source
+
+    def get_answer_prompt(self, question, sql, run_sql_result):
+        self.log(self.logger, "sql:" + sql)
+        # self.log(self.logger, "reflection:" + reflection)
+        print("result:", run_sql_result)
+        sql_result = run_sql_result.to_dict()
+        converted_dict = {key: {k: float(v) if isinstance(v, Decimal) else v for k, v in value.items()} for
+                          key, value in sql_result.items()}
+        sql_result = json.dumps(converted_dict, ensure_ascii=False)
+        self.log(self.logger, "sql_result:" + sql_result)
+        return self.get_final_prompt(question, sql_result)
+
+    def finish_answer(self, question, sql, result, source):
+        self.log(self.logger, "查询结果:" + result)
+        print("查询结果:", result)
+        if source == "generated":
             self.auto_add_examples(question, sql, auto=self.AUTO_ADD_EXAMPLES)
-            return result
+
+    def ask_stream(self, question, reget_info: str = '', budget: float = None):
+        """逐阶段产出进度事件，最后流式产出回答内容
+
+        事件为字典，stage 依次为 semantic、sql、rows、token（多次）、done；
+        调用方停止迭代即可中止本次提问。流式提问不参与相同问题合并。
+        超时抛出 DeadlineExceeded，此前已产出的事件即为部分结果。
+        """
+        self.partial = {}
+        with span("ask", question=question, stream=True), deadline.budget(budget):
+            try:
+                yield from self._ask_stream(question, reget_info)
+            except DeadlineExceeded as e:
+                self.timed_out(e)
+                raise
+
+    def _ask_stream(self, question, reget_info: str = ''):
+        import pandas as pd
+
+        while self.times <= self.MAX_TIMES:
+            deadline.check("ask")
+            question, semantic_result = self.confirm_quesiton(question, reget_info)
+            reget_info = ''
+            self.partial.update(question=question, semantic=semantic_result)
+            yield {"stage": "semantic", "question": question, "semantic": semantic_result}
+            self.department_info = self.get_department_info(question, semantic_result)
+            self.resolve_slots(question)
+            sql, run_sql_result, source = self.query(question, semantic_result)
+            if not isinstance(run_sql_result, pd.DataFrame):
+                self.times += 1
+                continue
+            yield {"stage": "sql", "sql": sql, "source": source}
+            yield {"stage": "rows", "rows": len(run_sql_result), "result": run_sql_result}
+            final_prompt = self.get_answer_prompt(question, sql, run_sql_result)
+            parts = []
+            with span("final", source=source, stream=True):
+                for token in self.stream_final_prompt(final_prompt):
+                    parts.append(token)
+                    yield {"stage": "token", "text": token}
+            result = "".join(parts)
+            self.finish_answer(question, sql, result, source)
+            self.times = 1
+            yield {"stage": "done", "answer": result}
+            return
+
     def auto_add_examples(self, question, sql, auto = False):
         if auto:
             self.add_example(question, sql)
             return "Auto Added"
-        add_or_no = input("是否添加到样例中？, 添加请输入 y，不添加请输入 n\n请输入您的选择：")
+        add_or_no = self.add_example_callback(question, sql)
         print("您的选择是:", add_or_no)
         if add_or_no == "y":
             self.add_example(question, sql)
@@ -488,6 +968,10 @@ class Base(ABC):
     def submit_final_prompt(self, final_prompt: List):
         pass
 
+    @abstractmethod
+    def stream_final_prompt(self, final_prompt: List):
+        pass
+
     @abstractmethod
     def submit_confirm_prompt(self, final_prompt: List):
         pass
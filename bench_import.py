@@ -0,0 +1,77 @@
+import argparse
+import re
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+# 模块 -> 导入耗时预算(毫秒)
+BUDGETS = {
+    "rag_sql": 150,
+    "base": 100,
+}
+# 导入阶段不应加载的重依赖，应在首次使用或 warmup 时加载
+FORBIDDEN = ["pandas", "numpy", "chromadb", "onnxruntime", "requests", "pymysql"]
+
+IMPORTTIME_RE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def measure(module: str) -> Tuple[float, List[Tuple[int, str]], List[str]]:
+    """在新进程中用 -X importtime 导入模块，返回 (总耗时毫秒, [(累计微秒, 子模块)], 已加载的模块)"""
+    code = f"import sys, {module}; print('\\n'.join(sys.modules))"
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(proc.stderr.strip().splitlines()[-1])
+    entries = []
+    for line in proc.stderr.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        if match:
+            entries.append((int(match.group(2)), len(match.group(3)), match.group(4)))
+    # importtime 先输出子模块再输出父模块，向前取缩进更深的连续行即为该模块导入的子模块
+    index = next((i for i, e in enumerate(entries) if e[2] == module), None)
+    if index is None:
+        return 0.0, [], proc.stdout.split()
+    total, depth = entries[index][0], entries[index][1]
+    children = []
+    for us, indent, name in reversed(entries[:index]):
+        if indent <= depth:
+            break
+        children.append((us, name))
+    return total / 1000, children, proc.stdout.split()
+
+
+def run(budgets: Dict[str, float], repeat: int, top: int) -> bool:
+    ok = True
+    for module, budget in budgets.items():
+        # 取多次中的最小值，减少磁盘缓存等因素的干扰
+        try:
+            results = [measure(module) for _ in range(repeat)]
+        except RuntimeError as e:
+            print(f"{module}: 导入失败 {e}")
+            ok = False
+            continue
+        total, entries, loaded = min(results, key=lambda r: r[0])
+        heavy = [name for name in FORBIDDEN if name in loaded]
+        passed = total <= budget and not heavy
+        ok = ok and passed
+        print(f"{module}: {total:.1f} ms (预算 {budget} ms) {'OK' if passed else 'FAIL'}")
+        if heavy:
+            print("  导入阶段加载了重依赖: " + ", ".join(heavy))
+        for us, name in sorted(entries, reverse=True)[:top]:
+            print(f"  {us / 1000:8.1f} ms  {name}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="检查模块导入耗时是否超出预算")
+    parser.add_argument("modules", nargs="*", help="要检查的模块，默认检查 BUDGETS 中的全部模块")
+    parser.add_argument("--budget", type=float, help="覆盖预算(毫秒)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=5, help="列出耗时最多的子模块数")
+    args = parser.parse_args()
+    modules = args.modules or list(BUDGETS)
+    budgets = {m: args.budget if args.budget is not None else BUDGETS.get(m, 150) for m in modules}
+    sys.exit(0 if run(budgets, args.repeat, args.top) else 1)
+
+
+if __name__ == "__main__":
+    main()
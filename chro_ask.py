@@ -5,9 +5,7 @@ from rag_sql import RAG_SQL
 def main():
     rag = RAG_SQL()
     question = "2024年上半年骨科门急诊收入是多少？"
-    rag.index_info = rag.get_similar_index(question)
-    rag.document_info = rag.get_similar_document(question)
-    rag.example_info = rag.get_similar_examples(question)
+    rag.retrieve(question)
     rag.connect_to_mysql(**mysql_config)
     rag.ask(question)
 
@@ -1,52 +1,82 @@
 import hashlib
 import uuid
-from typing import List
+from functools import cached_property
+from typing import TYPE_CHECKING, List
 import json
-import chromadb
-import pandas as pd
-from chromadb.utils import embedding_functions
 from config import chromadb_config
 
+if TYPE_CHECKING:
+    import pandas as pd
+
+COLLECTIONS = ("document", "ddl", "index", "example")
+
 
 class Chromadb():
     def __init__(self, config=None):
+        # 不用 self.config：RAG_SQL 中 Base.__init__ 会把它覆盖为 base_config
         if config == None:
-            self.config = chromadb_config
-        default_ef = embedding_functions.DefaultEmbeddingFunction()
-        self.embedding_function = self.config.get("embedding_function", default_ef)
-        self.curr_client = self.config.get("client", "persistent")
-        self.prefix_dir = self.config.get("prefix_dir", "")
-        self.index_file = self.config.get("index_file", "")
-        self.document_file = self.config.get("document_file", "")
-        self.example_file = self.config.get("example_file", "")
-        self.SQL_DDL_file = self.config.get("SQL_DDL_file", "")
-        self.document_result = self.config.get("document_result", 5)
-        self.example_result = self.config.get("example_result", 1)
-        self.index_result = self.config.get("index_result", 5)
-        self.ddl_result = self.config.get("ddl_result", 5)
+            self.chroma_config = chromadb_config
+        else:
+            self.chroma_config = config
+        self.curr_client = self.chroma_config.get("client", "persistent")
+        self.prefix_dir = self.chroma_config.get("prefix_dir", "")
+        self.index_file = self.chroma_config.get("index_file", "")
+        self.document_file = self.chroma_config.get("document_file", "")
+        self.example_file = self.chroma_config.get("example_file", "")
+        self.SQL_DDL_file = self.chroma_config.get("SQL_DDL_file", "")
+        self.document_result = self.chroma_config.get("document_result", 5)
+        self.example_result = self.chroma_config.get("example_result", 1)
+        self.index_result = self.chroma_config.get("index_result", 5)
+        self.ddl_result = self.chroma_config.get("ddl_result", 5)
+        # chromadb、嵌入模型和各个集合在首次使用时才加载，见 warmup
+        self.collections = {}
+
+    @cached_property
+    def embedding_function(self):
+        if "embedding_function" in self.chroma_config:
+            return self.chroma_config["embedding_function"]
+        from chromadb.utils import embedding_functions
+        return embedding_functions.DefaultEmbeddingFunction()
+
+    @cached_property
+    def chroma_client(self):
+        import chromadb
         if self.curr_client == 'persistent':
-            self.chroma_client = chromadb.PersistentClient(path='./chromedb')
-        collection_metadata = None
-        self.document_collection = self.chroma_client.get_or_create_collection(
-            name='document',
-            embedding_function=self.embedding_function,
-            metadata=collection_metadata
-        )
-        self.ddl_collection = self.chroma_client.get_or_create_collection(
-            name='ddl',
-            embedding_function=self.embedding_function,
-            metadata=collection_metadata
-        )
-        self.index_collection = self.chroma_client.get_or_create_collection(
-            name='index',
-            embedding_function=self.embedding_function,
-            metadata=collection_metadata
-        )
-        self.example_collection = self.chroma_client.get_or_create_collection(
-            name='example',
-            embedding_function=self.embedding_function,
-            metadata=collection_metadata
-        )
+            return chromadb.PersistentClient(path='./chromedb')
+        return chromadb.EphemeralClient()
+
+    def get_collection(self, name: str):
+        collection = self.collections.get(name)
+        if collection is None:
+            collection = self.chroma_client.get_or_create_collection(
+                name=name,
+                embedding_function=self.embedding_function,
+                metadata=None
+            )
+            self.collections[name] = collection
+        return collection
+
+    @property
+    def document_collection(self):
+        return self.get_collection("document")
+
+    @property
+    def ddl_collection(self):
+        return self.get_collection("ddl")
+
+    @property
+    def index_collection(self):
+        return self.get_collection("index")
+
+    @property
+    def example_collection(self):
+        return self.get_collection("example")
+
+    def warmup(self):
+        """打开所有集合并做一次嵌入计算，使模型在首个问题之前加载完成"""
+        for name in COLLECTIONS:
+            self.get_collection(name)
+        self.generate_embedding("warmup")
 
     def generate_embedding(self, data: str, **kwargs) -> List[float]:
         embedding = self.embedding_function([data])
@@ -180,34 +210,16 @@ class Chromadb():
 
     def remove_collection(self, collection_name: str) -> bool:
 
-        if collection_name == "example":
-            self.chroma_client.delete_collection(name="example")
-            self.example_collection = self.chroma_client.get_or_create_collection(
-                name="example", embedding_function=self.embedding_function
-            )
-            return True
-        elif collection_name == "ddl":
-            self.chroma_client.delete_collection(name="ddl")
-            self.ddl_collection = self.chroma_client.get_or_create_collection(
-                name="ddl", embedding_function=self.embedding_function
-            )
-            return True
-        elif collection_name == "document":
-            self.chroma_client.delete_collection(name="document")
-            self.document_collection = self.chroma_client.get_or_create_collection(
-                name="document", embedding_function=self.embedding_function
-            )
-            return True
-        elif collection_name == "index":
-            self.chroma_client.delete_collection(name="index")
-            self.index_collection= self.chroma_client.get_or_create_collection(
-                name="index", embedding_function=self.embedding_function
-            )
+        if collection_name in COLLECTIONS:
+            self.chroma_client.delete_collection(name=collection_name)
+            self.collections.pop(collection_name, None)
+            self.get_collection(collection_name)
             return True
         else:
             return False
 
-    def get_data(self, **kwargs) -> pd.DataFrame:
+    def get_data(self, **kwargs) -> "pd.DataFrame":
+        import pandas as pd
 
         example_data = self.example_collection.get()
         df = pd.DataFrame()
@@ -0,0 +1,97 @@
+import re
+import threading
+import time
+import unicodedata
+from typing import Callable, Tuple
+
+from exceptions import CoalesceCancelledError, DeadlineExceeded
+
+
+def normalize_question(question: str) -> str:
+    """全角转半角、去掉空白和句末标点，用于合并相同的问题"""
+    text = unicodedata.normalize("NFKC", question)
+    text = re.sub(r"\s+", "", text)
+    return text.rstrip("?？。.!！")
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """相同键的并发调用只执行一次，其余调用等待并共享结果
+
+    第一个调用者在自己的线程中执行；等待者可以各自设置超时或通过 cancel 事件放弃等待，
+    不影响正在执行的调用和其他等待者。
+    """
+
+    # 只属于执行者本身的异常，不传给等待者
+    PRIVATE_ERRORS = (DeadlineExceeded,)
+
+    def __init__(self, name: str = ""):
+        self.name = name
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    def do(self, key: str, fn: Callable, timeout: float = None, cancel: threading.Event = None) -> Tuple[object, bool]:
+        """返回 (结果, 是否为共享结果)"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self.lock:
+                call = self.calls.get(key)
+                leader = call is None
+                if leader:
+                    call = _Call()
+                    self.calls[key] = call
+                    self.executions += 1
+                else:
+                    call.waiters += 1
+                    self.coalesced += 1
+            if leader:
+                try:
+                    call.result = fn()
+                except BaseException as e:
+                    call.error = e
+                    raise
+                finally:
+                    with self.lock:
+                        self.calls.pop(key, None)
+                    call.event.set()
+                return call.result, False
+
+            self.wait(call, key, deadline, cancel)
+            if call.error is None:
+                return call.result, True
+            # 执行者自己超时与等待者无关，等待者在自己的截止时间内重新执行
+            if not isinstance(call.error, self.PRIVATE_ERRORS):
+                raise call.error
+
+    @staticmethod
+    def wait(call: _Call, key: str, deadline: float = None, cancel: threading.Event = None):
+        while True:
+            wait = 0.05 if cancel is not None else None
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"等待相同请求结果超时: {key}")
+                wait = remaining if wait is None else min(wait, remaining)
+            if call.event.wait(wait):
+                return
+            if cancel is not None and cancel.is_set():
+                raise CoalesceCancelledError(key)
+
+    def stats(self):
+        return {"name": self.name, "in_flight": len(self.calls), "executions": self.executions,
+                "coalesced": self.coalesced}
+
+
+# 进程内共享，多个 RAG_SQL 实例之间也能合并
+question_flight = SingleFlight("question")
+answer_flight = SingleFlight("answer")
+sql_flight = SingleFlight("sql")
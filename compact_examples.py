@@ -0,0 +1,210 @@
+import argparse
+import difflib
+import json
+import os
+import re
+import shutil
+from typing import Callable, Dict, List
+
+from config import base_config, compaction_config
+from department import DepartmentIndex
+from sql_utils import KEYWORDS, significant, tokenize
+
+DATE_RE = re.compile(r"\d{4}\s*[-年/]\s*\d{1,2}\s*(?:[-月/]\s*\d{1,2}\s*日?)?|\d{4}\s*年|\d{1,2}\s*月(?:份)?")
+SQL_DATE_RE = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+
+def sql_skeleton(sql: str) -> List[str]:
+    """去掉注释和字面量、统一空白和关键字大小写后的SQL记号
+
+    字面量替换为 ?，IN 列表收拢为 IN (?)，col = ? 视同 IN (?)，使只有科室、日期等取值不同的SQL骨架相同。
+    """
+    tokens = []
+    for kind, text in significant(tokenize(sql)):
+        if kind in ("string", "number"):
+            text = "?"
+        elif kind == "word" and text.upper() in KEYWORDS:
+            text = text.upper()
+        if text == "?" and tokens[-2:] == ["?", ","]:
+            tokens.pop()
+            continue
+        if text == "?" and tokens and tokens[-1] == "=":
+            tokens[-1:] = ["IN", "(", "?", ")"]
+            continue
+        tokens.append(text)
+    while tokens and tokens[-1] == ";":
+        tokens.pop()
+    return tokens
+
+
+def literal_signature(sql: str, departments) -> frozenset:
+    """SQL中除日期和科室名以外的字面量，如手术代码、医师姓名
+
+    只有日期、科室取值不同的示例才视为重复，手术代码或医师不同的查询各自保留。
+    """
+    literals = set()
+    for kind, text in significant(tokenize(sql)):
+        if kind == "string":
+            text = text[1:-1]
+            if SQL_DATE_RE.fullmatch(text) or text in departments:
+                continue
+            literals.add(text)
+    return frozenset(literals)
+
+
+def canonical_question(question: str) -> str:
+    """日期统一替换，去掉空白和标点"""
+    question = DATE_RE.sub("<日期>", question)
+    return re.sub(r"[\s，,。？?！!、：:（）()]+", "", question)
+
+
+def text_similarity(a: str, b: str) -> float:
+    return difflib.SequenceMatcher(None, a, b, autojunk=False).ratio()
+
+
+def embedding_similarity(questions: List[str]) -> Callable[[int, int], float]:
+    """用向量库的嵌入模型计算问题之间的余弦相似度"""
+    import numpy as np
+    from class_chromadb import Chromadb
+
+    vectors = np.array(Chromadb().embedding_function(questions), dtype=float)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    matrix = vectors @ vectors.T
+    return lambda i, j: float(matrix[i, j])
+
+
+def cluster_examples(examples: List[Dict], question_similarity: Callable[[int, int], float],
+                     question_threshold: float, sql_threshold: float, departments=()) -> List[List[int]]:
+    """SQL骨架相近、问题相似且只有日期和科室取值不同的示例归为一组，返回各组的示例下标
+
+    按原顺序逐个加入：与某组首个示例同时满足条件时并入该组，否则新建一组。
+    """
+    skeletons = [sql_skeleton(e["SQL"]) for e in examples]
+    signatures = [literal_signature(e["SQL"], departments) for e in examples]
+    clusters = []
+    for i in range(len(examples)):
+        for cluster in clusters:
+            seed = cluster[0]
+            if signatures[i] != signatures[seed] or question_similarity(i, seed) < question_threshold:
+                continue
+            if difflib.SequenceMatcher(None, skeletons[i], skeletons[seed], autojunk=False).ratio() >= sql_threshold:
+                cluster.append(i)
+                break
+        else:
+            clusters.append([i])
+    return clusters
+
+
+def representative(cluster: List[int], question_similarity: Callable[[int, int], float]) -> int:
+    """与组内其他问题平均相似度最高的示例，相同时取先出现的"""
+    return max(cluster, key=lambda i: (sum(question_similarity(i, j) for j in cluster), -i))
+
+
+def compact(examples: List[Dict], similarity: str = None, config=None) -> List[Dict]:
+    """每组保留一个代表示例，其余问题记入 variants"""
+    if config is None:
+        config = compaction_config
+    if similarity is None:
+        similarity = config.get("similarity", "embedding")
+    questions = [canonical_question(e["question"]) for e in examples]
+    if similarity == "embedding":
+        question_similarity = embedding_similarity(questions)
+        threshold = config.get("embedding_threshold", 0.9)
+    else:
+        question_similarity = lambda i, j: text_similarity(questions[i], questions[j])
+        threshold = config.get("text_threshold", 0.6)
+    departments = set(DepartmentIndex.from_files().children)
+    result = []
+    clusters = cluster_examples(examples, question_similarity, threshold, config.get("sql_threshold", 0.9), departments)
+    for cluster in clusters:
+        keep = representative(cluster, question_similarity)
+        entry = dict(examples[keep])
+        variants = list(entry.get("variants", []))
+        for i in cluster:
+            if i != keep:
+                variants += [examples[i]["question"]] + examples[i].get("variants", [])
+        if variants:
+            entry["variants"] = variants
+        result.append(entry)
+    return result
+
+
+def read_example_txt(path: str) -> List[Dict]:
+    """example.txt 以 ### 标题分节，每节一条SQL"""
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    examples = []
+    for section in re.split(r"^###\s*", text, flags=re.M)[1:]:
+        title, _, body = section.partition("\n")
+        note = re.match(r"--\s*同类问题:\s*(.*)\n", body)
+        variants = note.group(1).split("；") if note else []
+        if note:
+            body = body[note.end():]
+        examples.append({"question": title.strip(), "SQL": body.strip(), "variants": variants})
+    return examples
+
+
+def write_example_txt(path: str, examples: List[Dict]):
+    sections = []
+    for e in examples:
+        note = f"-- 同类问题: {'；'.join(e['variants'])}\n" if e.get("variants") else ""
+        sections.append(f"### {e['question']}\n{note}{e['SQL']}\n")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n\n\n".join(sections))
+
+
+def rebuild_collection(examples: List[Dict]):
+    """清空向量库中的示例集合，只写入各组的代表示例"""
+    from class_chromadb import Chromadb
+
+    chroma = Chromadb()
+    chroma.remove_collection("example")
+    for example in examples:
+        chroma.add_example_data(example)
+
+
+def print_report(name: str, before: List[Dict], after: List[Dict]):
+    size = lambda items: sum(len(e["question"]) + len(e["SQL"]) for e in items)
+    print(f"{name}: {len(before)} 条 -> {len(after)} 条, 字符数 {size(before)} -> {size(after)}")
+    for e in after:
+        if e.get("variants"):
+            print(f"  保留: {e['question']}")
+            for v in e["variants"]:
+                print(f"    合并: {v}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="合并近似重复的示例，并按合并结果重建示例向量集合")
+    parser.add_argument("--json", default=os.path.join(base_config["prefix_dir"], base_config["example_json"]))
+    parser.add_argument("--txt", default=os.path.join(base_config["prefix_dir"], base_config["example_file"]))
+    parser.add_argument("--similarity", choices=["embedding", "text"], default=compaction_config.get("similarity"),
+                        help="问题相似度：向量库嵌入模型的余弦相似度，或字符序列相似度")
+    parser.add_argument("--write", action="store_true", help="改写示例文件，原文件备份为 .bak")
+    parser.add_argument("--rebuild", action="store_true", help="用合并后的 example.json 重建向量库示例集合")
+    args = parser.parse_args()
+
+    with open(args.json, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    examples = compact(data["examples"], args.similarity)
+    print_report(args.json, data["examples"], examples)
+    txt_examples = None
+    if os.path.isfile(args.txt):
+        sections = read_example_txt(args.txt)
+        txt_examples = compact(sections, args.similarity)
+        print_report(args.txt, sections, txt_examples)
+    if args.write:
+        shutil.copyfile(args.json, args.json + ".bak")
+        data["examples"] = examples
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=4)
+        if txt_examples is not None:
+            shutil.copyfile(args.txt, args.txt + ".bak")
+            write_example_txt(args.txt, txt_examples)
+    if args.rebuild:
+        rebuild_collection(examples)
+    if not args.write and not args.rebuild:
+        print("未改动任何文件，使用 --write 改写示例文件，--rebuild 重建示例集合")
+
+
+if __name__ == "__main__":
+    main()
@@ -12,6 +12,15 @@ mysql_config = {
     "port": 3306,
 }
 
+# 造数、压测和索引验证使用的本地MySQL，不能与 mysql_config 指向同一台服务器
+benchmark_mysql_config = {
+    "host": "127.0.0.1",
+    "user": "root",
+    "password": "",
+    "dbname": "guke_bench",
+    "port": 3306,
+}
+
 base_config = {
     "log_dir": "log.log",
     "dialect": "MYSQL",
@@ -23,7 +32,9 @@ base_config = {
     "example_json": "example.json",
     "relation_file": "relation.txt",
     "MAX_TIMES" : 10,
-    "MAX_SQL_ATTEMPT":3
+    "MAX_SQL_ATTEMPT":3,
+    "SLOT_CONFIDENCE": 0.8,
+    "MYSQL_POOL_SIZE": 8
 }
 chromadb_config = {
     "prefix_dir": "addition/",
@@ -36,4 +47,104 @@ chromadb_config = {
     "index_result": 4,
     "example_result": 2,
     "ddl_result": 1,
-}
\ No newline at end of file
+}
+slot_config = {
+    "prefix_dir": "addition/",
+    "index_file": "index.txt",
+    "document_file": "document.txt",
+    "relation_file": "relation.txt",
+    "default_time": ("2023-01-01", "2023-11-30"),
+    "default_department": "骨科",
+    # 问题中有词典不认识的人名等文字时的置信度上限，应低于 SLOT_CONFIDENCE
+    "unknown_entity_confidence": 0.5,
+    # 有相对时间等没能解析的时间说法，或时间范围颠倒时的置信度上限
+    "unparsed_time_confidence": 0.5,
+}
+
+rollup_config = {
+    "enabled": False,
+    "table": "病历记录_日汇总",
+    "max_staleness": 3600,
+    # 后台刷新失败后的重试间隔(秒)
+    "retry_interval": 60,
+    "prefix_dir": "addition/",
+    "document_file": "document.txt",
+}
+
+guard_config = {
+    "enabled": True,
+    "max_rows": 5000000,
+    "max_cost": 1000000,
+    "max_execution_time": 30000,
+    "default_limit": 1000,
+    "plan_log": "plan_cost.log",
+}
+
+cache_config = {
+    "enabled": True,
+    "max_bytes": 256 * 1024 * 1024,
+    "max_entries": 1000,
+    "ttl": 3600,
+    "version_check_interval": 5,
+    "change_marker_sql": None,
+}
+
+drilldown_config = {
+    "enabled": True,
+    "max_entries": 32,
+    "ttl": 600,
+}
+
+coalesce_config = {
+    "enabled": True,
+    "wait_timeout": None,
+}
+
+server_config = {
+    "host": "0.0.0.0",
+    "port": 8000,
+    "workers": 4,
+    "max_queue": 16,
+    "per_client": 2,
+    "vllm_max_in_flight": 8,
+    "session_ttl": 600,
+    "drain_timeout": 60,
+}
+
+tracing_config = {
+    "enabled": True,
+    "log_file": "trace.log",
+    "buckets": (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+}
+
+datagen_config = {
+    "seed": 0,
+    "db": "synthetic.db",
+    "chunk_rows": 100000,
+    "start_date": "2022-01-01",
+    "end_date": "2024-06-30",
+    # relation.txt 中科室的病区占全部病历的比例
+    "focus_share": 0.4,
+    "other_wards": ["心血管内科", "呼吸内科", "消化内科", "神经内科", "肾内科", "内分泌科", "普外科", "肝胆外科",
+                    "神经外科", "心胸外科", "泌尿外科", "妇科", "产科", "儿科", "眼科", "耳鼻喉科", "肿瘤科", "重症医学科"],
+    "other_procedures": 300,
+    # example.json 中出现的医师，分配到骨科病区
+    "named_doctors": {"骨科一区": ["张立国", "蔡明"], "骨科二区": ["倪海键"]},
+}
+
+deadline_config = {
+    "enabled": True,
+    # 单个问题从语义解析到回答的总时长(秒)
+    "question_budget": 120,
+    # 未设置截止时间时单次大模型请求的超时(秒)
+    "llm_timeout": 300,
+}
+
+compaction_config = {
+    # embedding 使用向量库的嵌入模型，text 使用字符序列相似度
+    "similarity": "embedding",
+    "embedding_threshold": 0.9,
+    "text_threshold": 0.6,
+    # SQL骨架(去掉字面量后)的记号序列相似度
+    "sql_threshold": 0.9,
+}
@@ -0,0 +1,333 @@
+import argparse
+import json
+import os
+import re
+import tempfile
+import time
+from typing import Dict, Iterator, List, Tuple
+
+import numpy as np
+
+from config import base_config, datagen_config
+from department import DepartmentIndex
+from local_db import add_mysql_arguments, benchmark_mysql_target, connect_sqlite, mysql_to_sqlite
+
+COLUMNS = [
+    "入院科室", "入院日期", "入院途径", "病案号", "性别", "年龄", "出院科室", "出院日期", "所属病区", "主要诊断编码",
+    "主要诊断说明", "全部诊断", "主手术代码", "主手术名称", "全部手术操作", "住院天数", "总费用", "总药费", "抗菌药物费用",
+    "手术治疗费", "总材料费", "手术用一次性医用材料费", "治疗结果", "抢救次数", "成功次数", "输血次数", "带组医师", "带组医师工号",
+]
+CATALOGS = ["国考三级手术目录", "国考四级手术目录", "国考微创手术目录"]
+
+DIAGNOSES = [
+    ("M17.900", "膝关节骨关节病"), ("M16.900", "髋关节骨关节病"), ("M51.202", "腰椎间盘突出"),
+    ("M48.061", "腰椎管狭窄"), ("S72.001", "股骨颈骨折"), ("S82.201", "胫骨干骨折"), ("M87.051", "股骨头坏死"),
+    ("S42.201", "肱骨近端骨折"), ("I25.103", "冠状动脉粥样硬化性心脏病"), ("J18.900", "肺炎"),
+    ("K80.101", "胆囊结石伴慢性胆囊炎"), ("I63.900", "脑梗死"), ("N18.500", "慢性肾脏病5期"), ("C34.900", "肺恶性肿瘤"),
+]
+ADMISSION_ROUTES = (["门诊", "急诊", "其他医疗机构转入", "其他"], [0.7, 0.22, 0.05, 0.03])
+OUTCOMES = (["治愈", "好转", "未愈", "死亡", "其他"], [0.35, 0.55, 0.06, 0.01, 0.03])
+SURNAMES = "王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗郑梁谢宋唐许韩冯邓曹彭曾肖田董袁潘于蒋蔡余杜叶程苏魏吕丁任沈姚卢姜崔钟谭陆汪范金石廖贾夏韦付方白邹孟熊秦邱江尹薛闫段雷侯龙史陶黎贺顾毛郝龚邵万钱严覃武戴莫孔向汤"
+GIVEN = "伟芳娜敏静丽强磊军洋勇艳杰娟涛明超秀霞平刚桂英华玉兰文辉建国志红海波宁斌鹏飞宇浩凯俊峰晨瑞琳雪梅琴云鑫"
+
+
+def disease_codes(document: str) -> List[Tuple[str, List[str], List[str]]]:
+    """从 document.txt 解析重点病种的主手术代码，返回 (病种, 代码前缀, 完整代码)"""
+    result = []
+    for line in re.split(r"[;\n]", document):
+        if "的主手术代码" not in line:
+            continue
+        name, rest = line.split("的主手术代码", 1)
+        prefixes = re.findall(r"(\d{2}\.\d{2})(?=开头|或)", rest) if "开头" in rest else []
+        codes = re.findall(r'"([^"]+)"', rest)
+        result.append((name.strip(), prefixes, codes))
+    return result
+
+
+class DataGenerator:
+    """按种子生成可复现的病历记录，分块产出，内存占用与总行数无关
+
+    病区分布来自 relation.txt 中的科室层级，手术代码来自生成的手术目录，费用各列之间保持相关性。
+    """
+
+    def __init__(self, seed: int = 0, config=None):
+        if config is None:
+            config = datagen_config
+        self.config = config
+        self.seed = seed
+        rng = np.random.default_rng(seed)
+        self.start = np.datetime64(self.config.get("start_date", "2022-01-01"))
+        self.days = int((np.datetime64(self.config.get("end_date", "2024-06-30")) - self.start).astype(int)) + 1
+
+        index = DepartmentIndex.from_files()
+        focus = sorted({w for group in index.children for w in index.leaves.get(group, [])})
+        other = self.config.get("other_wards", [])
+        self.wards = focus + other
+        # 重点科室病区按 Zipf 分布分摊 focus_share，其余科室均分剩余比例
+        zipf = 1.0 / np.arange(1, len(focus) + 1)
+        weights = np.concatenate([zipf / zipf.sum() * self.config.get("focus_share", 0.4),
+                                  np.full(len(other), (1 - self.config.get("focus_share", 0.4)) / max(len(other), 1))])
+        self.ward_weights = weights / weights.sum()
+        self.focus = np.array([w in focus for w in self.wards])
+
+        self.doctors = []
+        for w, ward in enumerate(self.wards):
+            count = int(rng.integers(3, 7))
+            names = self.config.get("named_doctors", {}).get(ward, []) + [rng.choice(list(SURNAMES)) + "".join(rng.choice(list(GIVEN), int(rng.integers(1, 3))))
+                     for _ in range(count)]
+            self.doctors.append([(name, f"D{w:03d}{i:02d}") for i, name in enumerate(names)])
+
+        with open(os.path.join(base_config["prefix_dir"], base_config["document_file"]), "r", encoding="utf-8") as f:
+            diseases = disease_codes(f.read())
+        self.procedures = []
+        for name, prefixes, codes in diseases:
+            for prefix in prefixes:
+                self.procedures += [(f"{prefix}00x{i:03d}", f"{name}{i}") for i in range(1, 4)]
+                self.procedures.append((f"{prefix}01", f"{name}"))
+            self.procedures += [(code, name) for code in codes]
+        focus_count = len(self.procedures)
+        for i in range(self.config.get("other_procedures", 300)):
+            code = f"{int(rng.integers(1, 99)):02d}.{int(rng.integers(0, 99)):02d}00x{i:03d}"
+            self.procedures.append((code, f"手术操作{i}"))
+        self.procedures = list(dict.fromkeys(self.procedures))
+        # 重点病种的手术都是四级手术；其余手术随机归入各级目录
+        level = rng.random(len(self.procedures))
+        self.level4 = np.array([i < focus_count or level[i] < 0.25 for i in range(len(self.procedures))])
+        self.level3 = ~self.level4 & (level < 0.7)
+        self.minimally_invasive = rng.random(len(self.procedures)) < 0.3
+        self.focus_procedures = np.arange(focus_count)
+
+    def catalogs(self) -> Dict[str, List[Tuple[str, str]]]:
+        masks = {"国考三级手术目录": self.level3, "国考四级手术目录": self.level4, "国考微创手术目录": self.minimally_invasive}
+        return {table: [p for p, keep in zip(self.procedures, mask) if keep] for table, mask in masks.items()}
+
+    def chunks(self, rows: int, offset: int = 0, chunk_rows: int = None) -> Iterator[List[tuple]]:
+        """生成第 offset 行起的 rows 行，每块的随机数只由种子和块位置决定，便于分批扩容"""
+        chunk_rows = chunk_rows or self.config.get("chunk_rows", 100000)
+        for start in range(offset, offset + rows, chunk_rows):
+            size = min(chunk_rows, offset + rows - start)
+            yield self.chunk(start, size)
+
+    def chunk(self, start: int, size: int) -> List[tuple]:
+        rng = np.random.default_rng([self.seed, start])
+        ward = rng.choice(len(self.wards), size, p=self.ward_weights)
+        wards = np.array(self.wards, dtype=object)[ward]
+        focus = self.focus[ward]
+
+        stay = np.clip(np.rint(rng.lognormal(2.0, 0.55, size)), 1, 90).astype(int)
+        discharge = self.start + rng.integers(0, self.days, size).astype("timedelta64[D]")
+        admission = discharge - stay.astype("timedelta64[D]")
+
+        surgery = rng.random(size) < np.where(focus, 0.75, 0.3)
+        procedure = np.where(rng.random(size) < 0.6, rng.choice(self.focus_procedures, size),
+                             rng.integers(0, len(self.procedures), size))
+        procedure = np.where(focus, procedure, rng.integers(0, len(self.procedures), size))
+        codes = np.array([p[0] for p in self.procedures], dtype=object)[procedure]
+        names = np.array([p[1] for p in self.procedures], dtype=object)[procedure]
+        codes = np.where(surgery, codes, "")
+        names = np.where(surgery, names, "")
+        level4 = surgery & self.level4[procedure]
+
+        diagnosis = np.where(focus, rng.integers(0, 8, size), rng.integers(0, len(DIAGNOSES), size))
+        diagnosis_codes = np.array([d[0] for d in DIAGNOSES], dtype=object)[diagnosis]
+        diagnosis_names = np.array([d[1] for d in DIAGNOSES], dtype=object)[diagnosis]
+        extra = np.array([d[1] for d in DIAGNOSES], dtype=object)[rng.integers(0, len(DIAGNOSES), size)]
+        all_diagnoses = np.where(rng.random(size) < 0.4, diagnosis_names + ";" + extra, diagnosis_names)
+
+        # 费用：按床日费用和手术费用生成总费用，各分项按比例拆分并保证不超过总费用
+        daily = rng.lognormal(7.3, 0.35, size)
+        surgery_cost = np.where(surgery, rng.lognormal(9.6, 0.5, size) * np.where(level4, 1.8, 1.0), 0.0)
+        total = np.round(stay * daily + surgery_cost, 2)
+        drug_ratio = rng.beta(2, 6, size)
+        material_ratio = np.where(surgery, rng.beta(4, 6, size), rng.beta(1.5, 10, size))
+        scale = np.minimum(1.0, 0.95 / (drug_ratio + material_ratio))
+        drug = np.round(total * drug_ratio * scale, 2)
+        material = np.round(total * material_ratio * scale, 2)
+        antibiotics = np.round(drug * rng.beta(1, 8, size), 2)
+        operation_fee = np.round(np.where(surgery, total * rng.beta(2, 12, size), 0.0), 2)
+        disposable = np.round(np.where(surgery, material * rng.beta(5, 3, size), 0.0), 2)
+
+        rescue = rng.poisson(0.02, size)
+        success = rng.binomial(rescue, 0.8)
+        transfusion = rng.poisson(0.05, size)
+        age = np.clip(np.rint(rng.normal(56, 17, size)), 1, 99).astype(int)
+        sex = np.where(rng.random(size) < 0.5, "男", "女")
+        route = rng.choice(ADMISSION_ROUTES[0], size, p=ADMISSION_ROUTES[1])
+        outcome = rng.choice(OUTCOMES[0], size, p=OUTCOMES[1])
+        admit_ward = np.where(rng.random(size) < 0.95, wards,
+                              np.array(self.wards, dtype=object)[rng.integers(0, len(self.wards), size)])
+        doctor_index = rng.integers(0, 6, size)
+        doctors = [self.doctors[w][i % len(self.doctors[w])] for w, i in zip(ward.tolist(), doctor_index.tolist())]
+
+        columns = [
+            admit_ward, np.datetime_as_string(admission), route, [f"{start + i:012d}" for i in range(size)], sex, age,
+            wards, np.datetime_as_string(discharge), wards, diagnosis_codes, diagnosis_names, all_diagnoses, codes,
+            names, names, stay, total, drug, antibiotics, operation_fee, material, disposable, outcome, rescue,
+            success, transfusion, [d[0] for d in doctors], [d[1] for d in doctors],
+        ]
+        return list(zip(*[c.tolist() if hasattr(c, "tolist") else c for c in columns]))
+
+
+class SqliteLoader:
+    def __init__(self, path: str, ddl: str):
+        self.conn = connect_sqlite(path, ddl)
+        self.conn.execute("PRAGMA journal_mode = OFF")
+        self.conn.execute("PRAGMA synchronous = OFF")
+
+    def count(self) -> int:
+        return self.conn.execute('SELECT COUNT(*) FROM "病历记录"').fetchone()[0]
+
+    def load(self, table: str, columns: List[str], rows: List[tuple]):
+        placeholders = ", ".join("?" for _ in columns)
+        names = ", ".join(f'"{c}"' for c in columns)
+        self.conn.executemany(f'INSERT OR IGNORE INTO "{table}" ({names}) VALUES ({placeholders})', rows)
+        self.conn.commit()
+
+    def analyze(self):
+        self.conn.execute("ANALYZE")
+
+    def run(self, sql: str):
+        return self.conn.execute(mysql_to_sqlite(sql)).fetchall()
+
+    def plan(self, sql: str) -> str:
+        rows = self.conn.execute("EXPLAIN QUERY PLAN " + mysql_to_sqlite(sql)).fetchall()
+        return "\n".join(row[-1] for row in rows)
+
+
+class MysqlLoader:
+    """用 LOAD DATA LOCAL INFILE 批量导入本地MySQL，切勿指向生产库；表不存在时按 create_tables.sql 创建"""
+
+    def __init__(self, host, dbname, user, password, port, ddl: str = None, **kwargs):
+        import pymysql
+        self.conn = pymysql.connect(host=host, user=user, password=password, database=dbname, port=port,
+                                    local_infile=True, autocommit=True)
+        if ddl:
+            self.create_tables(ddl)
+
+    def create_tables(self, ddl: str):
+        with self.conn.cursor() as cs:
+            for statement in ddl.split(";"):
+                if not statement.strip():
+                    continue
+                statement = re.sub(r"CREATE\s+TABLE\s+(?!IF\s+NOT\s+EXISTS)", "CREATE TABLE IF NOT EXISTS ",
+                                   statement, count=1, flags=re.I)
+                cs.execute(statement)
+
+    def count(self) -> int:
+        with self.conn.cursor() as cs:
+            cs.execute("SELECT COUNT(*) FROM `病历记录`")
+            return cs.fetchone()[0]
+
+    def load(self, table: str, columns: List[str], rows: List[tuple]):
+        with tempfile.NamedTemporaryFile("w", encoding="utf-8", suffix=".tsv", delete=False) as f:
+            for row in rows:
+                f.write("\t".join(str(v) for v in row) + "\n")
+            path = f.name
+        try:
+            with self.conn.cursor() as cs:
+                cs.execute(f"LOAD DATA LOCAL INFILE %s IGNORE INTO TABLE `{table}` CHARACTER SET utf8mb4 "
+                           f"FIELDS TERMINATED BY '\\t' ({', '.join(f'`{c}`' for c in columns)})", (path,))
+        finally:
+            os.remove(path)
+
+    def analyze(self):
+        with self.conn.cursor() as cs:
+            cs.execute("ANALYZE TABLE `病历记录`")
+
+    def run(self, sql: str):
+        with self.conn.cursor() as cs:
+            cs.execute(sql)
+            return cs.fetchall()
+
+    def plan(self, sql: str) -> str:
+        with self.conn.cursor() as cs:
+            cs.execute("EXPLAIN " + sql)
+            names = [d[0] for d in cs.description]
+            rows = [dict(zip(names, row)) for row in cs.fetchall()]
+        return "\n".join(f"{r['table']} {r['type']} {r['key']}" for r in rows)
+
+
+def generate(loader, generator: DataGenerator, rows: int):
+    """补足到 rows 行，已有的行不重复生成"""
+    for table, entries in generator.catalogs().items():
+        loader.load(table, ["编码", "手术操作名称"], entries)
+    existing, done = loader.count(), 0
+    started = time.perf_counter()
+    for chunk in generator.chunks(max(rows - existing, 0), offset=existing):
+        loader.load("病历记录", COLUMNS, chunk)
+        done += len(chunk)
+        print(f"\r已生成 {existing + done} 行, {done / max(time.perf_counter() - started, 1e-9):.0f} 行/秒", end="", flush=True)
+    print()
+    loader.analyze()
+
+
+def parse_scale(text: str) -> int:
+    text = text.strip().upper()
+    unit = {"K": 1000, "M": 1000000}.get(text[-1], 1)
+    return int(float(text[:-1] if unit > 1 else text) * unit)
+
+
+def benchmark(loader, generator: DataGenerator, scales: List[int], queries: List[Dict], repeat: int = 3) -> Dict:
+    """逐级扩容，每个规模下运行全部示例查询，记录耗时中位数和执行计划的变化"""
+    report = {"scales": scales, "queries": []}
+    for query in queries:
+        report["queries"].append({"question": query["question"], "latency": [], "rows": [], "plan": [],
+                                  "plan_changed": []})
+    for scale in scales:
+        generate(loader, generator, scale)
+        for entry, query in zip(report["queries"], queries):
+            timings, result = [], []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                result = loader.run(query["SQL"])
+                timings.append(time.perf_counter() - started)
+            plan = loader.plan(query["SQL"])
+            entry["plan_changed"].append(bool(entry["plan"]) and plan != entry["plan"][-1])
+            entry["latency"].append(sorted(timings)[len(timings) // 2])
+            entry["rows"].append(len(result))
+            entry["plan"].append(plan)
+    return report
+
+
+def print_report(report: Dict):
+    header = "".join(f"{s:>12,}" for s in report["scales"])
+    print(f"{'#':>3}{header}  问题 (耗时秒，* 表示执行计划相对上一规模有变化)")
+    for i, entry in enumerate(report["queries"], 1):
+        cells = "".join(f"{t:>11.3f}{'*' if changed else ' '}" for t, changed in zip(entry["latency"], entry["plan_changed"]))
+        print(f"{i:>3}{cells}  {entry['question']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成病历记录测试数据，并按数据规模测试示例查询的耗时和执行计划")
+    parser.add_argument("mode", choices=["generate", "bench"])
+    parser.add_argument("--rows", default="1M", help="generate 模式下的目标行数，如 500K、10M")
+    parser.add_argument("--scales", default="1M,10M,50M", help="bench 模式下依次扩容到的行数")
+    parser.add_argument("--seed", type=int, default=datagen_config.get("seed", 0))
+    parser.add_argument("--db", default=datagen_config.get("db", "synthetic.db"), help="SQLite 数据库文件")
+    parser.add_argument("--mysql", action="store_true", help="导入本地测试MySQL，见 --mysql-host 等参数；库需已存在，表按 create_tables.sql 自动创建")
+    add_mysql_arguments(parser)
+    parser.add_argument("--examples", default=os.path.join(base_config["prefix_dir"], base_config["example_json"]))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="把耗时和执行计划写入 JSON 文件")
+    args = parser.parse_args()
+    generator = DataGenerator(args.seed)
+    with open(os.path.join(base_config["prefix_dir"], base_config["SQL_DDL_file"]), "r", encoding="utf-8") as f:
+        ddl = f.read()
+    if args.mysql:
+        loader = MysqlLoader(ddl=ddl, **benchmark_mysql_target(args))
+    else:
+        loader = SqliteLoader(args.db, ddl)
+    if args.mode == "generate":
+        generate(loader, generator, parse_scale(args.rows))
+        return
+    with open(args.examples, "r", encoding="utf-8") as f:
+        queries = json.load(f)["examples"]
+    report = benchmark(loader, generator, [parse_scale(s) for s in args.scales.split(",")], queries, args.repeat)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=1)
+
+
+if __name__ == "__main__":
+    main()
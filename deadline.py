@@ -0,0 +1,100 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional
+
+from config import deadline_config
+from exceptions import DeadlineExceeded
+from tracing import restore
+
+# 本次提问的截止时刻(time.monotonic)，大模型调用和数据库查询据此设置超时
+current_deadline = contextvars.ContextVar("current_deadline", default=None)
+
+
+def remaining() -> Optional[float]:
+    """剩余时间(秒)，未设置截止时间时返回None"""
+    deadline = current_deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def expired() -> bool:
+    left = remaining()
+    return left is not None and left <= 0
+
+
+def check(stage: str):
+    if expired():
+        raise DeadlineExceeded(stage)
+
+
+def timeout(default: float = None) -> Optional[float]:
+    """作为 requests 的 timeout 参数：剩余时间与默认超时取较小值"""
+    left = remaining()
+    if left is None:
+        return default
+    left = max(left, 0.001)
+    return left if default is None else min(left, default)
+
+
+@contextmanager
+def budget(seconds: float = None):
+    """在 seconds 秒后截止；已处于更早的截止时间内时沿用外层的截止时间"""
+    if seconds is None:
+        seconds = deadline_config.get("question_budget")
+    if not deadline_config.get("enabled", True) or seconds is None:
+        yield current_deadline.get()
+        return
+    deadline = time.monotonic() + seconds
+    outer = current_deadline.get()
+    if outer is not None:
+        deadline = min(deadline, outer)
+    token = current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        restore(current_deadline, token)
+
+
+@contextmanager
+def on_expiry(callback: Callable[[], None]):
+    """截止时间到达时在后台线程调用 callback，用于中止正在执行的查询
+
+    返回的事件表示 callback 是否已被调用。
+    """
+    fired = threading.Event()
+    left = remaining()
+    if left is None:
+        yield fired
+        return
+
+    def fire():
+        fired.set()
+        callback()
+
+    timer = threading.Timer(max(left, 0), fire)
+    timer.daemon = True
+    timer.start()
+    try:
+        yield fired
+    finally:
+        timer.cancel()
+
+
+def shared(flight, key: str, fn: Callable, stage: str, timeout: float = None, cancel: threading.Event = None):
+    """通过 SingleFlight 执行或等待相同调用，等待时间不超过剩余时间
+
+    因截止时间到达而放弃等待时抛出 DeadlineExceeded，而不是 TimeoutError。
+    """
+    left = remaining()
+    if left is not None:
+        left = max(left, 0)
+        timeout = left if timeout is None else min(timeout, left)
+    try:
+        return flight.do(key, fn, timeout, cancel)
+    except TimeoutError as e:
+        if expired():
+            raise DeadlineExceeded(stage) from e
+        raise
@@ -0,0 +1,156 @@
+import os
+import re
+from typing import Dict, Iterable, List
+
+from config import slot_config
+
+
+class DepartmentIndex:
+    """由 relation.txt 编译的科室层级索引，预先计算每个节点下属的全部病区"""
+
+    def __init__(self, relations: Dict[str, List[str]] = None):
+        self.children = {}
+        self.parents = {}
+        self.leaves = {}
+        for group, members in (relations or {}).items():
+            self.add_group(group, members)
+        self.compile()
+
+    @classmethod
+    def from_files(cls, config=None):
+        if config is None:
+            config = slot_config
+        prefix_dir = config.get("prefix_dir", "")
+        relations = {}
+        for file_name in (config.get("relation_file", ""), config.get("document_file", "")):
+            path = os.path.join(prefix_dir, file_name)
+            if not file_name or not os.path.isfile(path):
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                relations.update(cls.parse_relation(f.read()))
+        return cls(relations)
+
+    @staticmethod
+    def parse_relation(text: str) -> Dict[str, List[str]]:
+        """解析 `骨科包括："骨科一区","骨科二区"` 形式的科室关系"""
+        relations = {}
+        for line in re.split(r"[;\n]", text):
+            if "包括" not in line:
+                continue
+            group, members = line.split("包括", 1)
+            names = re.findall(r'["“”\']([^"“”\']+)["“”\']', members)
+            if names:
+                relations[group.strip()] = names
+        return relations
+
+    def add_group(self, group: str, members: Iterable[str]):
+        self.children.setdefault(group, [])
+        for member in members:
+            if member not in self.children[group]:
+                self.children[group].append(member)
+            self.children.setdefault(member, [])
+            self.parents.setdefault(member, []).append(group)
+
+    def add_leaf(self, name: str):
+        self.children.setdefault(name, [])
+
+    def compile(self):
+        self.leaves = {}
+        for name in self.children:
+            self._collect(name, [])
+        self.names = sorted(self.children, key=len, reverse=True)
+
+    def _collect(self, name: str, path: List[str]) -> List[str]:
+        if name in self.leaves:
+            return self.leaves[name]
+        if name in path:
+            raise ValueError(f"科室关系存在循环: {' -> '.join(path + [name])}")
+        if not self.children[name]:
+            result = [name]
+        else:
+            result = []
+            for child in self.children[name]:
+                result.extend(w for w in self._collect(child, path + [name]) if w not in result)
+        self.leaves[name] = result
+        return result
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.children
+
+    def is_group(self, name: str) -> bool:
+        return bool(self.children.get(name))
+
+    def resolve(self, names) -> List[str]:
+        """科室或科室组名称 -> 病区列表，未知名称按病区原样返回"""
+        if isinstance(names, str):
+            names = [names]
+        result = []
+        for name in names:
+            result.extend(w for w in self.leaves.get(name, [name]) if w not in result)
+        return result
+
+    def ancestors(self, name: str) -> List[str]:
+        result, stack = [], list(self.parents.get(name, []))
+        while stack:
+            parent = stack.pop(0)
+            if parent not in result:
+                result.append(parent)
+                stack.extend(self.parents.get(parent, []))
+        return result
+
+    def find(self, text: str) -> List[str]:
+        """按最长优先找出文本中提到的科室名称"""
+        found, spans = [], []
+        for name in self.names:
+            for match in re.finditer(re.escape(name), text):
+                if any(b < match.end() and match.start() < e for b, e in spans):
+                    continue
+                spans.append(match.span())
+                if name not in found:
+                    found.append(name)
+        return found
+
+    def predicate(self, names, column: str = "出院科室") -> str:
+        wards = ["'" + w.replace("'", "''") + "'" for w in self.resolve(names)]
+        if len(wards) == 1:
+            return f"`{column}` = {wards[0]}"
+        return f"`{column}` IN ({', '.join(wards)})"
+
+    def describe(self, names, column: str = "出院科室") -> str:
+        """生成放入提示词的科室筛选条件，代替原始关系文本"""
+        if isinstance(names, str):
+            names = [names]
+        return "\n".join(f"{name}: {self.predicate(name, column)}" for name in names)
+
+    def rollup(self, df, column: str = "出院科室", groups: List[str] = None, agg=None):
+        """把按病区统计的结果汇总到上级科室
+
+        默认只对例数、费用等可加的列求和，均次、占比等指标由汇总后的分子分母重算，
+        无法重算的列不输出；指定 agg 时按 agg 汇总各列。
+        """
+        import pandas as pd
+
+        if groups is None:
+            groups = sorted({p for ward in df[column].unique() for p in self.parents.get(ward, [])})
+        parts = []
+        for group in groups:
+            part = df[df[column].isin(self.leaves.get(group, [group]))]
+            if not part.empty:
+                parts.append(part.assign(**{column: group}))
+        if agg is not None:
+            rows = [{column: part[column].iloc[0], **{c: part[c].agg(func) for c, func in agg.items()}}
+                    for part in parts]
+            return pd.DataFrame(rows, columns=[column] + list(agg))
+        from drilldown import ADDITIVE, FEE_RATIO, PER_CASE, SURGERY_RATIO, reaggregate
+
+        metrics = [c for c in df.columns if c in ADDITIVE or c in PER_CASE or c in FEE_RATIO or c in SURGERY_RATIO]
+        if not parts:
+            return pd.DataFrame(columns=[column] + metrics)
+        # 查询结果中的 DECIMAL 列为 object 类型，先转为数值
+        work = pd.concat(parts, ignore_index=True)[[column] + metrics]
+        work[metrics] = work[metrics].apply(pd.to_numeric, errors="coerce")
+        result = reaggregate(work, [column])
+        if result is None:
+            additive = [c for c in metrics if c in ADDITIVE]
+            result = work.groupby(column, sort=False, as_index=False)[additive].sum()
+        return result.reset_index(drop=True)
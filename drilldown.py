@@ -0,0 +1,162 @@
+import time
+from collections import deque
+from typing import TYPE_CHECKING, List, Optional
+
+from config import drilldown_config
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# 结果中可能出现的维度列，按意图区分目标粒度
+DIMENSION_COLUMNS = {"出院科室", "姓名", "工号", "主刀医生", "带组医师", "带组医师工号", "病种", "主手术代码", "月份"}
+INTENT_DIMENSIONS = {
+    "科室概览": [["出院科室"]],
+    "医师": [["姓名", "工号"], ["姓名"], ["带组医师", "带组医师工号"]],
+    "重点病种": [["主刀医生", "带组医师工号"], ["主刀医生"], ["带组医师", "带组医师工号"]],
+}
+DOCTOR_COLUMNS = ["姓名", "主刀医生", "带组医师"]
+COUNT_COLUMNS = ["出院人数", "例数"]
+
+ADDITIVE = {"出院人数", "例数", "手术例数", "出院患者手术台次数", "出院患者四级手术台次数", "出院患者微创手术台次数",
+            "总手术台次数", "四级手术台次数", "微创手术台次数", "总费用", "总药费", "总卫生材料费", "住院天数"}
+PER_CASE = {"均次费", "住院均次费用", "均次药费", "均次卫生材料费", "平均住院日"}
+FEE_RATIO = {"药占比", "耗占比", "去药去耗材占比", "药占比（住院）", "耗占比（住院）"}
+# 比例指标 -> (分子列, 分母列, 倍数)
+SURGERY_RATIO = {
+    "出院患者手术占比": ("出院患者手术台次数", "出院人数", 100.0),
+    "出院患者四级手术比例": ("出院患者四级手术台次数", "出院患者手术台次数", 100.0),
+    "出院患者微创手术比例": ("出院患者微创手术台次数", "出院患者手术台次数", 100.0),
+    "出院患者微创手术占比": ("出院患者微创手术台次数", "出院患者手术台次数", 100.0),
+}
+DIMENSION_METRICS = {"姓名", "工号", "病种", "主刀医师"}
+
+
+def covers(source: List[str], target: List[str]) -> bool:
+    """缓存结果的筛选范围是否包含目标的范围，空列表表示不限"""
+    if not source:
+        return True
+    return bool(target) and set(target) <= set(source)
+
+
+def find_column(df: "pd.DataFrame", metric: str) -> Optional[str]:
+    for name in (metric, metric.replace("（住院）", "")):
+        if name in df.columns:
+            return name
+    return None
+
+
+def reaggregate(df: "pd.DataFrame", by: List[str]) -> Optional["pd.DataFrame"]:
+    """按更粗的维度重新汇总，比例和均值指标按权重重算；有无法重算的列时返回None"""
+    count = next((c for c in COUNT_COLUMNS if c in df.columns), None)
+    fee_total = "总费用" if "总费用" in df.columns else None
+    if fee_total is None and count is not None:
+        mean_fee = next((c for c in ("均次费", "住院均次费用") if c in df.columns), None)
+        if mean_fee is not None:
+            fee_total = "__总费用"
+            df = df.assign(__总费用=df[mean_fee] * df[count])
+    work, weighted = df.copy(), {}
+    for column in df.columns:
+        if column in by or column.startswith("__"):
+            continue
+        if column in ADDITIVE:
+            continue
+        if column in PER_CASE and count is not None:
+            weighted[column] = count
+        elif column in FEE_RATIO and fee_total is not None:
+            weighted[column] = fee_total
+        elif column in SURGERY_RATIO and all(c in df.columns for c in SURGERY_RATIO[column][:2]):
+            continue
+        elif column in DIMENSION_COLUMNS:
+            continue
+        else:
+            return None
+    for column, weight in weighted.items():
+        work[column] = df[column].astype(float) * df[weight].astype(float)
+    sums = [c for c in df.columns if c in ADDITIVE or c in weighted or c == fee_total]
+    grouped = work.groupby(by, sort=False, as_index=False)[sums].sum()
+    for column, weight in weighted.items():
+        grouped[column] = grouped[column] / grouped[weight].astype(float)
+    for column, (numerator, denominator, scale) in SURGERY_RATIO.items():
+        if column in df.columns:
+            grouped[column] = grouped[numerator] * scale / grouped[denominator].astype(float)
+    columns = [c for c in df.columns if c in grouped.columns and not c.startswith("__")]
+    return grouped[columns]
+
+
+class CachedResult:
+    def __init__(self, slot_result, sql: str, df: "pd.DataFrame"):
+        self.slot_result = slot_result
+        self.sql = sql
+        self.df = df
+        self.created = time.time()
+
+
+class ResultReuse:
+    """从已缓存的更宽泛结果中过滤或重新汇总，回答科室子集、医师子集等下钻问题"""
+
+    def __init__(self, config=None):
+        if config is None:
+            config = drilldown_config
+        self.config = config
+        self.entries = deque(maxlen=self.config.get("max_entries", 32))
+        self.ttl = self.config.get("ttl", 600)
+
+    def remember(self, slot_result, sql: str, df: "pd.DataFrame"):
+        import pandas as pd
+
+        if slot_result is not None and isinstance(df, pd.DataFrame):
+            self.entries.appendleft(CachedResult(slot_result, sql, df))
+
+    def answer(self, slot_result):
+        """返回 (来源SQL, 结果)，没有可复用的结果时返回 (None, None)"""
+        if slot_result is None:
+            return None, None
+        for entry in list(self.entries):
+            if time.time() - entry.created > self.ttl:
+                continue
+            result = self.derive(entry, slot_result)
+            if result is not None:
+                return entry.sql, result
+        return None, None
+
+    def derive(self, entry: CachedResult, target) -> Optional["pd.DataFrame"]:
+        source, df = entry.slot_result, entry.df
+        if source.slots["意图"] != target.slots["意图"] or sorted(source.diseases) != sorted(target.diseases):
+            return None
+        if not covers(source.wards, target.wards):
+            return None
+        if set(target.wards) != set(source.wards):
+            if "出院科室" not in df.columns:
+                return None
+            df = df[df["出院科室"].isin(target.wards)]
+
+        if sorted(source.doctors) != sorted(target.doctors):
+            doctor_column = next((c for c in DOCTOR_COLUMNS if c in df.columns), None)
+            # 只含部分医师的结果不能回答全体医师的问题
+            if doctor_column is None or not covers(source.doctors, target.doctors):
+                return None
+            if target.doctors:
+                df = df[df[doctor_column].isin(target.doctors)]
+
+        if (source.start, source.end) != (target.start, target.end):
+            if "月份" not in df.columns or not (source.start <= target.start and target.end <= source.end):
+                return None
+            if not (target.start.endswith("-01") and target.end[8:] >= "28"):
+                return None
+            months = df["月份"].astype(str).str[:7]
+            df = df[(months >= target.start[:7]) & (months <= target.end[:7])]
+
+        metrics = [m for m in target.slots["指标"] if m not in DIMENSION_METRICS]
+        columns = [find_column(df, m) for m in metrics]
+        if any(c is None for c in columns):
+            return None
+        dimensions = next((d for d in INTENT_DIMENSIONS.get(target.slots["意图"], []) if set(d) <= set(df.columns)), None)
+        if dimensions is None:
+            return None
+        extra = [c for c in df.columns if c in DIMENSION_COLUMNS and c not in dimensions]
+        if extra:
+            df = reaggregate(df, dimensions)
+            if df is None or any(c not in df.columns for c in columns):
+                return None
+        keep = dimensions + [c for c in dict.fromkeys(columns) if c not in dimensions]
+        return df[keep].reset_index(drop=True)
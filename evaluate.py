@@ -0,0 +1,167 @@
+import argparse
+import json
+import math
+import os
+import time
+from contextlib import nullcontext
+from decimal import Decimal
+from typing import Dict, List
+
+from config import base_config, vllm_config
+from local_db import connect_sqlite, make_run_sql
+from replay import Cassette, LLMStandIn, quiet, run_question
+from tracing import TraceCollector, percentile
+
+
+def read_examples(path: str) -> List[Dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)["examples"]
+
+
+def normalize_value(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if hasattr(value, "item"):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if isinstance(value, str):
+        value = value.strip()
+        try:
+            return float(value)
+        except ValueError:
+            return value
+    return value
+
+
+def values_match(a, b, rel_tol: float, abs_tol: float) -> bool:
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)) and not isinstance(a, bool):
+        return math.isclose(a, b, rel_tol=rel_tol, abs_tol=abs_tol)
+    return a == b
+
+
+def sort_key(row):
+    # 数值先四舍五入再排序，使容差内的行排在相同位置
+    return [(0, round(v, 4)) if isinstance(v, (int, float)) else (1, "") if v is None else (2, str(v)) for v in row]
+
+
+def results_match(predicted, gold, rel_tol: float = 1e-4, abs_tol: float = 1e-6) -> bool:
+    """忽略行顺序比较两个结果集，数值按容差比较
+
+    列名相同时按列名对齐，否则按列位置比较。
+    """
+    if predicted.shape != gold.shape:
+        return False
+    if sorted(map(str, predicted.columns)) == sorted(map(str, gold.columns)) and predicted.columns.is_unique:
+        predicted = predicted[list(gold.columns)]
+    rows_p = sorted(([normalize_value(v) for v in row] for row in predicted.itertuples(index=False)), key=sort_key)
+    rows_g = sorted(([normalize_value(v) for v in row] for row in gold.itertuples(index=False)), key=sort_key)
+    return all(values_match(a, b, rel_tol, abs_tol) for rp, rg in zip(rows_p, rows_g) for a, b in zip(rp, rg))
+
+
+def build_pipeline(run_sql, host: str = None):
+    """使用本地数据库的流水线；host 为空时连接 config 中的大模型并从向量库检索"""
+    if host is None:
+        from rag_sql import RAG_SQL
+
+        pipeline = quiet(RAG_SQL())
+    else:
+        from Vllm import Vllm
+
+        pipeline = quiet(Vllm({"vllm_host": host, "model": vllm_config["model"]}))
+    pipeline.run_sql = run_sql
+    pipeline.run_sql_is_set = True
+    pipeline.warmup()
+    return pipeline
+
+
+def evaluate(examples: List[Dict], run_sql, cassette: Cassette = None, rel_tol: float = 1e-4,
+             abs_tol: float = 1e-6) -> Dict:
+    results = []
+    standin = LLMStandIn(cassette) if cassette is not None else nullcontext()
+    with standin, TraceCollector() as collector:
+        template = build_pipeline(run_sql, standin.url if cassette is not None else None)
+        for example in examples:
+            question = example["question"]
+            pipeline = template.fork()
+            if cassette is not None:
+                for name, value in cassette.data["retrieval"].get(question, {}).items():
+                    setattr(pipeline, name, value)
+            elif hasattr(pipeline, "retrieve"):
+                pipeline.retrieve(question)
+            gold_ok, gold = run_sql(example["SQL"])
+            started = time.perf_counter()
+            result = run_question(pipeline, question)
+            latency = time.perf_counter() - started
+            summary = collector.summary(result["trace_id"])
+            sql, predicted, source = pipeline.last_query or (None, None, None)
+            if not gold_ok:
+                correct = None
+            elif hasattr(predicted, "shape"):
+                correct = results_match(predicted, gold, rel_tol, abs_tol)
+            else:
+                correct = False
+            results.append({
+                "question": question,
+                "correct": correct,
+                "gold_error": None if gold_ok else str(gold),
+                "sql": sql,
+                "source": source,
+                "answer": result["answer"],
+                "error": result["error"],
+                "latency": latency,
+                "attempts": summary["sql_attempts"],
+                "llm_calls": summary["llm_calls"],
+                "prompt_tokens": summary["prompt_tokens"],
+                "completion_tokens": summary["completion_tokens"],
+            })
+    scored = [r for r in results if r["correct"] is not None]
+    latencies = [r["latency"] for r in results]
+    count = len(results) or 1
+    return {
+        "questions": len(results),
+        "scored": len(scored),
+        "execution_accuracy": sum(1 for r in scored if r["correct"]) / len(scored) if scored else 0.0,
+        "latency_p50": percentile(latencies, 50),
+        "latency_p95": percentile(latencies, 95),
+        "llm_calls_per_question": sum(r["llm_calls"] for r in results) / count,
+        "tokens_per_question": sum(r["prompt_tokens"] + r["completion_tokens"] for r in results) / count,
+        "results": results,
+    }
+
+
+def print_report(report: Dict):
+    print(f"{'正确':<4}{'耗时(s)':>9}{'尝试':>5}{'调用':>5}{'tokens':>8}  问题")
+    for r in report["results"]:
+        mark = "-" if r["correct"] is None else ("Y" if r["correct"] else "N")
+        tokens = r["prompt_tokens"] + r["completion_tokens"]
+        print(f"{mark:<6}{r['latency']:>9.2f}{r['attempts']:>6}{r['llm_calls']:>6}{tokens:>9}  {r['question']}")
+    print(f"执行准确率: {report['execution_accuracy']:.2%} ({report['scored']}/{report['questions']} 可评分)")
+    print(f"耗时: p50 {report['latency_p50']:.2f}s  p95 {report['latency_p95']:.2f}s  "
+          f"每个问题大模型调用 {report['llm_calls_per_question']:.2f} 次, tokens {report['tokens_per_question']:.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="以 example.json 为标准答案，评估流水线的执行准确率和耗时")
+    parser.add_argument("--examples", default=os.path.join(base_config["prefix_dir"], base_config["example_json"]))
+    parser.add_argument("--ddl", default=os.path.join(base_config["prefix_dir"], base_config["SQL_DDL_file"]))
+    parser.add_argument("--db", default=":memory:", help="本地 SQLite 数据库文件，不存在的表按 --ddl 创建")
+    parser.add_argument("--cassette", help="使用录制的大模型响应离线评估，见 replay.py")
+    parser.add_argument("--rel-tol", type=float, default=1e-4)
+    parser.add_argument("--abs-tol", type=float, default=1e-6)
+    parser.add_argument("--output", help="把逐题结果写入 JSON 文件")
+    args = parser.parse_args()
+    with open(args.ddl, "r", encoding="utf-8") as f:
+        conn = connect_sqlite(args.db, f.read())
+    if args.db == ":memory:":
+        print("注意: 使用空的内存数据库，空结果集之间的比较没有区分度，建议通过 --db 指定已导入数据的库")
+    cassette = Cassette(args.cassette) if args.cassette else None
+    report = evaluate(read_examples(args.examples), make_run_sql(conn), cassette, args.rel_tol, args.abs_tol)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=1, default=str)
+
+
+if __name__ == "__main__":
+    main()
@@ -42,3 +42,41 @@ class APIError(Exception):
     """Raise for API errors"""
 
     pass
+
+
+class QueryTooExpensiveError(Exception):
+    """Raise when the query plan exceeds the configured cost limits"""
+
+    def __init__(self, cost, max_rows, max_cost):
+        self.cost = cost
+        super().__init__(
+            f"查询代价过高，已拒绝执行: 预计扫描 {cost['rows_examined']:.0f} 行(上限 {max_rows})，"
+            f"优化器代价 {cost['query_cost']:.0f}(上限 {max_cost})，全表扫描: {cost['full_scans'] or '无'}。"
+            "请检查是否缺少出院日期/出院科室过滤条件或存在笛卡尔积连接，并改写SQL。"
+        )
+
+
+class CoalesceCancelledError(Exception):
+    """Raise when a waiter gives up on a coalesced in-flight call"""
+
+    pass
+
+
+class ClarificationRequired(Exception):
+    """Raise when the question needs more information from the user"""
+
+    def __init__(self, message):
+        self.message = message
+        super().__init__(message)
+
+
+class DeadlineExceeded(Exception):
+    """Raise when a question runs out of its time budget
+
+    partial holds what the pipeline had produced so far, such as the generated SQL.
+    """
+
+    def __init__(self, stage, partial=None):
+        self.stage = stage
+        self.partial = partial or {}
+        super().__init__(f"处理超时，已在 {stage} 阶段中止")
@@ -0,0 +1,329 @@
+import argparse
+import json
+import os
+import re
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+from config import base_config
+from local_db import add_mysql_arguments, benchmark_mysql_target, connect_sqlite, mysql_to_sqlite
+from sql_utils import KEYWORDS, referenced_tables, significant, tokenize
+
+LOG_LINE_RE = re.compile(r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d+ - \w+ ----- ", re.M)
+
+# 无统计信息时的经验选择率
+EQ_SELECTIVITY = 0.05
+RANGE_SELECTIVITY = 0.25
+PREFIX_SELECTIVITY = 0.02
+MAX_INDEX_COLUMNS = 4
+
+
+def read_log_text(path: str) -> str:
+    with open(path, "rb") as f:
+        raw = f.read()
+    for encoding in ("utf-8", "gbk"):
+        try:
+            return raw.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return raw.decode("utf-8", errors="ignore")
+
+
+def read_log_entries(path: str, prefix: str) -> List[str]:
+    """按时间戳切分日志，返回以 prefix 开头的条目内容（可跨多行）"""
+    text = read_log_text(path)
+    entries = LOG_LINE_RE.split(text)
+    return [e[len(prefix):].strip() for e in entries if e.startswith(prefix)]
+
+
+def read_example_sql(path: str) -> List[str]:
+    with open(path, "r", encoding="utf-8") as f:
+        return [e["SQL"] for e in json.load(f).get("examples", [])]
+
+
+class Predicate:
+    def __init__(self, table: str, column: str, kind: str, values: int = 1):
+        self.table = table
+        self.column = column
+        self.kind = kind
+        self.values = values
+
+    @property
+    def selectivity(self) -> float:
+        if self.kind == "eq":
+            return min(1.0, EQ_SELECTIVITY * self.values)
+        if self.kind == "prefix":
+            return min(1.0, PREFIX_SELECTIVITY * self.values)
+        return RANGE_SELECTIVITY
+
+
+class WorkloadAnalyzer:
+    """解析SQL工作负载，按表统计过滤、连接、分组列"""
+
+    def __init__(self, schema: Dict[str, List[str]]):
+        self.schema = schema
+
+    def column_table(self, column: str, qualifier: str, tables: List[str]):
+        if qualifier in self.schema and column in self.schema[qualifier]:
+            return qualifier
+        for table in tables:
+            if column in self.schema.get(table, []):
+                return table
+        return None
+
+    def analyze(self, sql: str) -> Tuple[List[Predicate], Dict[str, List[str]]]:
+        tokens = significant(tokenize(sql))
+        tables = referenced_tables(sql)
+        predicates, group_by = [], defaultdict(list)
+        clause, stack = "SELECT", []
+        i = 0
+        while i < len(tokens):
+            kind, text = tokens[i]
+            upper = text.upper() if kind == "word" else ""
+            if text == "(":
+                stack.append(clause)
+            elif text == ")":
+                clause = stack.pop() if stack else clause
+            elif upper in ("SELECT", "FROM", "WHERE", "ON", "HAVING", "ORDER", "LIMIT", "JOIN"):
+                clause = upper
+            elif upper == "GROUP":
+                clause = "GROUP"
+            elif kind == "word" and upper not in KEYWORDS:
+                qualifier, column, j = "", text, i + 1
+                if j + 1 < len(tokens) and tokens[j][1] == ".":
+                    qualifier, column, j = text, tokens[j + 1][1], j + 2
+                table = self.column_table(column, qualifier, tables)
+                if table and clause in ("WHERE", "ON"):
+                    predicate = self.read_predicate(tokens, j, table, column, tables)
+                    if predicate:
+                        predicates.append(predicate)
+                elif table and clause == "GROUP" and column not in group_by[table]:
+                    group_by[table].append(column)
+                i = j
+                continue
+            i += 1
+        return predicates, group_by
+
+    def read_predicate(self, tokens, j, table, column, tables):
+        if j >= len(tokens):
+            return None
+        op = tokens[j][1].upper()
+        if op == "=":
+            return Predicate(table, column, "eq")
+        if op == "IN":
+            depth, values, k = 0, 0, j + 1
+            while k < len(tokens):
+                if tokens[k][1] == "(":
+                    depth += 1
+                elif tokens[k][1] == ")":
+                    depth -= 1
+                    if depth == 0:
+                        break
+                elif depth == 1 and tokens[k][0] in ("string", "number"):
+                    values += 1
+                k += 1
+            return Predicate(table, column, "eq", max(values, 1))
+        if op in ("BETWEEN", "<", ">", "<=", ">="):
+            return Predicate(table, column, "range")
+        if op == "LIKE" and j + 1 < len(tokens) and tokens[j + 1][0] == "string":
+            if not tokens[j + 1][1][1:].startswith("%"):
+                return Predicate(table, column, "prefix")
+        return None
+
+
+def plan_selectivity(index: Tuple[str, ...], predicates: List[Predicate]) -> float:
+    """索引可用前缀上的累计选择率，遇到范围条件即停止"""
+    by_column = {}
+    for p in predicates:
+        by_column.setdefault(p.column, []).append(p)
+    selectivity = 1.0
+    for column in index:
+        if column not in by_column:
+            break
+        group = by_column[column]
+        selectivity *= min(p.selectivity for p in group)
+        if any(p.kind != "eq" for p in group):
+            break
+    return selectivity
+
+
+class SqliteExplainer:
+    def __init__(self, ddl: str):
+        self.conn = connect_sqlite(ddl=ddl)
+
+    def schema(self) -> Tuple[Dict[str, List[str]], List[Tuple[str, Tuple[str, ...]]]]:
+        schema, indexes = {}, []
+        tables = [r[0] for r in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+        for table in tables:
+            schema[table] = [r[1] for r in self.conn.execute(f'PRAGMA table_info("{table}")')]
+            for row in self.conn.execute(f'PRAGMA index_list("{table}")'):
+                columns = tuple(r[2] for r in self.conn.execute(f'PRAGMA index_info("{row[1]}")'))
+                indexes.append((table, columns))
+        return schema, indexes
+
+    def create_index(self, name, table, columns):
+        self.conn.execute(f'CREATE INDEX "{name}" ON "{table}" ({", ".join(columns)})')
+
+    def drop_index(self, name, table):
+        self.conn.execute(f'DROP INDEX "{name}"')
+
+    def uses_index(self, sql: str, name: str) -> bool:
+        try:
+            plan = self.conn.execute("EXPLAIN QUERY PLAN " + mysql_to_sqlite(sql)).fetchall()
+        except Exception:
+            return False
+        return any(f"INDEX {name} " in row[-1] + " " for row in plan)
+
+
+class MysqlExplainer:
+    """在本地MySQL上建索引并用 EXPLAIN FORMAT=JSON 验证，切勿指向生产库"""
+
+    def __init__(self, host, dbname, user, password, port, **kwargs):
+        import pymysql
+        self.conn = pymysql.connect(host=host, user=user, password=password, database=dbname, port=port)
+
+    def schema(self):
+        schema, indexes = {}, []
+        with self.conn.cursor() as cs:
+            cs.execute("SELECT TABLE_NAME, COLUMN_NAME FROM information_schema.COLUMNS "
+                       "WHERE TABLE_SCHEMA = DATABASE() ORDER BY ORDINAL_POSITION")
+            for table, column in cs.fetchall():
+                schema.setdefault(table, []).append(column)
+            cs.execute("SELECT TABLE_NAME, INDEX_NAME, COLUMN_NAME FROM information_schema.STATISTICS "
+                       "WHERE TABLE_SCHEMA = DATABASE() ORDER BY TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX")
+            grouped = defaultdict(list)
+            for table, index, column in cs.fetchall():
+                grouped[(table, index)].append(column)
+        indexes = [(table, tuple(columns)) for (table, _), columns in grouped.items()]
+        return schema, indexes
+
+    def create_index(self, name, table, columns):
+        with self.conn.cursor() as cs:
+            cs.execute(f"CREATE INDEX `{name}` ON `{table}` ({', '.join(f'`{c}`' for c in columns)})")
+
+    def drop_index(self, name, table):
+        with self.conn.cursor() as cs:
+            cs.execute(f"DROP INDEX `{name}` ON `{table}`")
+
+    def uses_index(self, sql: str, name: str) -> bool:
+        try:
+            with self.conn.cursor() as cs:
+                cs.execute("EXPLAIN FORMAT=JSON " + sql)
+                plan = cs.fetchone()[0]
+        except Exception:
+            return False
+        return f'"key": "{name}"' in plan
+
+
+class IndexAdvisor:
+    def __init__(self, explainer):
+        self.explainer = explainer
+        self.schema, self.existing = explainer.schema()
+        self.analyzer = WorkloadAnalyzer(self.schema)
+
+    def existing_selectivity(self, table: str, predicates: List[Predicate]) -> float:
+        best = 1.0
+        for index_table, columns in self.existing:
+            if index_table == table:
+                best = min(best, plan_selectivity(columns, predicates))
+        return best
+
+    @staticmethod
+    def candidate_columns(predicates: List[Predicate], group_by: List[str], frequency) -> Tuple[str, ...]:
+        eq = sorted({p.column for p in predicates if p.kind == "eq"}, key=lambda c: -frequency[c])
+        ranges = sorted({p.column for p in predicates if p.kind != "eq"} - set(eq), key=lambda c: -frequency[c])
+        columns = eq + ranges[:1]
+        if not ranges:
+            columns += [c for c in group_by if c not in columns]
+        return tuple(columns[:MAX_INDEX_COLUMNS])
+
+    def advise(self, workload: List[Tuple[str, float]], top: int = 10) -> List[Dict]:
+        analyzed, frequency = [], defaultdict(float)
+        for sql, weight in workload:
+            predicates, group_by = self.analyzer.analyze(sql)
+            analyzed.append((sql, weight, predicates, group_by))
+            for p in predicates:
+                frequency[p.column] += weight
+
+        candidates = defaultdict(lambda: {"weight": 0.0, "statements": []})
+        for sql, weight, predicates, group_by in analyzed:
+            for table in {p.table for p in predicates}:
+                table_predicates = [p for p in predicates if p.table == table]
+                columns = self.candidate_columns(table_predicates, group_by.get(table, []), frequency)
+                if not columns or any(idx[:len(columns)] == columns for t, idx in self.existing if t == table):
+                    continue
+                candidates[(table, columns)]["weight"] += weight
+                candidates[(table, columns)]["statements"].append((sql, weight, table_predicates))
+
+        # 较短的候选若是较长候选的前缀，由较长的索引同时覆盖
+        for (table, columns) in sorted(candidates, key=lambda k: len(k[1])):
+            for (other_table, other) in candidates:
+                if other_table == table and len(other) > len(columns) and other[:len(columns)] == columns:
+                    candidates[(other_table, other)]["statements"].extend(candidates[(table, columns)]["statements"])
+                    candidates[(table, columns)]["statements"] = []
+                    break
+        report = []
+        for (table, columns), info in candidates.items():
+            if not info["statements"]:
+                continue
+            benefit = sum(
+                weight * max(0.0, self.existing_selectivity(table, preds) - plan_selectivity(columns, preds))
+                for _, weight, preds in info["statements"]
+            )
+            name = ("idx_" + "_".join((table,) + columns))[:64]
+            verified = self.verify(name, table, columns, [s for s, _, _ in info["statements"]])
+            report.append({
+                "table": table,
+                "columns": columns,
+                "benefit": round(benefit, 3),
+                "frequency": sum(w for _, w, _ in info["statements"]),
+                "verified": verified,
+                "statements": len(info["statements"]),
+                "ddl": f"CREATE INDEX `{name}` ON `{table}` ({', '.join(f'`{c}`' for c in columns)});",
+            })
+        report.sort(key=lambda r: (-r["benefit"], -r["verified"]))
+        return report[:top]
+
+    def verify(self, name, table, columns, statements) -> int:
+        try:
+            self.explainer.create_index(name, table, columns)
+        except Exception:
+            return 0
+        try:
+            return sum(1 for sql in statements if self.explainer.uses_index(sql, name))
+        finally:
+            self.explainer.drop_index(name, table)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="根据日志和示例SQL推荐复合索引")
+    parser.add_argument("--log", default=base_config["log_dir"])
+    parser.add_argument("--examples", default=os.path.join(base_config["prefix_dir"], base_config["example_json"]))
+    parser.add_argument("--ddl", default=os.path.join(base_config["prefix_dir"], base_config["SQL_DDL_file"]))
+    parser.add_argument("--example-weight", type=float, default=1.0)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--mysql", action="store_true", help="在本地测试MySQL上建索引做 EXPLAIN 验证，见 --mysql-host 等参数")
+    add_mysql_arguments(parser)
+    args = parser.parse_args()
+
+    workload = []
+    if os.path.isfile(args.log):
+        workload += [(sql, 1.0) for sql in read_log_entries(args.log, "sql:")]
+    if os.path.isfile(args.examples):
+        workload += [(sql, args.example_weight) for sql in read_example_sql(args.examples)]
+    if args.mysql:
+        explainer = MysqlExplainer(**benchmark_mysql_target(args))
+    else:
+        with open(args.ddl, "r", encoding="utf-8") as f:
+            explainer = SqliteExplainer(f.read())
+
+    report = IndexAdvisor(explainer).advise(workload, top=args.top)
+    print(f"共分析 {len(workload)} 条SQL")
+    for rank, item in enumerate(report, 1):
+        print(f"{rank}. 预计收益 {item['benefit']:.3f}  频次 {item['frequency']:.0f}  "
+              f"EXPLAIN命中 {item['verified']}/{item['statements']}")
+        print(f"   {item['ddl']}")
+
+
+if __name__ == "__main__":
+    main()
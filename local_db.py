@@ -0,0 +1,111 @@
+import re
+import sqlite3
+from datetime import date
+
+import pandas as pd
+
+import deadline
+from config import benchmark_mysql_config, mysql_config
+from exceptions import DeadlineExceeded, ImproperlyConfigured
+from sql_utils import tokenize
+
+
+def add_mysql_arguments(parser):
+    """造数、压测等会写库或建索引的命令行工具的MySQL连接参数，默认取 benchmark_mysql_config"""
+    parser.add_argument("--mysql-host", default=benchmark_mysql_config["host"])
+    parser.add_argument("--mysql-port", type=int, default=benchmark_mysql_config["port"])
+    parser.add_argument("--mysql-user", default=benchmark_mysql_config["user"])
+    parser.add_argument("--mysql-password", default=benchmark_mysql_config["password"])
+    parser.add_argument("--mysql-db", default=benchmark_mysql_config["dbname"])
+
+
+def benchmark_mysql_target(args) -> dict:
+    """命令行参数对应的连接配置，指向 mysql_config 的生产库服务器时拒绝"""
+    target = {"host": args.mysql_host, "port": args.mysql_port, "user": args.mysql_user,
+              "password": args.mysql_password, "dbname": args.mysql_db}
+    if target["host"] == mysql_config["host"] or target["dbname"] == mysql_config["dbname"]:
+        raise ImproperlyConfigured(f"拒绝在生产库 {target['host']}/{target['dbname']} 上执行，"
+                                   "请使用 benchmark_mysql_config 或 --mysql-host/--mysql-db 指定本地测试库")
+    return target
+
+
+def datediff(end, start):
+    if end is None or start is None:
+        return None
+    return (date.fromisoformat(str(end)[:10]) - date.fromisoformat(str(start)[:10])).days
+
+
+def mysql_ddl_to_sqlite(ddl: str) -> list:
+    """把 create_tables.sql 中的 MySQL 建表语句转换为 SQLite 语句，表内 INDEX 拆成单独的 CREATE INDEX"""
+    statements = []
+    for statement in ddl.split(";"):
+        if not statement.strip():
+            continue
+        table = re.search(r"CREATE TABLE(?: IF NOT EXISTS)?\s+`?(\w+)`?", statement).group(1)
+        body = statement[statement.index("(") + 1:statement.rindex(")")]
+        columns, indexes = [], []
+        for line in body.split(",\n"):
+            line = line.strip().rstrip(",")
+            index = re.match(r"(?:INDEX|KEY)\s+`?(\w+)`?\s*\((.+)\)", line, re.I)
+            if index:
+                indexes.append(f"CREATE INDEX IF NOT EXISTS {index.group(1)} ON {table} ({index.group(2)})")
+                continue
+            line = re.sub(r"\s+comment\s+'[^']*'", "", line, flags=re.I)
+            line = re.sub(r"ENUM\([^)]*\)", "TEXT", line, flags=re.I)
+            line = re.sub(r"DECIMAL\(\d+,\s*\d+\)", "REAL", line, flags=re.I)
+            columns.append(line)
+        statements.append(f"CREATE TABLE IF NOT EXISTS {table} (\n    " + ",\n    ".join(columns) + "\n)")
+        statements.extend(indexes)
+    return statements
+
+
+def mysql_to_sqlite(sql: str) -> str:
+    """按 MySQL 语义改写查询：双引号为字符串，'/' 为小数除法，去掉优化器提示"""
+    parts = []
+    for kind, text in tokenize(sql):
+        if kind == "string" and text.startswith('"'):
+            text = "'" + text[1:-1].replace('\\"', '"').replace("'", "''") + "'"
+        elif kind == "op" and text == "/":
+            text = "* 1.0 /"
+        elif kind == "comment" and text.startswith("/*+"):
+            text = ""
+        elif kind == "word" and not re.fullmatch(r"\w+", text):
+            text = f'"{text}"'
+        parts.append(text)
+    return "".join(parts)
+
+
+def connect_sqlite(path: str = ":memory:", ddl: str = None) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.create_function("DATEDIFF", 2, datediff, deterministic=True)
+    if ddl:
+        for statement in mysql_ddl_to_sqlite(ddl):
+            conn.execute(statement)
+        conn.commit()
+    return conn
+
+
+def make_run_sql(conn: sqlite3.Connection):
+    def run_sql_sqlite(sql: str):
+        deadline.check("db")
+        interrupted = None
+        try:
+            with deadline.on_expiry(conn.interrupt) as interrupted:
+                cs = conn.execute(mysql_to_sqlite(sql))
+                rows = cs.fetchall()
+            df = pd.DataFrame(rows, columns=[desc[0] for desc in cs.description])
+            return True, df
+        except Exception as e:
+            if interrupted is not None and interrupted.is_set():
+                raise DeadlineExceeded("db") from e
+            return False, e
+    return run_sql_sqlite
+
+
+def make_execute_sql(conn: sqlite3.Connection):
+    def execute_sql_sqlite(sql: str, args=None):
+        sql = mysql_to_sqlite(sql).replace("%s", "?")
+        cs = conn.execute(sql, args or ())
+        conn.commit()
+        return cs.rowcount
+    return execute_sql_sqlite
@@ -0,0 +1,136 @@
+import json
+import time
+from typing import Dict, List, Tuple
+
+from config import guard_config
+from exceptions import QueryTooExpensiveError
+from sql_utils import tokenize
+
+AGGREGATE_FUNCTIONS = {"COUNT", "SUM", "AVG", "MIN", "MAX", "GROUP_CONCAT"}
+
+
+def _depth_zero(tokens: List[Tuple[str, str]]):
+    """遍历括号深度为0的 (位置, 类型, 大写文本)"""
+    depth = 0
+    for i, (kind, text) in enumerate(tokens):
+        if text == "(":
+            depth += 1
+        elif text == ")":
+            depth -= 1
+        elif depth == 0:
+            yield i, kind, text.upper() if kind == "word" else text
+
+
+def add_execution_time_hint(sql: str, milliseconds: int) -> str:
+    """在最外层 SELECT 后加入 MAX_EXECUTION_TIME 优化器提示"""
+    if "MAX_EXECUTION_TIME" in sql.upper():
+        return sql
+    tokens = tokenize(sql, raw=True)
+    for i, kind, text in _depth_zero(tokens):
+        if kind == "word" and text == "SELECT":
+            tokens.insert(i + 1, ("comment", f" /*+ MAX_EXECUTION_TIME({milliseconds}) */"))
+            break
+    return "".join(text for _, text in tokens)
+
+
+def add_limit(sql: str, limit: int) -> str:
+    """最外层查询不是聚合查询且没有 LIMIT 时，追加 LIMIT"""
+    tokens = tokenize(sql, raw=True)
+    words, main_select = [], None
+    depth_zero = list(_depth_zero(tokens))
+    for i, kind, text in depth_zero:
+        if kind == "word" and text == "SELECT":
+            main_select = i
+    if main_select is None:
+        return sql
+    for i, kind, text in depth_zero:
+        if i > main_select and kind == "word":
+            words.append((i, text))
+    names = {text for _, text in words}
+    if names & {"LIMIT", "GROUP", "DISTINCT", "UNION"}:
+        return sql
+    for i, text in words:
+        following = next((t for k, t in tokens[i + 1:] if k not in ("ws", "comment")), "")
+        if text in AGGREGATE_FUNCTIONS and following == "(":
+            return sql
+    body = sql.rstrip().rstrip(";").rstrip()
+    return f"{body}\nLIMIT {limit};"
+
+
+def estimate_rows(plan: Dict) -> Tuple[float, List[str]]:
+    """按 EXPLAIN FORMAT=JSON 估算扫描行数，嵌套循环连接按前缀行数相乘"""
+    examined, full_scans = 0.0, []
+
+    def walk_table(table: Dict, prefix: float) -> float:
+        nonlocal examined
+        rows = float(table.get("rows_examined_per_scan", 0))
+        examined += prefix * rows
+        if table.get("access_type") == "ALL":
+            full_scans.append(table.get("table_name", ""))
+        for value in table.values():
+            if isinstance(value, (dict, list)):
+                walk(value, 1.0)
+        return float(table.get("rows_produced_per_join", prefix * rows))
+
+    def walk(node, prefix: float = 1.0):
+        if isinstance(node, list):
+            for item in node:
+                walk(item, prefix)
+        elif isinstance(node, dict):
+            for key, value in node.items():
+                if key == "nested_loop":
+                    produced = prefix
+                    for item in value:
+                        produced = walk_table(item.get("table", {}), produced)
+                elif key == "table" and isinstance(value, dict):
+                    walk_table(value, prefix)
+                elif isinstance(value, (dict, list)):
+                    walk(value, prefix)
+
+    walk(plan)
+    return examined, full_scans
+
+
+class QueryGuard:
+    """执行生成的SQL前做 EXPLAIN 预检，加超时提示和 LIMIT，拒绝代价过高的计划"""
+
+    def __init__(self, config=None):
+        if config is None:
+            config = guard_config
+        self.config = config
+        self.max_rows = self.config.get("max_rows", 5000000)
+        self.max_cost = self.config.get("max_cost", 1000000)
+        self.max_execution_time = self.config.get("max_execution_time", 30000)
+        self.default_limit = self.config.get("default_limit", 1000)
+        self.plan_log = self.config.get("plan_log", "")
+
+    def rewrite(self, sql: str, limit: bool = True) -> str:
+        """limit 为 False 时只加超时提示，用于需要完整结果的导出"""
+        if self.default_limit and limit:
+            sql = add_limit(sql, self.default_limit)
+        if self.max_execution_time:
+            sql = add_execution_time_hint(sql, self.max_execution_time)
+        return sql
+
+    def inspect(self, sql: str, plan: Dict) -> Dict:
+        query_block = plan.get("query_block", {})
+        rows, full_scans = estimate_rows(query_block)
+        cost = {
+            "sql": sql,
+            "query_cost": float(query_block.get("cost_info", {}).get("query_cost", 0)),
+            "rows_examined": rows,
+            "full_scans": full_scans,
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        self.record(cost)
+        return cost
+
+    def check(self, cost: Dict):
+        if cost["rows_examined"] > self.max_rows or cost["query_cost"] > self.max_cost:
+            raise QueryTooExpensiveError(cost, self.max_rows, self.max_cost)
+
+    def record(self, cost: Dict):
+        if not self.plan_log:
+            return
+        with open(self.plan_log, "a", encoding="utf-8") as f:
+            f.write(json.dumps(cost, ensure_ascii=False) + "\n")
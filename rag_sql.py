@@ -1,7 +1,19 @@
 from  Vllm import Vllm
 from class_chromadb import Chromadb
 from config import  vllm_config, chromadb_config, mysql_config
+from tracing import span
 class RAG_SQL(Vllm, Chromadb):
     def __init__(self):
         Chromadb.__init__(self)
-        Vllm.__init__(self,vllm_config)
\ No newline at end of file
+        Vllm.__init__(self,vllm_config)
+
+    def retrieve(self, question):
+        """检索与问题相似的指标、文档和示例，作为后续提示词的上下文"""
+        with span("retrieval"):
+            self.index_info = self.get_similar_index(question)
+            self.document_info = self.get_similar_document(question)
+            self.example_info = self.get_similar_examples(question)
+
+    def warmup(self):
+        Vllm.warmup(self)
+        Chromadb.warmup(self)
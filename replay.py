@@ -0,0 +1,373 @@
+import argparse
+import hashlib
+import json
+import os
+import threading
+import time
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+from config import base_config, mysql_config, vllm_config
+from exceptions import ClarificationRequired
+from sql_utils import normalize_sql
+from tracing import TraceCollector, percentile, start_trace
+
+
+def llm_key(messages: List[Dict]) -> str:
+    text = json.dumps(messages, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def sql_key(sql: str) -> str:
+    return hashlib.sha256(normalize_sql(sql).encode("utf-8")).hexdigest()
+
+
+def to_json_value(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if hasattr(value, "item"):
+        return value.item()
+    if value is None or isinstance(value, (int, float, str, bool)):
+        return value
+    return str(value)
+
+
+class Cassette:
+    """录制的大模型请求/响应、SQL/结果和检索上下文，保存为一个 JSON 文件
+
+    同一个键可能被请求多次（如重试时提示词相同），按录制顺序依次返回，用完后重复最后一个。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.data = {"llm": {}, "sql": {}, "retrieval": {}}
+        self.cursors = {}
+        if os.path.isfile(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.data.update(json.load(f))
+
+    def save(self):
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f, ensure_ascii=False, indent=1)
+
+    def rewind(self):
+        with self.lock:
+            self.cursors = {}
+
+    def append(self, kind: str, key: str, entry: Dict):
+        with self.lock:
+            self.data[kind].setdefault(key, []).append(entry)
+
+    def next(self, kind: str, key: str):
+        with self.lock:
+            entries = self.data[kind].get(key)
+            if not entries:
+                return None
+            cursor = self.cursors.get((kind, key), 0)
+            self.cursors[(kind, key)] = cursor + 1
+            return entries[min(cursor, len(entries) - 1)]
+
+
+class LLMStandIn:
+    """进程内的 OpenAI 兼容 /v1/chat/completions 服务
+
+    replay 模式从录制中返回响应；record 模式转发到 upstream 并录制。客户端请求流式时按块返回 SSE。
+    """
+
+    def __init__(self, cassette: Cassette, upstream: str = None, auth_key: str = None, latency_scale: float = 0.0,
+                 latency: float = 0.0, chunk_chars: int = 4):
+        self.cassette = cassette
+        self.upstream = upstream
+        self.auth_key = auth_key
+        self.latency_scale = latency_scale
+        self.latency = latency
+        self.chunk_chars = chunk_chars
+        self.requests = 0
+        self.misses = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.make_handler())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def complete(self, body: Dict):
+        """返回 (录制条目, 未命中时的错误信息)"""
+        self.requests += 1
+        key = llm_key(body["messages"])
+        if self.upstream is None:
+            entry = self.cassette.next("llm", key)
+            if entry is None:
+                self.misses += 1
+                return None, "request not in cassette"
+            delay = self.latency + self.latency_scale * entry.get("latency", 0.0)
+            if delay > 0:
+                time.sleep(delay)
+            return entry, None
+
+        import requests
+
+        headers = {"Content-Type": "application/json"}
+        if self.auth_key is not None:
+            headers["Authorization"] = f"Bearer {self.auth_key}"
+        started = time.perf_counter()
+        response = requests.post(f"{self.upstream}/v1/chat/completions", headers=headers,
+                                 json=dict(body, stream=False))
+        response_dict = response.json()
+        entry = {
+            "messages": body["messages"],
+            "content": response_dict["choices"][0]["message"]["content"],
+            "usage": response_dict.get("usage"),
+            "latency": time.perf_counter() - started,
+        }
+        self.cassette.append("llm", key, entry)
+        return entry, None
+
+    def make_handler(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def send_json(self, status: int, payload: Dict):
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                if self.path != "/v1/chat/completions":
+                    self.send_json(404, {"error": "not found"})
+                    return
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                entry, error = standin.complete(body)
+                if entry is None:
+                    self.send_json(404, {"error": error})
+                    return
+                if not body.get("stream"):
+                    self.send_json(200, {
+                        "object": "chat.completion",
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": entry["content"]},
+                                     "finish_reason": "stop"}],
+                        "usage": entry.get("usage"),
+                    })
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+                self.end_headers()
+                content = entry["content"]
+                for start in range(0, len(content), standin.chunk_chars):
+                    chunk = {"choices": [{"index": 0, "delta": {"content": content[start:start + standin.chunk_chars]}}]}
+                    self.wfile.write(b"data: " + json.dumps(chunk, ensure_ascii=False).encode("utf-8") + b"\n\n")
+                if body.get("stream_options", {}).get("include_usage"):
+                    chunk = {"choices": [], "usage": entry.get("usage")}
+                    self.wfile.write(b"data: " + json.dumps(chunk).encode("utf-8") + b"\n\n")
+                self.wfile.write(b"data: [DONE]\n\n")
+
+        return Handler
+
+
+class RecordingDB:
+    """包装真实的 run_sql，录制每条SQL的结果"""
+
+    def __init__(self, cassette: Cassette, run_sql):
+        self.cassette = cassette
+        self.run_sql_inner = run_sql
+
+    def run_sql(self, sql: str):
+        started = time.perf_counter()
+        ok, result = self.run_sql_inner(sql)
+        entry = {"sql": sql, "ok": ok, "latency": time.perf_counter() - started}
+        if ok:
+            entry["columns"] = [str(c) for c in result.columns]
+            entry["rows"] = [[to_json_value(v) for v in row] for row in result.itertuples(index=False)]
+        else:
+            entry["error"] = str(result)
+        self.cassette.append("sql", sql_key(sql), entry)
+        return ok, result
+
+
+class ReplayDB:
+    """按规范化SQL返回录制的结果，可注入延迟；未录制的SQL按执行失败处理"""
+
+    def __init__(self, cassette: Cassette, latency_scale: float = 0.0, latency: float = 0.0):
+        self.cassette = cassette
+        self.latency_scale = latency_scale
+        self.latency = latency
+        self.misses = 0
+
+    def run_sql(self, sql: str):
+        import pandas as pd
+
+        entry = self.cassette.next("sql", sql_key(sql))
+        if entry is None:
+            self.misses += 1
+            return False, Exception("SQL not in cassette: " + sql)
+        delay = self.latency + self.latency_scale * entry.get("latency", 0.0)
+        if delay > 0:
+            time.sleep(delay)
+        if not entry["ok"]:
+            return False, Exception(entry["error"])
+        return True, pd.DataFrame(entry["rows"], columns=entry["columns"])
+
+
+def raise_clarification(message: str) -> str:
+    raise ClarificationRequired(message)
+
+
+def quiet(pipeline):
+    pipeline.clarify_callback = raise_clarification
+    pipeline.confirm_callback = lambda message: "y"
+    pipeline.add_example_callback = lambda question, sql: "n"
+    pipeline.AUTO_ADD_EXAMPLES = False
+    return pipeline
+
+
+def read_questions(path: str) -> List[str]:
+    """example.json 取其中的 question，文本文件按行或 '？' 分隔"""
+    if path.endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            return [e["question"] for e in json.load(f)["examples"]]
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    return [q.strip() for q in text.replace("？", "？\n").splitlines() if q.strip()]
+
+
+def run_question(pipeline, question: str, stream: bool = False) -> Dict:
+    """在独立的 trace 中提问一次，返回 trace_id、回答和错误信息"""
+    with start_trace() as trace_id:
+        try:
+            if stream:
+                events = list(pipeline.ask_stream(question))
+                answer = events[-1].get("answer") if events else None
+            else:
+                answer = pipeline.ask(question)
+            return {"trace_id": trace_id, "answer": answer, "error": None}
+        except Exception as e:
+            return {"trace_id": trace_id, "answer": None, "error": f"{type(e).__name__}: {e}"}
+
+
+def record(questions: List[str], cassette: Cassette, stream: bool = False):
+    """用线上大模型和数据库跑一遍问题集，录制所有交互"""
+    from rag_sql import RAG_SQL
+
+    rag = quiet(RAG_SQL())
+    rag.connect_to_mysql(**mysql_config)
+    rag.run_sql = RecordingDB(cassette, rag.run_sql).run_sql
+    rag.run_unguarded_sql = RecordingDB(cassette, rag.run_unguarded_sql).run_sql
+    with LLMStandIn(cassette, upstream=rag.host, auth_key=rag.auth_key) as standin:
+        rag.host = standin.url
+        # 槽位词典加载时的查询也要录制，回放时 warmup 会再次执行
+        rag.warmup()
+        for question in questions:
+            pipeline = rag.fork()
+            pipeline.retrieve(question)
+            cassette.data["retrieval"][question] = {
+                "index_info": pipeline.index_info,
+                "document_info": pipeline.document_info,
+                "example_info": pipeline.example_info,
+            }
+            result = run_question(pipeline, question, stream)
+            print(question, "->", result["answer"] if result["error"] is None else result["error"])
+    cassette.save()
+
+
+def replay_pipeline(cassette: Cassette, host: str, db: ReplayDB):
+    """不依赖向量库和 MySQL 的流水线，检索上下文和SQL结果都来自录制"""
+    from Vllm import Vllm
+
+    pipeline = quiet(Vllm({"vllm_host": host, "model": vllm_config["model"]}))
+    pipeline.run_sql = db.run_sql
+    pipeline.run_sql_is_set = True
+    pipeline.warmup()
+    return pipeline
+
+
+def benchmark(questions: List[str], cassette: Cassette, repeat: int = 1, latency_scale: float = 0.0,
+              llm_latency: float = 0.0, db_latency: float = 0.0, stream: bool = False) -> Dict:
+    db = ReplayDB(cassette, latency_scale, db_latency)
+    results = []
+    with LLMStandIn(cassette, latency_scale=latency_scale, latency=llm_latency) as standin, \
+            TraceCollector() as collector:
+        template = replay_pipeline(cassette, standin.url, db)
+        for _ in range(repeat):
+            cassette.rewind()
+            for question in questions:
+                pipeline = template.fork()
+                for name, value in cassette.data["retrieval"].get(question, {}).items():
+                    setattr(pipeline, name, value)
+                started = time.perf_counter()
+                result = run_question(pipeline, question, stream)
+                result.update(question=question, latency=time.perf_counter() - started)
+                result.update(collector.summary(result["trace_id"]))
+                results.append(result)
+    stages = {name: {"count": len(values), "p50": percentile(values, 50), "p95": percentile(values, 95)}
+              for name, values in collector.durations().items()}
+    latencies = [r["latency"] for r in results]
+    count = len(results) or 1
+    return {
+        "questions": len(results),
+        "errors": sum(1 for r in results if r["error"] is not None),
+        "end_to_end": {"p50": percentile(latencies, 50), "p95": percentile(latencies, 95)},
+        "stages": stages,
+        "llm_calls_per_question": sum(r["llm_calls"] for r in results) / count,
+        "prompt_tokens_per_question": sum(r["prompt_tokens"] for r in results) / count,
+        "completion_tokens_per_question": sum(r["completion_tokens"] for r in results) / count,
+        "llm_cassette_misses": standin.misses,
+        "sql_cassette_misses": db.misses,
+        "results": results,
+    }
+
+
+def print_report(report: Dict):
+    print(f"问题数: {report['questions']}  失败: {report['errors']}  "
+          f"录制未命中: LLM {report['llm_cassette_misses']} / SQL {report['sql_cassette_misses']}")
+    print(f"端到端: p50 {report['end_to_end']['p50'] * 1000:.1f} ms  p95 {report['end_to_end']['p95'] * 1000:.1f} ms")
+    print(f"每个问题: 大模型调用 {report['llm_calls_per_question']:.2f} 次, "
+          f"prompt tokens {report['prompt_tokens_per_question']:.0f}, "
+          f"completion tokens {report['completion_tokens_per_question']:.0f}")
+    print(f"{'阶段':<14}{'次数':>6}{'p50(ms)':>12}{'p95(ms)':>12}")
+    for name, stage in sorted(report["stages"].items(), key=lambda item: -item[1]["p95"]):
+        print(f"{name:<14}{stage['count']:>6}{stage['p50'] * 1000:>12.1f}{stage['p95'] * 1000:>12.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="录制线上交互，离线回放并统计各阶段耗时")
+    parser.add_argument("mode", choices=["record", "bench"])
+    parser.add_argument("--questions", default=os.path.join(base_config["prefix_dir"], base_config["example_json"]))
+    parser.add_argument("--cassette", default="cassette.json")
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--latency-scale", type=float, default=0.0, help="按录制耗时的倍数注入延迟，1 为原速")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="每次大模型请求额外注入的延迟(秒)")
+    parser.add_argument("--db-latency", type=float, default=0.0, help="每次SQL额外注入的延迟(秒)")
+    parser.add_argument("--stream", action="store_true", help="使用 ask_stream")
+    parser.add_argument("--output", help="把完整结果写入 JSON 文件")
+    args = parser.parse_args()
+    questions = read_questions(args.questions)
+    cassette = Cassette(args.cassette)
+    if args.mode == "record":
+        record(questions, cassette, args.stream)
+        return
+    report = benchmark(questions, cassette, args.repeat, args.latency_scale, args.llm_latency, args.db_latency,
+                       args.stream)
+    print_report(report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=1, default=str)
+
+
+if __name__ == "__main__":
+    main()
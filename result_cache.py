@@ -0,0 +1,165 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional
+
+from config import cache_config
+from sql_utils import normalize_sql, referenced_tables
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+class CacheEntry:
+    def __init__(self, df: "pd.DataFrame", tables: List[str], versions: Dict):
+        self.columns = list(df.columns)
+        self.arrays = [df.iloc[:, i].to_numpy(copy=True) for i in range(len(self.columns))]
+        self.nbytes = int(df.memory_usage(index=False, deep=True).sum())
+        self.tables = tables
+        self.versions = versions
+        self.created = time.time()
+
+    def to_frame(self) -> "pd.DataFrame":
+        import pandas as pd
+
+        return pd.DataFrame({i: a.copy() for i, a in enumerate(self.arrays)}).set_axis(self.columns, axis=1)
+
+
+class ResultCache:
+    """按规范化SQL缓存查询结果，LRU + TTL，源表更新后失效"""
+
+    def __init__(self, version_provider: Callable[[List[str]], Dict] = None, config=None):
+        if config is None:
+            config = cache_config
+        self.config = config
+        self.max_bytes = self.config.get("max_bytes", 256 * 1024 * 1024)
+        self.max_entries = self.config.get("max_entries", 1000)
+        self.ttl = self.config.get("ttl", 3600)
+        self.version_check_interval = self.config.get("version_check_interval", 5)
+        self.version_provider = version_provider
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.versions = {}
+        self.versions_checked = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(sql: str, params=()) -> str:
+        text = normalize_sql(sql) + "\x00" + json.dumps(list(params), ensure_ascii=False, default=str)
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def current_versions(self, tables: List[str]) -> Dict:
+        """读取源表版本，间隔 version_check_interval 秒内复用上一次的结果
+
+        版本查询要访问数据库，不能在持有 self.lock 时调用。
+        """
+        if self.version_provider is None:
+            return {}
+        with self.lock:
+            stale = (time.time() - self.versions_checked > self.version_check_interval
+                     or any(t not in self.versions for t in tables))
+            versions = self.versions
+            known = sorted(set(versions) | set(tables))
+        if stale:
+            versions = self.version_provider(known)
+            with self.lock:
+                self.versions = versions
+                self.versions_checked = time.time()
+        return {t: versions.get(t) for t in tables}
+
+    @staticmethod
+    def versions_known(versions: Dict) -> bool:
+        """UPDATE_TIME 为 NULL 等取不到版本的情况无法判断表是否变化，不使用缓存"""
+        return all(v is not None for v in versions.values())
+
+    def get(self, sql: str, params=()) -> Optional["pd.DataFrame"]:
+        key = self.make_key(sql, params)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and time.time() - entry.created > self.ttl:
+                self._remove(key)
+                entry = None
+        if entry is not None:
+            versions = self.current_versions(entry.tables)
+            if versions != entry.versions or not self.versions_known(versions):
+                with self.lock:
+                    if self.entries.get(key) is entry:
+                        self._remove(key)
+                entry = None
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            if key in self.entries:
+                self.entries.move_to_end(key)
+            self.hits += 1
+            self.bytes_saved += entry.nbytes
+        return entry.to_frame()
+
+    def put(self, sql: str, df: "pd.DataFrame", params=()):
+        tables = referenced_tables(sql)
+        versions = self.current_versions(tables)
+        if not self.versions_known(versions):
+            return
+        entry = CacheEntry(df, tables, versions)
+        if entry.nbytes > self.max_bytes:
+            return
+        key = self.make_key(sql, params)
+        with self.lock:
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = entry
+            self.bytes += entry.nbytes
+            while self.bytes > self.max_bytes or len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def _remove(self, key: str):
+        entry = self.entries.pop(key)
+        self.bytes -= entry.nbytes
+
+    def invalidate(self, table: str = None):
+        with self.lock:
+            for key in [k for k, e in self.entries.items() if table is None or table in e.tables]:
+                self._remove(key)
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+            "bytes_saved": self.bytes_saved,
+            "evictions": self.evictions,
+        }
+
+
+def make_version_provider(run_sql, change_marker_sql: str = None):
+    """默认读取 information_schema.TABLES.UPDATE_TIME，也可配置自定义的变更标记查询"""
+    def version_provider(tables: List[str]) -> Dict:
+        import pandas as pd
+
+        if change_marker_sql:
+            ok, df = run_sql(change_marker_sql)
+            marker = json.dumps(df.values.tolist(), default=str) if ok else None
+            return {t: marker for t in tables}
+        names = ", ".join("'" + t.replace("'", "''") + "'" for t in tables)
+        ok, df = run_sql(
+            "SELECT TABLE_NAME, UPDATE_TIME FROM information_schema.TABLES "
+            f"WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN ({names})"
+        )
+        if not ok:
+            # 取不到版本时不信任缓存
+            return {t: None for t in tables}
+        # UPDATE_TIME 为 NULL(如 InnoDB 重启后尚未写入)时版本未知，保持为 None
+        versions = {str(name): None if pd.isna(updated) else str(updated) for name, updated in df.values.tolist()}
+        return {t: versions.get(t) for t in tables}
+    return version_provider
@@ -0,0 +1,225 @@
+import os
+import re
+import threading
+import time
+from typing import Dict, Optional
+
+from config import rollup_config
+from department import DepartmentIndex
+
+ROLLUP_DDL = '''
+CREATE TABLE IF NOT EXISTS `{table}` (
+    出院日期 DATE NOT NULL,
+    出院科室 VARCHAR(255) NOT NULL,
+    带组医师工号 VARCHAR(255) NOT NULL,
+    带组医师 VARCHAR(255) NOT NULL,
+    主手术代码 VARCHAR(255) NOT NULL,
+    主手术名称 VARCHAR(1024) NOT NULL,
+    是否四级手术 TINYINT NOT NULL,
+    是否微创手术 TINYINT NOT NULL,
+    出院人数 INT NOT NULL,
+    总费用 DECIMAL(18, 2) NOT NULL,
+    总药费 DECIMAL(18, 2) NOT NULL,
+    总材料费 DECIMAL(18, 2) NOT NULL,
+    住院天数 INT NOT NULL,
+    住院日期差 INT NOT NULL,
+    PRIMARY KEY (出院日期, 出院科室, 带组医师工号, 主手术代码),
+    INDEX idx_rollup_dept_date (出院科室, 出院日期),
+    INDEX idx_rollup_code_date (主手术代码, 出院日期)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+'''
+
+REFRESH_SQL = '''
+INSERT INTO `{table}`
+SELECT
+    r.出院日期,
+    r.出院科室,
+    r.带组医师工号,
+    MAX(r.带组医师),
+    r.主手术代码,
+    MAX(LEFT(r.主手术名称, 1024)),
+    MAX(s4.编码 IS NOT NULL),
+    MAX(wc.编码 IS NOT NULL),
+    COUNT(*),
+    SUM(r.总费用),
+    SUM(r.总药费),
+    SUM(r.总材料费),
+    SUM(r.住院天数),
+    SUM(DATEDIFF(r.出院日期, r.入院日期))
+FROM `病历记录` r
+LEFT JOIN `国考四级手术目录` s4 ON r.主手术代码 = s4.编码
+LEFT JOIN `国考微创手术目录` wc ON r.主手术代码 = wc.编码
+WHERE r.出院日期 >= %s
+GROUP BY r.出院日期, r.出院科室, r.带组医师工号, r.主手术代码
+'''
+
+SURGERY = "CASE WHEN 主手术代码 <> '' THEN 出院人数 ELSE 0 END"
+
+# 指标名称 -> 基于汇总表的计算表达式，与 index.txt 中的公式保持一致
+METRIC_SQL = {
+    "出院人数": "SUM(出院人数)",
+    "例数": "SUM(出院人数)",
+    "手术例数": f"SUM({SURGERY})",
+    "出院患者手术台次数": f"SUM({SURGERY})",
+    "出院患者手术占比": f"SUM({SURGERY}) * 100.0 / SUM(出院人数)",
+    "出院患者四级手术台次数": "SUM(是否四级手术 * 出院人数)",
+    "出院患者四级手术比例": f"SUM(是否四级手术 * 出院人数) * 100.0 / SUM({SURGERY})",
+    "出院患者微创手术台次数": "SUM(是否微创手术 * 出院人数)",
+    "出院患者微创手术占比": f"SUM(是否微创手术 * 出院人数) * 100.0 / SUM({SURGERY})",
+    "出院患者微创手术比例": f"SUM(是否微创手术 * 出院人数) * 100.0 / SUM({SURGERY})",
+    "均次费": "SUM(总费用) / SUM(出院人数)",
+    "住院均次费用": "SUM(总费用) / SUM(出院人数)",
+    "均次药费": "SUM(总药费) / SUM(出院人数)",
+    "药占比": "SUM(总药费) / SUM(总费用)",
+    "药占比（住院）": "SUM(总药费) / SUM(总费用)",
+    "均次卫生材料费": "SUM(总材料费) / SUM(出院人数)",
+    "耗占比": "SUM(总材料费) / SUM(总费用)",
+    "耗占比（住院）": "SUM(总材料费) / SUM(总费用)",
+    "去药去耗材占比": "(SUM(总费用) - SUM(总药费) - SUM(总材料费)) / SUM(总费用)",
+    "平均住院日": "SUM(住院日期差) / SUM(出院人数)",
+}
+
+# 各意图的分组维度，指标里出现这些名称时由分组列提供
+INTENT_DIMENSIONS = {
+    "科室概览": [("出院科室", "出院科室")],
+    "医师": [("带组医师", "姓名"), ("带组医师工号", "工号")],
+    "重点病种": [("带组医师", "主刀医生"), ("带组医师工号", "带组医师工号")],
+}
+DIMENSION_METRICS = {"姓名", "工号", "病种", "主刀医师"}
+
+
+def parse_disease_codes(text: str) -> Dict[str, str]:
+    """解析 document.txt 中的病种手术代码说明，生成主手术代码的过滤条件"""
+    result = {}
+    for line in text.split(";\n"):
+        if "的主手术代码" not in line:
+            continue
+        name, rule = line.split("的主手术代码", 1)
+        codes = re.findall(r"\d+\.\d+[0-9x]*", rule)
+        if not codes:
+            continue
+        if "开头" in rule:
+            result[name.strip()] = "(" + " OR ".join(f"主手术代码 LIKE '{c}%'" for c in codes) + ")"
+        else:
+            result[name.strip()] = "主手术代码 IN (" + ", ".join(f"'{c}'" for c in codes) + ")"
+    return result
+
+
+class RollupBuilder:
+    """维护按 (出院日期, 出院科室, 带组医师工号, 主手术代码) 汇总的日粒度汇总表"""
+
+    def __init__(self, run_sql, execute_sql, config=None):
+        if config is None:
+            config = rollup_config
+        self.config = config
+        self.table = self.config.get("table", "病历记录_日汇总")
+        self.max_staleness = self.config.get("max_staleness", 3600)
+        self.retry_interval = self.config.get("retry_interval", 60)
+        self.run_sql = run_sql
+        self.execute_sql = execute_sql
+        self.last_refresh = 0
+        self.last_attempt = 0
+        self.refreshing = False
+        self.error = None
+        self.lock = threading.Lock()
+
+    def create(self):
+        self.execute_sql(ROLLUP_DDL.format(table=self.table))
+
+    def watermark(self) -> Optional[str]:
+        ok, df = self.run_sql(f"SELECT MAX(出院日期) AS watermark FROM `{self.table}`;")
+        if not ok or df.empty or df.iloc[0, 0] is None:
+            return None
+        return str(df.iloc[0, 0])
+
+    def refresh(self, since: str = None) -> int:
+        """增量刷新：重算水位日（可能只装载了一部分）及之后的出院记录"""
+        if since is None:
+            since = self.watermark() or "1900-01-01"
+        self.execute_sql(f"DELETE FROM `{self.table}` WHERE 出院日期 >= %s", (since,))
+        rows = self.execute_sql(REFRESH_SQL.format(table=self.table), (since,))
+        self.last_refresh = time.time()
+        return rows
+
+    def rebuild(self) -> int:
+        return self.refresh(since="1900-01-01")
+
+    def refresh_in_background(self) -> bool:
+        """在后台线程中增量刷新，已有刷新在进行时不重复启动"""
+        with self.lock:
+            if self.refreshing:
+                return False
+            self.refreshing = True
+            self.last_attempt = time.time()
+        threading.Thread(target=self._refresh_in_background, name="rollup-refresh", daemon=True).start()
+        return True
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+            self.error = None
+        except Exception as e:
+            # 失败后间隔 retry_interval 秒再重试，期间由原表回答
+            self.error = e
+        finally:
+            with self.lock:
+                self.refreshing = False
+
+    def ensure_fresh(self) -> bool:
+        """汇总表能否直接使用；过期时在后台刷新，刷新完成前返回False，由原表回答
+
+        刷新先删除再重算水位日之后的数据，刷新过程中汇总表不完整，也不能使用。
+        """
+        if self.refreshing:
+            return False
+        now = time.time()
+        if now - self.last_refresh <= self.max_staleness:
+            return True
+        if now - self.last_attempt > self.retry_interval:
+            self.refresh_in_background()
+        return False
+
+
+class QueryRouter:
+    """把可由汇总表回答的科室/病种/医师问题直接改写为汇总表查询，跳过 SQL 生成"""
+
+    def __init__(self, department_index: DepartmentIndex, config=None):
+        if config is None:
+            config = rollup_config
+        self.config = config
+        self.table = self.config.get("table", "病历记录_日汇总")
+        self.department_index = department_index
+        document_path = os.path.join(self.config.get("prefix_dir", ""), self.config.get("document_file", ""))
+        self.disease_codes = {}
+        if os.path.isfile(document_path):
+            with open(document_path, "r", encoding="utf-8") as f:
+                self.disease_codes = parse_disease_codes(f.read())
+
+    def route(self, slot_result) -> Optional[str]:
+        intent = slot_result.slots["意图"]
+        if intent not in INTENT_DIMENSIONS:
+            return None
+        metrics = [m for m in slot_result.slots["指标"] if m not in DIMENSION_METRICS]
+        if any(m not in METRIC_SQL for m in metrics):
+            return None
+        conditions = [
+            self.department_index.predicate(slot_result.wards),
+            f"出院日期 BETWEEN '{slot_result.start}' AND '{slot_result.end}'",
+        ]
+        if slot_result.doctors:
+            conditions.append("带组医师 IN (" + ", ".join(f"'{d}'" for d in slot_result.doctors) + ")")
+        if slot_result.diseases:
+            if any(d not in self.disease_codes for d in slot_result.diseases):
+                return None
+            conditions.append("(" + " OR ".join(self.disease_codes[d] for d in slot_result.diseases) + ")")
+        elif intent == "重点病种":
+            return None
+        dimensions = INTENT_DIMENSIONS[intent]
+        select = [f"{column} AS {alias}" for column, alias in dimensions]
+        select += [f"{METRIC_SQL[m]} AS `{m}`" for m in metrics]
+        group_by = ", ".join(column for column, _ in dimensions)
+        return (
+            "SELECT\n    " + ",\n    ".join(select) +
+            f"\nFROM `{self.table}`\nWHERE\n    " + "\n    AND ".join(conditions) +
+            f"\nGROUP BY {group_by}\nORDER BY SUM(出院人数) DESC;"
+        )
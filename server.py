@@ -0,0 +1,320 @@
+import asyncio
+import contextvars
+import json
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel
+
+from config import mysql_config, server_config
+from exceptions import ClarificationRequired, DeadlineExceeded
+from rag_sql import RAG_SQL
+from session import Conversation
+from tracing import current_trace, new_trace_id, render_metrics, start_trace
+from Vllm import Vllm
+
+
+class AskRequest(BaseModel):
+    question: str
+    # 本次提问的总时长(秒)，默认取 deadline_config
+    budget: Optional[float] = None
+    # 多轮对话的会话号，携带时追问沿用上一轮的槽位和SQL
+    conversation_id: Optional[str] = None
+
+
+class ClarifyRequest(BaseModel):
+    token: str
+    info: str
+    budget: Optional[float] = None
+
+
+def raise_clarification(message: str) -> str:
+    raise ClarificationRequired(message)
+
+
+def skip_add_example(question: str, sql: str) -> str:
+    return "n"
+
+
+def frame_payload(df) -> dict:
+    return {"rows": len(df), "columns": [str(c) for c in df.columns], "data": df.head(100).values.tolist()}
+
+
+def partial_payload(partial: dict) -> dict:
+    """超时时已得到的中间结果，查询结果转为可序列化的行列表"""
+    payload = {k: v for k, v in partial.items() if k != "result"}
+    if partial.get("result") is not None:
+        payload["result"] = frame_payload(partial["result"])
+    return payload
+
+
+class PipelinePool:
+    """每个工作线程独占一个 RAG_SQL 副本，副本之间共享向量库、连接池和大模型客户端"""
+
+    def __init__(self, size: int):
+        self.pipelines = queue.Queue()
+        template = RAG_SQL()
+        template.clarify_callback = raise_clarification
+        template.confirm_callback = lambda message: "y"
+        template.add_example_callback = skip_add_example
+        template.connect_to_mysql(**mysql_config)
+        template.warmup()
+        # fork 出的副本共用同一个结果缓存
+        self.result_cache = template.result_cache
+        for _ in range(size):
+            self.pipelines.put(template.fork())
+
+    def run(self, question: str, reget_info: str = "", trace_id: str = None, budget: float = None,
+            conversation: Conversation = None):
+        rag = self.pipelines.get()
+        try:
+            with start_trace(trace_id):
+                rag.reset()
+                if conversation is not None:
+                    return conversation.ask(rag, question, budget)
+                rag.retrieve(question)
+                return rag.ask(question, reget_info, budget=budget)
+        finally:
+            self.pipelines.put(rag)
+
+    def stream(self, question: str, reget_info: str = "", budget: float = None):
+        rag = self.pipelines.get()
+        try:
+            rag.reset()
+            rag.retrieve(question)
+            yield from rag.ask_stream(question, reget_info, budget)
+        finally:
+            self.pipelines.put(rag)
+
+
+class Service:
+    def __init__(self, config=None):
+        if config is None:
+            config = server_config
+        self.config = config
+        self.workers = self.config.get("workers", 4)
+        self.capacity = self.workers + self.config.get("max_queue", 16)
+        self.per_client = self.config.get("per_client", 2)
+        self.vllm_max_in_flight = self.config.get("vllm_max_in_flight", 8)
+        self.session_ttl = self.config.get("session_ttl", 600)
+        self.drain_timeout = self.config.get("drain_timeout", 60)
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.clients = {}
+        self.sessions = {}
+        self.conversations = {}
+        self.draining = False
+        self.pool = None
+        self.executor = None
+
+    def start(self):
+        self.pool = PipelinePool(self.workers)
+        self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ask")
+
+    async def stop(self):
+        """停止接收新请求，等待已排队和执行中的问题完成"""
+        self.draining = True
+        deadline = time.monotonic() + self.drain_timeout
+        while self.pending and time.monotonic() < deadline:
+            await asyncio.sleep(0.2)
+        self.executor.shutdown(wait=False)
+
+    def admit(self, client: str):
+        if self.draining:
+            raise HTTPException(status_code=503, detail="服务正在关闭")
+        with self.lock:
+            if self.pending >= self.capacity or Vllm.in_flight >= self.vllm_max_in_flight:
+                raise HTTPException(status_code=429, detail="服务繁忙，请稍后重试", headers={"Retry-After": "5"})
+            if self.clients.get(client, 0) >= self.per_client:
+                raise HTTPException(status_code=429, detail="该客户端并发请求过多", headers={"Retry-After": "1"})
+            self.pending += 1
+            self.clients[client] = self.clients.get(client, 0) + 1
+
+    def release(self, client: str):
+        with self.lock:
+            self.pending -= 1
+            self.clients[client] -= 1
+            if not self.clients[client]:
+                del self.clients[client]
+
+    def new_session(self, question: str, reget_info: str) -> str:
+        now = time.time()
+        with self.lock:
+            for token in [t for t, s in self.sessions.items() if now - s["created"] > self.session_ttl]:
+                del self.sessions[token]
+            token = uuid.uuid4().hex
+            self.sessions[token] = {"question": question, "reget_info": reget_info, "created": now}
+        return token
+
+    def conversation(self, conversation_id: str) -> Conversation:
+        """取出会话号对应的多轮对话，不存在或已过期时新建"""
+        now = time.time()
+        with self.lock:
+            for key in [k for k, c in self.conversations.items() if now - c.updated > self.session_ttl]:
+                del self.conversations[key]
+            return self.conversations.setdefault(conversation_id, Conversation())
+
+    def pop_session(self, token: str):
+        with self.lock:
+            session = self.sessions.pop(token, None)
+        if session is None or time.time() - session["created"] > self.session_ttl:
+            raise HTTPException(status_code=404, detail="会话不存在或已过期")
+        return session
+
+    def restore_session(self, token: str, session: dict):
+        with self.lock:
+            self.sessions[token] = session
+
+    def run(self, question: str, reget_info: str, trace_id: str, budget: float, conversation: Conversation):
+        """返回 (回答, 会话本轮解析出的问题和结果来源)，同一会话的请求依次执行"""
+        if conversation is None:
+            return self.pool.run(question, reget_info, trace_id, budget), None
+        with conversation.lock:
+            answer = self.pool.run(question, reget_info, trace_id, budget, conversation)
+            return answer, (conversation.question, conversation.source)
+
+    async def handle(self, client: str, question: str, reget_info: str = "", trace_id: str = None,
+                     budget: float = None, conversation_id: str = None):
+        self.admit(client)
+        trace_id = trace_id or new_trace_id()
+        conversation = self.conversation(conversation_id) if conversation_id else None
+        try:
+            loop = asyncio.get_running_loop()
+            answer, resolved = await loop.run_in_executor(self.executor, self.run, question, reget_info, trace_id,
+                                                          budget, conversation)
+            response = {"status": "ok", "question": question, "answer": answer, "trace_id": trace_id}
+            if conversation is not None:
+                response.update(conversation_id=conversation_id, resolved_question=resolved[0], source=resolved[1])
+            return response
+        except ClarificationRequired as e:
+            token = self.new_session(question, reget_info)
+            return {"status": "clarify", "token": token, "message": e.message, "trace_id": trace_id}
+        except DeadlineExceeded as e:
+            # 查询结果中可能有 Decimal、日期等类型，按字符串序列化
+            content = json.dumps({"status": "timeout", "question": question, "stage": e.stage, "message": str(e),
+                                  "partial": partial_payload(e.partial), "trace_id": trace_id},
+                                 ensure_ascii=False, default=str)
+            return Response(content, status_code=504, media_type="application/json")
+        finally:
+            self.release(client)
+
+    def stream(self, client: str, question: str, reget_info: str = "", trace_id: str = None, budget: float = None):
+        """以 SSE 事件返回各阶段进度和回答内容，客户端断开时停止生成"""
+        self.admit(client)
+        # 生成器的每一步可能在不同线程中执行，统一放在同一个上下文里，使 span 能正确嵌套
+        context = contextvars.copy_context()
+        context.run(current_trace.set, trace_id or new_trace_id())
+        events = self.pool.stream(question, reget_info, budget)
+
+        def sse():
+            try:
+                for event in iter(lambda: context.run(next, events, None), None):
+                    if event["stage"] == "rows":
+                        event = {"stage": "rows", **frame_payload(event["result"])}
+                    yield "data: " + json.dumps(event, ensure_ascii=False, default=str) + "\n\n"
+            except ClarificationRequired as e:
+                token = self.new_session(question, reget_info)
+                yield "data: " + json.dumps({"stage": "clarify", "token": token, "message": e.message},
+                                            ensure_ascii=False) + "\n\n"
+            except DeadlineExceeded as e:
+                yield "data: " + json.dumps({"stage": "timeout", "at": e.stage, "message": str(e)},
+                                            ensure_ascii=False) + "\n\n"
+            finally:
+                context.run(events.close)
+                self.release(client)
+
+        return StreamingResponse(sse(), media_type="text/event-stream")
+
+
+service = Service()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    service.start()
+    yield
+    await service.stop()
+
+
+app = FastAPI(title="nl2sql", lifespan=lifespan)
+
+
+def client_id(request: Request) -> str:
+    return request.headers.get("X-Client-Id") or (request.client.host if request.client else "unknown")
+
+
+def request_id(request: Request) -> str:
+    return request.headers.get("X-Request-Id") or new_trace_id()
+
+
+@app.post("/ask")
+async def ask(body: AskRequest, request: Request):
+    return await service.handle(client_id(request), body.question, trace_id=request_id(request), budget=body.budget,
+                                conversation_id=body.conversation_id)
+
+
+@app.post("/ask/stream")
+async def ask_stream(body: AskRequest, request: Request):
+    return service.stream(client_id(request), body.question, trace_id=request_id(request), budget=body.budget)
+
+
+@app.post("/clarify")
+async def clarify(body: ClarifyRequest, request: Request):
+    """携带 token 补充信息，相当于命令行下 reget_info 的多轮交互"""
+    session = service.pop_session(body.token)
+    reget_info = session["reget_info"] + body.info
+    try:
+        return await service.handle(client_id(request), session["question"], reget_info,
+                                    trace_id=request_id(request), budget=body.budget)
+    except HTTPException:
+        # 未被接纳(429/503)时请求没有执行，保留 token 供客户端重试
+        service.restore_session(body.token, session)
+        raise
+
+
+@app.get("/healthz")
+async def healthz():
+    status = 503 if service.draining else 200
+    return JSONResponse(status_code=status, content={
+        "draining": service.draining,
+        "pending": service.pending,
+        "vllm_in_flight": Vllm.in_flight,
+    })
+
+
+@app.get("/metrics")
+async def metrics():
+    gauges = (
+        "# TYPE nl2sql_pending_questions gauge\n"
+        f"nl2sql_pending_questions {service.pending}\n"
+        "# TYPE nl2sql_vllm_in_flight gauge\n"
+        f"nl2sql_vllm_in_flight {Vllm.in_flight}\n"
+    )
+    if service.pool is not None and service.pool.result_cache is not None:
+        stats = service.pool.result_cache.stats()
+        gauges += (
+            "# TYPE nl2sql_result_cache_entries gauge\n"
+            f"nl2sql_result_cache_entries {stats['entries']}\n"
+            "# TYPE nl2sql_result_cache_bytes gauge\n"
+            f"nl2sql_result_cache_bytes {stats['bytes']}\n"
+            "# TYPE nl2sql_result_cache_hit_ratio gauge\n"
+            f"nl2sql_result_cache_hit_ratio {stats['hit_ratio']:.4f}\n"
+            "# TYPE nl2sql_result_cache_bytes_saved_total counter\n"
+            f"nl2sql_result_cache_bytes_saved_total {stats['bytes_saved']}\n"
+            "# TYPE nl2sql_result_cache_evictions_total counter\n"
+            f"nl2sql_result_cache_evictions_total {stats['evictions']}\n"
+        )
+    return PlainTextResponse(render_metrics() + gauges, media_type="text/plain; version=0.0.4")
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host=server_config["host"], port=server_config["port"], timeout_graceful_shutdown=server_config["drain_timeout"])
@@ -0,0 +1,271 @@
+import re
+import threading
+import time
+from typing import List, Optional, Tuple
+
+import deadline
+from slot_extractor import INTENT_METRICS
+from sql_utils import tokenize
+from tracing import span
+
+# 追问的常见说法：“那二区呢”、“换成1到6月”、“再看一下蔡明”
+FOLLOWUP_RE = re.compile(r"^(那么?|换成|改成|换到|改为|再看|再查|如果是|同样|还是)|呢[?？。]?$")
+WARD_SHORTHAND_RE = re.compile(r"([一二三四五六七八九十]+区)")
+# 按科室筛选的列
+WARD_COLUMNS = ("出院科室", "入院科室", "所属病区")
+# 追问较短且没有提到意图、病种、医师和指标时也按追问处理
+MAX_FOLLOWUP_LENGTH = 15
+
+
+class Delta:
+    """追问相对上一轮的槽位变化"""
+
+    def __init__(self):
+        self.start = None
+        self.end = None
+        self.departments = []
+        self.intent = None
+        self.doctors = []
+        self.diseases = []
+        self.metrics = []
+
+    @property
+    def shape_changed(self) -> bool:
+        """意图、病种、医师或指标变化时SQL结构随之变化，需要重新生成"""
+        return bool(self.intent or self.doctors or self.diseases or self.metrics)
+
+    @property
+    def empty(self) -> bool:
+        return self.start is None and not self.departments and not self.shape_changed
+
+
+def unquote(text: str) -> str:
+    return text[1:-1].replace(text[0] * 2, text[0])
+
+
+def replace_dates(sql: str, old: Tuple[str, str], new: Tuple[str, str]) -> Optional[str]:
+    """把SQL中上一轮的起止日期字面量替换为新的日期，找不到时返回None"""
+    mapping = dict(zip(old, new))
+    found, parts = set(), []
+    for kind, text in tokenize(sql, raw=True):
+        if kind == "string" and unquote(text) in mapping:
+            found.add(unquote(text))
+            text = text[0] + mapping[unquote(text)] + text[0]
+        parts.append(text)
+    return "".join(parts) if found == set(old) else None
+
+
+def replace_wards(sql: str, old_wards: List[str], new_wards: List[str], predicate) -> Optional[str]:
+    """把 `出院科室` = '...' 或 `出院科室` IN (...) 中上一轮的病区替换为新的科室条件
+
+    predicate(column) 返回该列的新条件；找不到与上一轮病区一致的条件，或SQL中其他位置仍引用这些病区时返回None。
+    """
+    tokens = tokenize(sql, raw=True)
+    index = [i for i, (kind, _) in enumerate(tokens) if kind not in ("ws", "comment")]
+    old, parts, replaced, skip_to = set(old_wards), [], 0, -1
+    for n, i in enumerate(index):
+        if i <= skip_to:
+            continue
+        kind, text = tokens[i]
+        column = text.strip("`")
+        end = None
+        if kind == "word" and column in WARD_COLUMNS and n + 2 < len(index):
+            op_kind, op = tokens[index[n + 1]]
+            if op == "=" and tokens[index[n + 2]][0] == "string" and {unquote(tokens[index[n + 2]][1])} == old:
+                end = index[n + 2]
+            elif op.upper() == "IN" and tokens[index[n + 2]][1] == "(":
+                values, m = [], n + 3
+                while m + 1 < len(index) and tokens[index[m]][0] == "string":
+                    values.append(unquote(tokens[index[m]][1]))
+                    if tokens[index[m + 1]][1] != ",":
+                        break
+                    m += 2
+                if m + 1 < len(index) and tokens[index[m + 1]][1] == ")" and set(values) == old:
+                    end = index[m + 1]
+        if end is not None:
+            parts.append((i, end, predicate(column)))
+            replaced += 1
+            skip_to = end
+    if not replaced:
+        return None
+    result, last = [], 0
+    for begin, end, text in parts:
+        result.append("".join(t for _, t in tokens[last:begin]))
+        result.append(text)
+        last = end + 1
+    result.append("".join(t for _, t in tokens[last:]))
+    patched = "".join(result)
+    # 病区还出现在被替换的条件以外，说明SQL结构超出了简单过滤，不做改写
+    remaining = {unquote(t) for k, t in tokenize(patched) if k == "string"}
+    if remaining & (old - set(new_wards)):
+        return None
+    return patched
+
+
+class Conversation:
+    """多轮对话的状态：上一轮解析出的槽位、思路、SQL和查询结果
+
+    追问只改变时间或科室时直接改写上一轮SQL的条件并查询，不再经过语义解析、思考和SQL生成；
+    意图、病种、医师或指标变化时把槽位合并成完整问题交给流水线重新生成。
+    每次调用传入流水线实例，服务端可以用任意一个空闲的副本处理同一会话；同一会话的并发请求依次处理。
+    """
+
+    def __init__(self):
+        self.question = None
+        self.slot_result = None
+        self.thinking = None
+        self.sql = None
+        self.result = None
+        self.source = None
+        self.answer = None
+        self.updated = time.time()
+        self.lock = threading.RLock()
+
+    def ask(self, pipeline, question: str, budget: float = None) -> str:
+        with self.lock, span("conversation") as item, deadline.budget(budget):
+            delta = self.delta(pipeline, question)
+            item.set("followup", delta is not None)
+            if delta is None:
+                return self.full(pipeline, question)
+            target = self.merge(pipeline, delta)
+            item.set("shape_changed", delta.shape_changed)
+            if delta.shape_changed:
+                return self.full(pipeline, target.question)
+            sql, df, source = self.patch(pipeline, target)
+            item.set("source", source)
+            if df is None:
+                return self.full(pipeline, target.question)
+            prompt = pipeline.get_answer_prompt(target.question, sql, df)
+            with span("final", source=source):
+                answer = pipeline.submit_final_prompt(prompt)
+            pipeline.finish_answer(target.question, sql, answer, source)
+            self.remember(target.question, target, sql, df, source, answer)
+            return answer
+
+    def full(self, pipeline, question: str) -> str:
+        pipeline.times = 1
+        if hasattr(pipeline, "retrieve"):
+            pipeline.retrieve(question)
+        answer = pipeline.ask(question)
+        sql, df, source = pipeline.last_query or (None, None, None)
+        self.thinking = pipeline.partial.get("thinking", self.thinking)
+        self.remember(question, pipeline.slot_result, sql, df, source, answer)
+        return answer
+
+    def remember(self, question, slot_result, sql, df, source, answer):
+        self.question = question
+        self.slot_result = slot_result
+        self.sql, self.result, self.source = sql, df, source
+        self.answer = answer
+        self.updated = time.time()
+
+    def delta(self, pipeline, question: str) -> Optional[Delta]:
+        """解析追问中的槽位变化，不是追问或没有上一轮槽位时返回None"""
+        if self.slot_result is None:
+            return None
+        extractor = pipeline.slot_extractor
+        delta = Delta()
+        start, end, covered = extractor.parse_time(question)
+        if covered:
+            # 追问没有写年份时沿用上一轮的年份
+            if not re.search(r"\d{4}", question) and start[:4] == end[:4]:
+                year = self.slot_result.start[:4]
+                start, end = year + start[4:], year + end[4:]
+            delta.start, delta.end = start, end
+        for begin, finish, word, payload in extractor.automaton.find_longest(question):
+            if any(b <= begin < e for b, e in covered):
+                continue
+            kind, value = payload if isinstance(payload, tuple) else (payload, word)
+            if kind == "科室":
+                delta.departments.append(value)
+            elif kind == "意图":
+                delta.intent = value
+            elif kind == "医师":
+                delta.doctors.append(value)
+            elif kind == "病种":
+                delta.diseases.append(value)
+            elif kind == "指标":
+                delta.metrics.append(value)
+        if not delta.departments:
+            delta.departments = self.ward_shorthand(pipeline.department_index, question)
+        # 重复上一轮已有的取值不算变化
+        previous = self.slot_result
+        if delta.intent == previous.slots["意图"]:
+            delta.intent = None
+        if set(delta.doctors) == set(previous.doctors):
+            delta.doctors = []
+        if set(delta.diseases) == set(previous.diseases):
+            delta.diseases = []
+        if set(delta.metrics) == set(previous.slots["指标"]):
+            delta.metrics = []
+        followup = FOLLOWUP_RE.search(question.strip()) or (
+            not delta.shape_changed and len(question) <= MAX_FOLLOWUP_LENGTH)
+        # 没有解析出任何变化(如提到词典中没有的科室)时不当作追问，以免重复回答上一轮的问题
+        return delta if followup and not delta.empty else None
+
+    def ward_shorthand(self, department_index, question: str) -> List[str]:
+        """“二区”这类简称按上一轮科室的前缀补全为“骨科二区”"""
+        names = []
+        for shorthand in WARD_SHORTHAND_RE.findall(question):
+            candidates = [n for n in department_index.children if n.endswith(shorthand)]
+            previous = self.slot_result.wards + self.slot_result.slots["科室"].split("，")
+            for name in sorted(candidates, key=lambda n: -max(len(common_prefix(n, p)) for p in previous)):
+                names.append(name)
+                break
+        return names
+
+    def merge(self, pipeline, delta: Delta):
+        """上一轮的槽位加上追问的变化，得到本轮完整的 SlotResult"""
+        previous = self.slot_result
+        intent = delta.intent or previous.slots["意图"]
+        diseases = delta.diseases or ([] if delta.intent and intent != "重点病种" else previous.diseases)
+        doctors = delta.doctors or previous.doctors
+        if delta.metrics:
+            metrics = delta.metrics
+        elif intent != previous.slots["意图"]:
+            metrics = list(INTENT_METRICS[intent])
+        else:
+            metrics = previous.slots["指标"]
+        departments = delta.departments or previous.slots["科室"].split("，")
+        start, end = (delta.start, delta.end) if delta.start else (previous.start, previous.end)
+        return pipeline.slot_extractor.compose(intent, start, end, departments, doctors, diseases, metrics)
+
+    def patch(self, pipeline, target):
+        """依次尝试复用已有结果、汇总表路由和改写上一轮SQL，返回 (SQL, 结果, 来源)"""
+        import pandas as pd
+
+        pipeline.slot_result = target
+        sql, df = pipeline.reuse_result()
+        if df is not None:
+            return sql, df, "reuse"
+        sql, df = pipeline.run_routed_sql()
+        if df is not None:
+            return sql, df, "rollup"
+        if self.sql is None or self.source == "reuse":
+            return None, None, None
+        previous = self.slot_result
+        sql = self.sql
+        if (target.start, target.end) != (previous.start, previous.end):
+            sql = replace_dates(sql, (previous.start, previous.end), (target.start, target.end))
+        if sql is not None and set(target.wards) != set(previous.wards):
+            departments = target.slots["科室"].split("，")
+            sql = replace_wards(sql, previous.wards, target.wards,
+                                lambda column: pipeline.department_index.predicate(departments, column))
+        if sql is None:
+            return None, None, None
+        with span("followup_sql"):
+            ok, df = pipeline.run_sql(sql)
+        if not ok or not isinstance(df, pd.DataFrame):
+            pipeline.log(pipeline.logger, "followup SQL error:" + str(df))
+            return None, None, None
+        if pipeline.result_reuse is not None:
+            pipeline.result_reuse.remember(target, sql, df)
+        pipeline.last_query = (sql, df, "followup")
+        return sql, df, "followup"
+
+
+def common_prefix(a: str, b: str) -> str:
+    n = 0
+    while n < min(len(a), len(b)) and a[n] == b[n]:
+        n += 1
+    return a[:n]
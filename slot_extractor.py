@@ -0,0 +1,351 @@
+import calendar
+import os
+import re
+from typing import Dict, List, Tuple
+
+from config import slot_config
+from department import DepartmentIndex
+
+CN_NUM = {"一": 1, "二": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9, "十": 10}
+
+# 语义分析提示词里各意图的全部指标
+INTENT_METRICS = {
+    "科室概览": ["出院人数", "手术例数", "出院患者手术台次数", "出院患者手术占比", "出院患者四级手术台次数",
+                 "出院患者四级手术比例", "出院患者微创手术台次数", "出院患者微创手术占比"],
+    "重点病种": ["病种", "主刀医师", "例数", "均次费", "均次药费", "药占比", "均次卫生材料费", "耗占比",
+                 "去药去耗材占比", "平均住院日"],
+    "医师": ["姓名", "工号", "出院人数", "住院均次费用", "药占比（住院）", "耗占比（住院）"],
+}
+
+INTENT_KEYWORDS = {
+    "科室概览": ["科室概览", "概览", "科室情况"],
+    "重点病种": ["重点病种", "病种"],
+    "医师": ["医师", "医生", "大夫"],
+}
+
+# 不携带语义、但也不需要交给大模型理解的连接词
+FILLER_WORDS = ["期间", "情况", "如何", "是多少", "多少", "怎么样", "怎样", "数据", "相关", "指标", "包括", "的",
+                "和", "与", "及", "在", "中", "，", ",", "、", "？", "?", "。", "：", ":", "请问", "查询", "统计",
+                "一下", "看看", "全部", "所有", "各", "每个", "分别", "进行", "科室", "默认", "为", "年", "月", "日", "号",
+                " "]
+# 称谓前未被词典识别的文字视为不认识的人名
+TITLE_RE = re.compile(r"医生|医师|主任|大夫")
+CJK_RUN_RE = re.compile(r"[\u4e00-\u9fff]{2,}")
+
+TIME_PATTERNS = [
+    ("range", re.compile(
+        r"(\d{4})[-年/.](\d{1,2})[-月/.](\d{1,2})[日号]?\s*(?:至|到|~|～|—)\s*"
+        r"(?:(\d{4})[-年/.])?(\d{1,2})[-月/.](\d{1,2})[日号]?")),
+    ("month_range", re.compile(
+        r"(?:(\d{4})年)?(\d{1,2}|[一二三四五六七八九十]{1,3})月?份?\s*(?:至|到|~|～|-|—)\s*"
+        r"(\d{1,2}|[一二三四五六七八九十]{1,3})月份?")),
+    ("half", re.compile(r"(?:(\d{4})年)?([上下])半年")),
+    ("quarter", re.compile(r"(?:(\d{4})年)?第?([1-4一二三四])季度")),
+    ("month", re.compile(r"(?:(\d{4})年)?(\d{1,2}|[一二三四五六七八九十]{1,3})月份?")),
+    ("year", re.compile(r"(\d{4})年(?:全年|度)?")),
+]
+# 尚不支持的相对时间说法，出现时不能用默认时间代替
+RELATIVE_TIME_RE = re.compile(r"去年|今年|本年|前年|明年|本月|这个?月|上个?月|下个?月|本季度|这个?季度|上个?季度|"
+                              r"近[\d一二三四五六七八九十半]+个?[年月周天日]|最近|上周|本周|昨天|今天|至今|年初|年底|年末")
+MONTH_MENTION_RE = re.compile(r"(\d{1,2}|[一二三四五六七八九十]{1,3})月")
+
+
+def cn_to_int(text: str) -> int:
+    if text.isdigit():
+        return int(text)
+    if text == "十":
+        return 10
+    if text.startswith("十"):
+        return 10 + CN_NUM[text[1]]
+    if len(text) == 1:
+        return CN_NUM[text]
+    return CN_NUM[text[0]] * 10 + (CN_NUM[text[2]] if len(text) == 3 else 0)
+
+
+def valid_date(year: int, month: int, day: int) -> bool:
+    return 1 <= month <= 12 and 1 <= day <= calendar.monthrange(year, month)[1]
+
+
+def month_end(year: int, month: int) -> str:
+    return f"{year:04d}-{month:02d}-{calendar.monthrange(year, month)[1]:02d}"
+
+
+class AhoCorasick:
+    """纯 Python 实现的 Aho-Corasick 多模式匹配，用于一次扫描问题中的所有词典词"""
+
+    def __init__(self):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        self.built = False
+
+    def add(self, word: str, payload=None):
+        if not word:
+            return
+        node = 0
+        for ch in word:
+            nxt = self.goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[node][ch] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            node = nxt
+        self.output[node].append((word, payload))
+        self.built = False
+
+    def build(self):
+        queue = list(self.goto[0].values())
+        for node in queue:
+            self.fail[node] = 0
+        head = 0
+        while head < len(queue):
+            node = queue[head]
+            head += 1
+            for ch, child in self.goto[node].items():
+                queue.append(child)
+                state = self.fail[node]
+                while state and ch not in self.goto[state]:
+                    state = self.fail[state]
+                self.fail[child] = self.goto[state].get(ch, 0)
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+        self.built = True
+
+    def iter(self, text: str):
+        if not self.built:
+            self.build()
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(ch, 0)
+            for word, payload in self.output[node]:
+                yield i - len(word) + 1, i + 1, word, payload
+
+    def find_longest(self, text: str) -> List[Tuple[int, int, str, object]]:
+        """返回从左到右、最长优先、互不重叠的匹配"""
+        matches = sorted(self.iter(text), key=lambda m: (m[0], -(m[1] - m[0])))
+        result, last_end = [], 0
+        for match in matches:
+            if match[0] >= last_end:
+                result.append(match)
+                last_end = match[1]
+        return result
+
+
+class SlotResult:
+    def __init__(self, question: str, slots: Dict, confidence: float, wards: List[str], doctors: List[str],
+                 diseases: List[str] = None, start: str = None, end: str = None):
+        self.question = question
+        self.slots = slots
+        self.confidence = confidence
+        self.wards = wards
+        self.doctors = doctors
+        self.diseases = diseases or []
+        self.start = start
+        self.end = end
+
+    def to_semantic(self) -> Dict:
+        return {"Done": "True", "question": self.question, "result": self.slots}
+
+    def __repr__(self):
+        return f"SlotResult(confidence={self.confidence:.2f}, slots={self.slots})"
+
+
+class SlotExtractor:
+    def __init__(self, config=None, department_index: DepartmentIndex = None):
+        if config is None:
+            config = slot_config
+        self.config = config
+        self.prefix_dir = self.config.get("prefix_dir", "")
+        self.index_file = self.config.get("index_file", "")
+        self.document_file = self.config.get("document_file", "")
+        self.default_start, self.default_end = self.config.get("default_time", ("2023-01-01", "2023-11-30"))
+        self.default_department = self.config.get("default_department", "骨科")
+        self.department_index = department_index or DepartmentIndex.from_files(self.config)
+        # 用 dict 保持插入顺序，词典构建结果不随哈希种子变化
+        self.diseases = {}
+        self.metrics = {}
+        self.doctors = dict.fromkeys(self.config.get("doctors", []))
+        self.load_from_files()
+
+    def read_file(self, file_name: str) -> str:
+        path = os.path.join(self.prefix_dir, file_name)
+        if not file_name or not os.path.isfile(path):
+            return ""
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read()
+
+    def load_from_files(self):
+        for line in self.read_file(self.index_file).split(";\n"):
+            if "=" in line:
+                self.metrics[line.split("=", 1)[0].strip()] = None
+        for line in self.read_file(self.document_file).split(";\n"):
+            if "的主手术代码" in line:
+                name = line.split("的主手术代码", 1)[0].strip()
+                self.diseases[name] = None
+        for metrics in INTENT_METRICS.values():
+            self.metrics.update(dict.fromkeys(metrics))
+        self.build()
+
+    def load_from_db(self, run_sql):
+        """补充数据库中实际出现的出院科室和带组医师"""
+        ok, df = run_sql("SELECT DISTINCT `出院科室` FROM `病历记录`;")
+        if ok:
+            for ward in df.iloc[:, 0].dropna():
+                self.department_index.add_leaf(str(ward))
+            self.department_index.compile()
+        ok, df = run_sql("SELECT DISTINCT `带组医师` FROM `病历记录`;")
+        if ok:
+            self.doctors.update(dict.fromkeys(str(name) for name in df.iloc[:, 0].dropna()))
+        self.build()
+
+    def build(self):
+        """同一个词只保留先加入的含义：完整名称优先于简称，如“耗占比”是指标本身而不是“耗占比（住院）”的简称"""
+        words = {}
+        for name in self.department_index.children:
+            words.setdefault(name, "科室")
+        for name in self.diseases:
+            words.setdefault(name, "病种")
+        for name in self.metrics:
+            words.setdefault(name, "指标")
+        for name in self.doctors:
+            words.setdefault(name, "医师")
+        for intent, keywords in INTENT_KEYWORDS.items():
+            for keyword in keywords:
+                words.setdefault(keyword, ("意图", intent))
+        for name in self.diseases:
+            if "相关" in name:
+                words.setdefault(name.replace("相关", ""), ("病种", name))
+        for name in self.metrics:
+            if "（" in name:
+                words.setdefault(name.split("（")[0], ("指标", name))
+        self.automaton = AhoCorasick()
+        for word, payload in words.items():
+            self.automaton.add(word, payload)
+        self.automaton.build()
+
+    def parse_time(self, question: str) -> Tuple[str, str, List[Tuple[int, int]]]:
+        default_year = int(self.default_start[:4])
+        for kind, pattern in TIME_PATTERNS:
+            match = pattern.search(question)
+            if not match:
+                continue
+            g = match.groups()
+            if kind == "range":
+                end_year = int(g[3]) if g[3] else int(g[0])
+                if not (valid_date(int(g[0]), int(g[1]), int(g[2])) and valid_date(end_year, int(g[4]), int(g[5]))):
+                    continue
+                start = f"{int(g[0]):04d}-{int(g[1]):02d}-{int(g[2]):02d}"
+                end = f"{end_year:04d}-{int(g[4]):02d}-{int(g[5]):02d}"
+            elif kind == "month_range":
+                first, last = cn_to_int(g[1]), cn_to_int(g[2])
+                if not (1 <= first <= 12 and 1 <= last <= 12):
+                    continue
+                year = int(g[0]) if g[0] else default_year
+                start = f"{year:04d}-{first:02d}-01"
+                # “11月到2月”跨年，结束月份算到下一年
+                end = month_end(year + 1 if last < first else year, last)
+            elif kind == "half":
+                year = int(g[0]) if g[0] else default_year
+                start, end = (f"{year}-01-01", f"{year}-06-30") if g[1] == "上" else (f"{year}-07-01", f"{year}-12-31")
+            elif kind == "quarter":
+                year = int(g[0]) if g[0] else default_year
+                quarter = cn_to_int(g[1])
+                start = f"{year:04d}-{quarter * 3 - 2:02d}-01"
+                end = month_end(year, quarter * 3)
+            elif kind == "month":
+                month = cn_to_int(g[1])
+                if not 1 <= month <= 12:
+                    continue
+                year = int(g[0]) if g[0] else default_year
+                start, end = f"{year:04d}-{month:02d}-01", month_end(year, month)
+            else:
+                year = int(g[0])
+                start, end = f"{year}-01-01", f"{year}-12-31"
+            return start, end, [match.span()]
+        return self.default_start, self.default_end, []
+
+    def extract(self, question: str) -> SlotResult:
+        start, end, covered = self.parse_time(question)
+        departments, doctors, diseases, metrics, intents = [], [], [], [], []
+        for begin, finish, word, payload in self.automaton.find_longest(question):
+            if any(b <= begin < e for b, e in covered):
+                continue
+            kind, value = payload if isinstance(payload, tuple) else (payload, word)
+            target = {"科室": departments, "医师": doctors, "病种": diseases, "指标": metrics, "意图": intents}[kind]
+            if value not in target:
+                target.append(value)
+            covered.append((begin, finish))
+
+        if intents and not (diseases and intents[0] == "医师"):
+            intent, intent_conf = intents[0], 1.0
+        elif diseases:
+            intent, intent_conf = "重点病种", 0.9
+        elif doctors:
+            intent, intent_conf = "医师", 0.9
+        elif metrics:
+            candidates = [i for i, m in INTENT_METRICS.items() if all(x in m for x in metrics)]
+            intent, intent_conf = (candidates[0], 0.8) if len(candidates) == 1 else ("科室概览", 0.5)
+        else:
+            intent, intent_conf = "科室概览", 0.3
+
+        # 已识别的词和连接词替换为等长的占位符，保留其余文字的位置
+        masked = list(question)
+        for b, e in covered:
+            masked[b:e] = "|" * (e - b)
+        masked = "".join(masked)
+        for word in sorted(FILLER_WORDS, key=len, reverse=True):
+            masked = masked.replace(word, "|" * len(word))
+        residual = masked.replace("|", "")
+        coverage = 1 - len(residual) / max(len(question), 1)
+        confidence = round(min(intent_conf, 0.4 + 0.6 * coverage), 2)
+        if end < start or self.has_unparsed_time(question, covered):
+            # 时间范围颠倒，或有没能解析的时间说法，不能按默认时间回答
+            confidence = min(confidence, self.config.get("unparsed_time_confidence", 0.5))
+        if self.has_unknown_entity(question, masked):
+            # 问题中有词典不认识的人名、科室等，按比例算出的置信度会偏高，交给大模型处理
+            confidence = min(confidence, self.config.get("unknown_entity_confidence", 0.5))
+        return self.compose(intent, start, end, departments, doctors, diseases, metrics, confidence)
+
+    @staticmethod
+    def has_unparsed_time(question: str, covered: List[Tuple[int, int]]) -> bool:
+        """相对时间说法，或时间解析没有覆盖到的“X月”(如月份超出范围)"""
+        if RELATIVE_TIME_RE.search(question):
+            return True
+        return any(not any(b <= m.start() < e for b, e in covered) for m in MONTH_MENTION_RE.finditer(question))
+
+    @staticmethod
+    def has_unknown_entity(question: str, masked: str) -> bool:
+        """未识别的连续两个以上汉字，或称谓前未识别的文字"""
+        if CJK_RUN_RE.search(masked):
+            return True
+        for match in TITLE_RE.finditer(question):
+            if re.search(r"[\u4e00-\u9fff]$", masked[:match.start()]):
+                return True
+        return False
+
+    def compose(self, intent: str, start: str, end: str, departments: List[str], doctors: List[str],
+                diseases: List[str], metrics: List[str], confidence: float = 1.0) -> SlotResult:
+        """由各槽位取值生成完整问题和 SlotResult，多轮追问时用来合并上一轮的槽位"""
+        if not metrics or metrics == ["病种"]:
+            metrics = list(INTENT_METRICS[intent])
+        if not departments:
+            departments = [self.default_department]
+        wards = self.department_index.resolve(departments)
+
+        other = "、".join(diseases)
+        if doctors:
+            other = (other + "；" if other else "") + "带组医师：" + "、".join(doctors)
+        slots = {
+            "意图": intent,
+            "时间": f"{start}至{end}",
+            "科室": "，".join(departments),
+            "指标": metrics,
+            "其他信息": other,
+        }
+        subject = "和".join(doctors) + "在" if doctors else ""
+        topic = "".join(diseases) + "的" if diseases else ""
+        full_question = f"{start}至{end}期间，{subject}{slots['科室']}的{topic}{'，'.join(metrics)}情况"
+        return SlotResult(full_question, slots, confidence, wards, doctors, diseases, start, end)
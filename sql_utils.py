@@ -0,0 +1,71 @@
+import re
+from typing import List, Tuple
+
+TOKEN_RE = re.compile(r"""
+    (?P<ws>\s+)
+  | (?P<comment>--[^\n]*|\#[^\n]*|/\*.*?\*/)
+  | (?P<string>'(?:[^'\\]|\\.|'')*'|"(?:[^"\\]|\\.|"")*")
+  | (?P<ident>`[^`]+`)
+  | (?P<number>\d+(?:\.\d+)?)
+  | (?P<word>[^\W\d]\w*)
+  | (?P<op><=|>=|<>|!=|=|<|>|\|\||[-+*/%])
+  | (?P<punct>[(),.;])
+  | (?P<other>.)
+""", re.VERBOSE | re.DOTALL)
+
+def tokenize(sql: str, raw: bool = False) -> List[Tuple[str, str]]:
+    """把SQL切分为 (类型, 文本)，类型为 ws/comment/string/number/word/op/punct/other
+
+    反引号标识符归为 word 并去掉反引号；raw=True 时保留原文，便于改写后拼回SQL
+    """
+    tokens = []
+    for match in TOKEN_RE.finditer(sql):
+        kind = match.lastgroup
+        text = match.group()
+        if kind == "ident" and raw:
+            kind = "word"
+        elif kind == "ident":
+            kind, text = "word", text[1:-1]
+        tokens.append((kind, text))
+    return tokens
+
+
+def significant(tokens: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    return [t for t in tokens if t[0] not in ("ws", "comment")]
+
+
+def normalize_sql(sql: str) -> str:
+    """去掉注释、统一空白和关键字大小写，保留字面量，用作缓存等场景的键"""
+    parts = []
+    for kind, text in significant(tokenize(sql)):
+        if kind == "word" and text.upper() in KEYWORDS:
+            text = text.upper()
+        elif kind == "word" and not re.fullmatch(r"\w+", text):
+            text = f"`{text}`"
+        parts.append(text)
+    return " ".join(parts).rstrip(" ;")
+
+
+def referenced_tables(sql: str) -> List[str]:
+    """FROM/JOIN 之后出现的表名，排除 WITH 定义的临时结果集"""
+    tokens = significant(tokenize(sql))
+    ctes, tables = set(), []
+    for i, (kind, text) in enumerate(tokens):
+        upper = text.upper() if kind == "word" else ""
+        if upper == "AS" and i > 0 and i + 1 < len(tokens) and tokens[i + 1][1] == "(":
+            ctes.add(tokens[i - 1][1])
+        if upper in ("FROM", "JOIN") and i + 1 < len(tokens) and tokens[i + 1][0] == "word":
+            name = tokens[i + 1][1]
+            if i + 3 < len(tokens) and tokens[i + 2][1] == ".":
+                name = tokens[i + 3][1]
+            if name.upper() not in KEYWORDS and name not in tables:
+                tables.append(name)
+    return [t for t in tables if t not in ctes]
+
+
+KEYWORDS = {
+    "SELECT", "FROM", "WHERE", "AND", "OR", "NOT", "IN", "IS", "NULL", "AS", "ON", "JOIN", "INNER", "LEFT",
+    "RIGHT", "OUTER", "CROSS", "GROUP", "BY", "ORDER", "HAVING", "LIMIT", "OFFSET", "UNION", "ALL", "DISTINCT",
+    "WITH", "CASE", "WHEN", "THEN", "ELSE", "END", "BETWEEN", "LIKE", "ASC", "DESC", "EXISTS", "COUNT", "SUM",
+    "AVG", "MIN", "MAX", "DATEDIFF", "INTERVAL", "SET",
+}
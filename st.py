@@ -1,19 +1,172 @@
+import csv
+import io
+import time
+
+import pandas as pd
 import streamlit as st
-from config import mysql_config
+import deadline
+from config import guard_config, mysql_config
+from exceptions import ClarificationRequired, DeadlineExceeded, QueryTooExpensiveError
 from rag_sql import RAG_SQL
 
+STAGE_NAMES = {"semantic": "语义解析", "sql": "生成SQL", "rows": "查询数据", "token": "首个回答字", "done": "回答完成"}
+CSV_CHUNK_ROWS = 50000
 
-def main():
+
+def raise_clarification(message: str) -> str:
+    raise ClarificationRequired(message)
+
+
+@st.cache_resource(show_spinner="正在加载向量库、模型和数据库连接...")
+def load_pipeline():
+    """进程内只初始化一次：向量库、嵌入模型、数据库连接池和大模型客户端"""
     rag = RAG_SQL()
+    rag.clarify_callback = raise_clarification
+    rag.confirm_callback = lambda message: "y"
+    rag.add_example_callback = lambda question, sql: "n"
+    rag.connect_to_mysql(**mysql_config)
+    rag.warmup()
+    return rag
+
+
+def session_pipeline():
+    """每个浏览器会话一个副本，保存单次提问的状态"""
+    if "rag" not in st.session_state:
+        st.session_state.rag = load_pipeline().fork()
+    return st.session_state.rag
+
+
+def frame_chunks(df: pd.DataFrame):
+    columns = list(df.columns)
+    for start in range(0, max(len(df), 1), CSV_CHUNK_ROWS):
+        yield columns, list(df.iloc[start:start + CSV_CHUNK_ROWS].itertuples(index=False, name=None))
+
+
+def export_csv(chunks) -> bytes:
+    """逐块把 (列名, 行) 编码为 CSV，不需要先组装成 DataFrame；生成的文件整体在内存中供下载
+
+    带 BOM 以便 Excel 正确识别中文。
+    """
+    buffer = io.BytesIO()
+    text = io.TextIOWrapper(buffer, encoding="utf-8-sig", newline="")
+    writer = None
+    for columns, rows in chunks:
+        if writer is None:
+            writer = csv.writer(text, lineterminator="\n")
+            writer.writerow(columns)
+        writer.writerows(rows)
+    text.flush()
+    data = buffer.getvalue()
+    text.detach()
+    return data
+
+
+def export_parquet(df: pd.DataFrame) -> bytes:
+    buffer = io.BytesIO()
+    df.to_parquet(buffer, index=False)
+    return buffer.getvalue()
+
+
+def export_result(state, df: pd.DataFrame, fmt: str) -> bytes:
+    """页面上的结果没有被默认 LIMIT 截断时直接导出，不再查询
+
+    截断时重新读取完整结果：仍做 EXPLAIN 预检、加超时提示并受截止时间约束，只去掉默认 LIMIT。
+    """
+    limit = guard_config.get("default_limit") if guard_config.get("enabled") else None
+    truncated = state["source"] == "generated" and bool(limit) and len(df) >= limit
+    if not truncated:
+        return export_csv(frame_chunks(df)) if fmt == "CSV" else export_parquet(df)
+    with deadline.budget():
+        chunks = session_pipeline().stream_sql(state["sql"], CSV_CHUNK_ROWS)
+        if fmt == "CSV":
+            return export_csv(chunks)
+        df = pd.concat([pd.DataFrame(rows, columns=columns) for columns, rows in chunks], ignore_index=True)
+    return export_parquet(df)
+
+
+def run(rag, question, reget_info):
+    """按阶段逐步展示提问过程，回答内容边生成边显示，结束后把结果存入会话"""
+    rag.times = 1
+    rag.retrieve(question)
+    status = st.status("正在理解问题...", expanded=True)
+    answer_box = st.empty()
+    state = {"key": (question, reget_info), "timings": [], "sql": None, "source": None, "result": None, "answer": "",
+             "exports": {}}
+    started = time.perf_counter()
+    try:
+        for event in rag.ask_stream(question, reget_info):
+            stage = event["stage"]
+            if stage != "token" or not state["answer"]:
+                state["timings"].append((STAGE_NAMES[stage], time.perf_counter() - started))
+            if stage == "semantic":
+                status.update(label="正在生成SQL...")
+                status.write("语义解析：" + str(event["semantic"]))
+            elif stage == "sql":
+                state["sql"], state["source"] = event["sql"], event["source"]
+                status.update(label="正在查询数据...")
+                status.code(event["sql"], language="sql")
+            elif stage == "rows":
+                state["result"] = event["result"]
+                status.update(label=f"已查询到 {event['rows']} 行，正在生成回答...")
+            elif stage == "token":
+                state["answer"] += event["text"]
+                answer_box.markdown(state["answer"])
+            elif stage == "done":
+                state["answer"] = event["answer"]
+                status.update(label="完成", state="complete", expanded=False)
+        answer_box.empty()
+    except ClarificationRequired as e:
+        status.update(label="需要补充信息", state="error", expanded=False)
+        state["clarify"] = e.message
+    except DeadlineExceeded as e:
+        # 已展示的SQL、查询结果和部分回答保留在 state 中
+        status.update(label="处理超时", state="error", expanded=False)
+        state["timeout"] = str(e)
+    st.session_state.last = state
+
+
+def show(state):
+    if state.get("clarify"):
+        st.warning(state["clarify"])
+        return
+    if state.get("timeout"):
+        st.warning(state["timeout"] + "，以下为已得到的部分结果")
+    if state["sql"]:
+        with st.expander("SQL"):
+            st.code(state["sql"], language="sql")
+    st.markdown(state["answer"])
+    df = state["result"]
+    if df is not None:
+        st.dataframe(df)
+        # 用户点击后才生成导出文件，生成后在会话中缓存，之后的重新运行不会再次生成
+        fmt = st.radio("下载格式", ["CSV", "Parquet"], horizontal=True)
+        if fmt not in state["exports"] and st.button(f"生成{fmt}文件"):
+            try:
+                state["exports"][fmt] = export_result(state, df, fmt)
+            except ImportError:
+                st.info("导出 Parquet 需要安装 pyarrow")
+            except (QueryTooExpensiveError, DeadlineExceeded) as e:
+                st.warning("完整结果无法导出：" + str(e))
+        if fmt in state["exports"]:
+            st.download_button(f"下载{fmt}", state["exports"][fmt], file_name="result." + fmt.lower(),
+                               mime="text/csv" if fmt == "CSV" else "application/octet-stream")
+    st.sidebar.subheader("阶段耗时")
+    st.sidebar.table(pd.DataFrame(state["timings"], columns=["阶段", "累计耗时(秒)"]).round(2))
+
+
+def main():
+    rag = session_pipeline()
+    st.sidebar.title("导航")
     question = st.text_input("请输入问题：")
+    reget_info = ""
+    last = st.session_state.get("last")
+    if last and last["key"][0] == question and (last.get("clarify") or last["key"][1]):
+        reget_info = st.text_input("请补充或确认相关信息：")
     if question:
-        rag.index_info = rag.get_similar_index(question)
-        rag.document_info = rag.get_similar_document(question)
-        rag.example_info = rag.get_similar_examples(question)
-        rag.connect_to_mysql(**mysql_config)
-        result = rag.ask(question)
-        st.sidebar.title("导航")
-        st.write(result)
+        if last is None or last["key"] != (question, reget_info):
+            # 点击按钮会触发重新运行，从而中止当前提问
+            st.sidebar.button("停止")
+            run(rag, question, reget_info)
+        show(st.session_state.last)
 if __name__ == "__main__":
     main()
-
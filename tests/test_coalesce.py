@@ -0,0 +1,53 @@
+import threading
+import time
+
+import pytest
+
+import deadline
+from coalesce import SingleFlight
+from exceptions import DeadlineExceeded
+
+
+def start_leader(flight, key, fn):
+    started = threading.Event()
+    errors = []
+
+    def run():
+        def call():
+            started.set()
+            return fn()
+        try:
+            flight.do(key, call)
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    started.wait()
+    return thread, errors
+
+
+def test_waiter_out_of_budget_raises_deadline_exceeded():
+    flight = SingleFlight()
+    release = threading.Event()
+    thread, _ = start_leader(flight, "k", lambda: release.wait(5))
+    try:
+        with deadline.budget(0.1), pytest.raises(DeadlineExceeded):
+            deadline.shared(flight, "k", lambda: "waiter", "coalesce")
+    finally:
+        release.set()
+        thread.join()
+
+
+def test_leader_deadline_is_not_passed_to_waiters():
+    flight = SingleFlight()
+
+    def leader():
+        time.sleep(0.1)
+        raise DeadlineExceeded("db")
+
+    thread, errors = start_leader(flight, "k", leader)
+    result, shared = flight.do("k", lambda: "waiter")
+    thread.join()
+    assert (result, shared) == ("waiter", False)
+    assert isinstance(errors[0], DeadlineExceeded)
@@ -0,0 +1,23 @@
+from decimal import Decimal
+
+import pandas as pd
+import pytest
+
+from department import DepartmentIndex
+
+
+def test_rollup_recomputes_ratios_and_averages():
+    index = DepartmentIndex({"骨科": ["骨科一区", "骨科二区"]})
+    df = pd.DataFrame({
+        "出院科室": ["骨科一区", "骨科二区"],
+        "出院人数": [10, 30],
+        "均次费": [Decimal("100"), Decimal("200")],
+        "药占比": [10.0, 20.0],
+        "出院患者手术台次数": [5, 15],
+        "出院患者手术占比": [50.0, 50.0],
+    })
+    row = index.rollup(df, groups=["骨科"]).iloc[0]
+    assert row["出院人数"] == 40
+    assert row["均次费"] == pytest.approx(175.0)
+    assert row["药占比"] == pytest.approx(130000 / 7000)
+    assert row["出院患者手术占比"] == pytest.approx(50.0)
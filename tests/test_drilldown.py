@@ -0,0 +1,53 @@
+import pandas as pd
+
+from config import slot_config
+from drilldown import ResultReuse
+from slot_extractor import SlotExtractor
+
+extractor = SlotExtractor(dict(slot_config, doctors=["蔡明", "张立国"]))
+
+
+def doctor_frame(names):
+    return pd.DataFrame({"姓名": names, "工号": [f"D{i}" for i in range(len(names))],
+                         "出院人数": [10] * len(names), "耗占比（住院）": [20.0 + i for i in range(len(names))]})
+
+
+def reuse_with(question, df):
+    reuse = ResultReuse({"max_entries": 8, "ttl": 600})
+    reuse.remember(extractor.extract(question), "SELECT 1", df)
+    return reuse
+
+
+def test_single_doctor_result_does_not_answer_all_doctors():
+    reuse = reuse_with("2023-01-01至2023-02-28期间，蔡明在骨科的耗占比（住院）", doctor_frame(["蔡明"]))
+    sql, df = reuse.answer(extractor.extract("2023-01-01至2023-02-28期间，骨科医生的耗占比（住院）"))
+    assert df is None
+
+
+def test_all_doctors_result_answers_single_doctor():
+    reuse = reuse_with("2023-01-01至2023-02-28期间，骨科医生的耗占比（住院）", doctor_frame(["蔡明", "张立国"]))
+    sql, df = reuse.answer(extractor.extract("2023-01-01至2023-02-28期间，蔡明在骨科的耗占比（住院）"))
+    assert df["姓名"].tolist() == ["蔡明"]
+
+
+def test_doctor_outside_cached_subset_is_not_answered():
+    reuse = reuse_with("2023-01-01至2023-02-28期间，蔡明在骨科的耗占比（住院）", doctor_frame(["蔡明"]))
+    sql, df = reuse.answer(extractor.extract("2023-01-01至2023-02-28期间，张立国在骨科的耗占比（住院）"))
+    assert df is None
+
+
+def test_ward_subset_is_filtered_and_superset_is_not_answered():
+    overview = pd.DataFrame({"出院科室": ["骨科一区", "骨科二区"], "出院人数": [10, 30]})
+    reuse = reuse_with("2023-01-01至2023-11-30骨科科室概览，指标为出院人数", overview)
+    sql, df = reuse.answer(extractor.extract("2023-01-01至2023-11-30骨科一区科室概览，指标为出院人数"))
+    assert df["出院科室"].tolist() == ["骨科一区"]
+
+    reuse = reuse_with("2023-01-01至2023-11-30骨科一区科室概览，指标为出院人数", overview.iloc[:1])
+    sql, df = reuse.answer(extractor.extract("2023-01-01至2023-11-30骨科科室概览，指标为出院人数"))
+    assert df is None
+
+
+def test_wider_period_is_not_answered():
+    reuse = reuse_with("2023-01-01至2023-02-28期间，骨科医生的耗占比（住院）", doctor_frame(["蔡明", "张立国"]))
+    sql, df = reuse.answer(extractor.extract("2023-01-01至2023-11-30期间，骨科医生的耗占比（住院）"))
+    assert df is None
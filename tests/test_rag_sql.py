@@ -0,0 +1,14 @@
+from config import chromadb_config
+
+
+def test_rag_sql_uses_configured_embedding_function(monkeypatch):
+    from rag_sql import RAG_SQL
+
+    def embed(texts):
+        return [[float(len(t)), 1.0] for t in texts]
+
+    monkeypatch.setitem(chromadb_config, "embedding_function", embed)
+    monkeypatch.setitem(chromadb_config, "document_result", 3)
+    pipeline = RAG_SQL()
+    assert pipeline.embedding_function is embed
+    assert pipeline.document_result == 3
@@ -0,0 +1,30 @@
+import threading
+import time
+
+import pandas as pd
+
+from rollup import RollupBuilder
+
+
+def test_stale_rollup_refreshes_in_background():
+    release = threading.Event()
+    statements = []
+
+    def execute_sql(sql, args=None):
+        statements.append(sql)
+        if sql.lstrip().upper().startswith("INSERT"):
+            release.wait(5)
+        return 0
+
+    builder = RollupBuilder(lambda sql: (True, pd.DataFrame({"watermark": [None]})), execute_sql,
+                            {"max_staleness": 3600, "retry_interval": 0})
+    assert builder.ensure_fresh() is False
+    assert builder.refreshing
+    assert builder.ensure_fresh() is False
+    release.set()
+    for _ in range(100):
+        if not builder.refreshing:
+            break
+        time.sleep(0.05)
+    assert builder.ensure_fresh() is True
+    assert sum(s.lstrip().upper().startswith("DELETE") for s in statements) == 1
@@ -0,0 +1,67 @@
+from types import SimpleNamespace
+
+from department import DepartmentIndex
+from session import Conversation
+from slot_extractor import SlotExtractor
+
+
+def make_conversation(question):
+    pipeline = SimpleNamespace(slot_extractor=SlotExtractor(), department_index=DepartmentIndex.from_files())
+    conversation = Conversation()
+    conversation.slot_result = pipeline.slot_extractor.extract(question)
+    return pipeline, conversation
+
+
+def test_unknown_department_is_not_a_followup():
+    pipeline, conversation = make_conversation("2023-01-01至2023-11-30骨科一区的耗占比")
+    assert conversation.delta(pipeline, "脊柱外科呢") is None
+
+
+def test_ward_shorthand_followup():
+    pipeline, conversation = make_conversation("2023-01-01至2023-11-30骨科一区的耗占比")
+    delta = conversation.delta(pipeline, "那二区呢")
+    assert delta.departments == ["骨科二区"]
+    assert not delta.shape_changed
+
+
+def test_coalesced_turn_remembers_the_leaders_query(monkeypatch):
+    import threading
+    import time
+
+    import pandas as pd
+
+    from coalesce import question_flight
+    from config import coalesce_config
+    from Vllm import Vllm
+
+    monkeypatch.setitem(coalesce_config, "enabled", True)
+    question = "2023-01-01至2023-11-30骨科一区的耗占比"
+    leader = Vllm({"vllm_host": "http://127.0.0.1:9", "model": "test"})
+    waiter = leader.fork()
+    waiter.last_query = ("SELECT '其他会话的查询'", pd.DataFrame(), "generated")
+    release = threading.Event()
+    sql, df = "SELECT 1", pd.DataFrame({"耗占比": [0.3]})
+
+    def leader_ask(q, reget_info=""):
+        release.wait(5)
+        leader.slot_result = leader.slot_extractor.extract(q)
+        leader.last_query = (sql, df, "generated")
+        return "回答"
+
+    monkeypatch.setattr(leader, "_ask", leader_ask)
+    thread = threading.Thread(target=leader.ask, args=(question,))
+    thread.start()
+    while not question_flight.calls:
+        time.sleep(0.01)
+    conversation = Conversation()
+    waiting = threading.Thread(target=conversation.full, args=(waiter, question))
+    waiting.start()
+    call = next(iter(question_flight.calls.values()))
+    while call.waiters < 1:
+        time.sleep(0.01)
+    release.set()
+    thread.join()
+    waiting.join()
+    assert conversation.answer == "回答"
+    assert conversation.sql == sql
+    assert conversation.slot_result.slots["科室"] == "骨科一区"
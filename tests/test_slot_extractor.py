@@ -0,0 +1,72 @@
+from config import base_config, slot_config
+from slot_extractor import SlotExtractor
+
+
+def make_extractor(doctors):
+    return SlotExtractor(dict(slot_config, doctors=doctors))
+
+
+def test_unknown_doctor_before_title_is_not_confident():
+    extractor = make_extractor(["倪海键"])
+    result = extractor.extract("2023-01-01至2023-11-30期间，张立国医生在骨科进行的腰椎手术情况，包括手术例数，均次费，"
+                               "均次药费，药占比，均次卫生材料费，耗占比，去药去耗材占比，平均住院日")
+    assert result.confidence < base_config["SLOT_CONFIDENCE"]
+
+
+def test_unknown_name_next_to_known_doctor_is_not_confident():
+    extractor = make_extractor(["倪海键"])
+    result = extractor.extract("王五和倪海键在骨科的耗占比")
+    assert result.doctors == ["倪海键"]
+    assert result.confidence < base_config["SLOT_CONFIDENCE"]
+
+
+def test_known_doctors_stay_confident():
+    extractor = make_extractor(["张立国", "倪海键"])
+    result = extractor.extract("2023-01-01至2023-11-30期间，张立国医生在骨科进行的腰椎手术情况，包括手术例数，均次费，"
+                               "均次药费，药占比，均次卫生材料费，耗占比，去药去耗材占比，平均住院日")
+    assert result.doctors == ["张立国"]
+    assert result.confidence >= base_config["SLOT_CONFIDENCE"]
+    assert extractor.extract("王五和倪海键在骨科的耗占比").confidence < base_config["SLOT_CONFIDENCE"]
+
+
+def test_example_questions_without_names_stay_confident():
+    extractor = make_extractor(["张立国", "蔡明", "倪海键"])
+    for question in ["2023-01-01至2023-11-30骨科科室概览",
+                     "2023-01-01至2023-01-31腰椎手术情况，科室为骨科，指标包括手术例数，均次费，均次药费，药占比，"
+                     "均次卫生材料费，耗占比，去药去耗材占比，平均住院日",
+                     "张立国医生的腰椎手术在2023-01-01至2023-11-30期间的耗占比，科室默认为骨科"]:
+        assert extractor.extract(question).confidence >= base_config["SLOT_CONFIDENCE"]
+
+
+def test_extraction_does_not_depend_on_hash_seed():
+    import os
+    import subprocess
+    import sys
+
+    script = ("from slot_extractor import SlotExtractor; "
+              "print(SlotExtractor().extract('2023-01-01至2023-11-30骨科一区的耗占比'))")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    outputs = {subprocess.run([sys.executable, "-c", script], cwd=root, capture_output=True, text=True, check=True,
+                              env=dict(os.environ, PYTHONHASHSEED=str(seed))).stdout for seed in range(6)}
+    assert len(outputs) == 1
+
+
+def test_out_of_range_month_is_not_confident():
+    result = make_extractor([]).extract("骨科1-13月概览")
+    assert result.confidence < base_config["SLOT_CONFIDENCE"]
+
+
+def test_month_range_across_new_year():
+    result = make_extractor([]).extract("11月到2月骨科概览")
+    assert (result.start, result.end) == ("2023-11-01", "2024-02-29")
+
+
+def test_relative_time_is_not_confident():
+    result = make_extractor([]).extract("去年骨科概览")
+    assert result.confidence < base_config["SLOT_CONFIDENCE"]
+
+
+def test_invalid_date_range_is_skipped():
+    result = make_extractor([]).extract("2023-02-30至2023-03-31骨科概览")
+    assert result.start <= result.end
+    assert result.confidence < base_config["SLOT_CONFIDENCE"]
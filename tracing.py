@@ -0,0 +1,268 @@
+import contextvars
+import json
+import logging
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterable, Optional, Tuple
+
+from config import tracing_config
+
+current_trace = contextvars.ContextVar("current_trace", default=None)
+current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: Iterable[float]):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = sorted(buckets)
+        self.lock = threading.Lock()
+        # 标签 -> [各桶计数, 总和, 总数]
+        self.series = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.series.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            index = bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, (counts, total, count) in sorted(self.series.items()):
+                cumulative = 0
+                for bound, bucket in zip(self.buckets, counts):
+                    cumulative += bucket
+                    lines.append(f"{self.name}_bucket{format_labels(key + (('le', repr(float(bound))),))} {cumulative}")
+                lines.append(f"{self.name}_bucket{format_labels(key + (('le', '+Inf'),))} {count}")
+                lines.append(f"{self.name}_sum{format_labels(key)} {total}")
+                lines.append(f"{self.name}_count{format_labels(key)} {count}")
+        return "\n".join(lines)
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self.lock = threading.Lock()
+        self.series = {}
+
+    def inc(self, value: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + value
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in sorted(self.series.items()):
+                lines.append(f"{self.name}{format_labels(key)} {value}")
+        return "\n".join(lines)
+
+
+def format_labels(labels: Tuple) -> str:
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+stage_latency = Histogram("nl2sql_stage_latency_seconds", "Latency of each pipeline stage",
+                          tracing_config.get("buckets", (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)))
+stage_errors = Counter("nl2sql_stage_errors_total", "Pipeline stages that raised")
+llm_tokens = Counter("nl2sql_llm_tokens_total", "Tokens reported in the vLLM usage field")
+llm_calls = Counter("nl2sql_llm_calls_total", "Requests sent to the vLLM endpoint")
+sql_rows = Counter("nl2sql_sql_rows_total", "Rows returned by executed SQL")
+cache_lookups = Counter("nl2sql_cache_lookups_total", "Result cache lookups")
+METRICS = [stage_latency, stage_errors, llm_calls, llm_tokens, sql_rows, cache_lookups]
+
+
+def render_metrics() -> str:
+    """Prometheus 文本格式"""
+    return "\n".join(metric.render() for metric in METRICS) + "\n"
+
+
+def setup_trace_logger(log_file: str) -> logging.Logger:
+    logger = logging.getLogger("nl2sql.trace")
+    if not logger.handlers:
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        file_handler = logging.FileHandler(log_file, encoding="utf-8", delay=True)
+        file_handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(file_handler)
+    return logger
+
+
+trace_logger = setup_trace_logger(tracing_config.get("log_file", "trace.log"))
+# 每个 span 结束时回调，基准测试和评估用来收集各阶段耗时
+span_listeners = []
+
+
+class Span:
+    def __init__(self, name: str, trace_id: str, parent: Optional["Span"], attributes: Dict):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attributes = attributes
+        self.start = time.time()
+        self.duration = None
+        self.error = None
+
+    def set(self, key: str, value):
+        self.attributes[key] = value
+
+    def add(self, key: str, value: float = 1):
+        self.attributes[key] = self.attributes.get(key, 0) + value
+
+    def to_dict(self) -> Dict:
+        record = {"trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id, "name": self.name,
+                  "start": round(self.start, 6), "duration_ms": round(self.duration * 1000, 3)}
+        if self.error is not None:
+            record["error"] = self.error
+        record.update(self.attributes)
+        return record
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex
+
+
+def trace_id() -> Optional[str]:
+    return current_trace.get()
+
+
+@contextmanager
+def start_trace(trace_id: str = None):
+    """开始一次请求范围的追踪，期间产生的 span 都带上同一个 trace_id"""
+    token = current_trace.set(trace_id or new_trace_id())
+    try:
+        yield current_trace.get()
+    finally:
+        current_trace.reset(token)
+
+
+def restore(var: contextvars.ContextVar, token: contextvars.Token):
+    # 生成器中的 span 可能在其他上下文中被关闭，此时无法 reset，直接恢复旧值
+    try:
+        var.reset(token)
+    except ValueError:
+        var.set(None if token.old_value is contextvars.Token.MISSING else token.old_value)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """记录一个阶段的耗时和属性，结束时写一行 JSON 日志并计入延迟直方图
+
+    不在追踪范围内调用时自动生成新的 trace_id。
+    """
+    if not tracing_config.get("enabled", True):
+        yield Span(name, "", None, attributes)
+        return
+    trace_token = None
+    if current_trace.get() is None:
+        trace_token = current_trace.set(new_trace_id())
+    item = Span(name, current_trace.get(), current_span.get(), attributes)
+    span_token = current_span.set(item)
+    started = time.perf_counter()
+    try:
+        yield item
+    except GeneratorExit:
+        # 流式调用方提前停止迭代
+        item.set("aborted", True)
+        raise
+    except BaseException as e:
+        item.error = f"{type(e).__name__}: {e}"
+        stage_errors.inc(stage=name)
+        raise
+    finally:
+        item.duration = time.perf_counter() - started
+        restore(current_span, span_token)
+        if trace_token is not None:
+            restore(current_trace, trace_token)
+        stage_latency.observe(item.duration, stage=name)
+        trace_logger.info(json.dumps(item.to_dict(), ensure_ascii=False, default=str))
+        for listener in span_listeners:
+            listener(item)
+
+
+def annotate(key: str, value):
+    """给当前 span 设置属性，不在 span 内时忽略"""
+    item = current_span.get()
+    if item is not None:
+        item.set(key, value)
+
+
+def record_llm_call():
+    item = current_span.get()
+    llm_calls.inc(stage=item.name if item is not None else "unknown")
+    if item is not None:
+        item.add("llm_calls")
+
+
+def record_usage(usage: Optional[Dict]):
+    """记录 vLLM 返回的 usage 字段"""
+    if not usage:
+        return
+    item = current_span.get()
+    for field, kind in (("prompt_tokens", "prompt"), ("completion_tokens", "completion")):
+        tokens = usage.get(field) or 0
+        stage = item.name if item is not None else "unknown"
+        llm_tokens.inc(tokens, type=kind, stage=stage)
+        if item is not None:
+            item.add(field, tokens)
+
+
+class TraceCollector:
+    """收集 span，按 trace 汇总每个问题的耗时、大模型调用次数和 token 数"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.spans = []
+
+    def __enter__(self):
+        span_listeners.append(self.collect)
+        return self
+
+    def __exit__(self, *exc):
+        span_listeners.remove(self.collect)
+
+    def collect(self, item: Span):
+        with self.lock:
+            self.spans.append(item)
+
+    def durations(self) -> Dict[str, list]:
+        """阶段名 -> 耗时列表(秒)"""
+        result = {}
+        for item in self.spans:
+            result.setdefault(item.name, []).append(item.duration)
+        return result
+
+    def summary(self, trace_id: str) -> Dict:
+        spans = [s for s in self.spans if s.trace_id == trace_id]
+        return {
+            "llm_calls": sum(s.attributes.get("llm_calls", 0) for s in spans),
+            "prompt_tokens": sum(s.attributes.get("prompt_tokens", 0) for s in spans),
+            "completion_tokens": sum(s.attributes.get("completion_tokens", 0) for s in spans),
+            "sql_attempts": sum(1 for s in spans if s.name == "sql_attempt"),
+            "stages": {s.name: s.duration for s in spans},
+        }
+
+
+def percentile(values: Iterable[float], q: float) -> float:
+    """最近秩法的分位数，q 取 0-100"""
+    values = sorted(values)
+    if not values:
+        return 0.0
+    rank = max(1, int(-(-q * len(values) // 100)))
+    return values[min(rank, len(values)) - 1]